@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Backfill precomputed match keys on existing RSHD items
+
+Items posted before match keys were stored at post time are matched by
+deriving the keys on the fly. This one-off migration stores them on every
+item that is missing them so matching, search and analytics read them directly.
+
+Usage:
+    python backfill_match_keys.py
+"""
+
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+import os
+from dotenv import load_dotenv
+from pathlib import Path
+
+from categorization_service import build_match_keys
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+BATCH_SIZE = 500
+
+async def backfill_match_keys():
+    mongo_url = os.environ['MONGO_URL']
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[os.environ['DB_NAME']]
+
+    cursor = db.rshd_items.find(
+        {"match_keys": {"$exists": False}},
+        {"_id": 0, "id": 1, "name": 1, "attributes": 1}
+    )
+
+    updated = 0
+    batch = []
+    async for item in cursor:
+        batch.append(UpdateOne(
+            {"id": item["id"]},
+            {"$set": {"match_keys": build_match_keys(item["name"], item.get("attributes"))}}
+        ))
+        if len(batch) >= BATCH_SIZE:
+            result = await db.rshd_items.bulk_write(batch, ordered=False)
+            updated += result.modified_count
+            batch = []
+
+    if batch:
+        result = await db.rshd_items.bulk_write(batch, ordered=False)
+        updated += result.modified_count
+
+    await db.rshd_items.create_index([("match_keys.tokens", 1)])
+
+    print(f"Backfilled match keys on {updated} RSHD items")
+
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(backfill_match_keys())
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Backfill the retailer_live flag on existing RSHD items
+
+Consumer listings filter on retailer_live, which is set when an item is
+posted and re-synced on every retailer status transition. Items posted
+before the flag existed are served through a slower fallback until this
+one-off migration has stamped them.
+
+Usage:
+    python backfill_retailer_live.py
+"""
+
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+import os
+from dotenv import load_dotenv
+from pathlib import Path
+
+from live_retailer_service import live_retailer_query, ensure_live_retailer_indexes
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+async def backfill_retailer_live():
+    mongo_url = os.environ['MONGO_URL']
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[os.environ['DB_NAME']]
+
+    retailers = await db.users.find(live_retailer_query(), {"_id": 0, "id": 1}).to_list(None)
+    live_ids = [r["id"] for r in retailers]
+
+    live = await db.rshd_items.update_many(
+        {"drlp_id": {"$in": live_ids}, "retailer_live": {"$ne": True}},
+        {"$set": {"retailer_live": True}}
+    )
+    hidden = await db.rshd_items.update_many(
+        {"drlp_id": {"$nin": live_ids}, "retailer_live": {"$ne": False}},
+        {"$set": {"retailer_live": False}}
+    )
+
+    await ensure_live_retailer_indexes(db)
+
+    print(f"Live retailers: {len(live_ids)}")
+    print(f"Flagged {live.modified_count} items live and {hidden.modified_count} items hidden")
+
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(backfill_retailer_live())
@@ -0,0 +1,261 @@
+"""
+Barcode Product Cache for DealShaq
+- In-process LRU in front of the `barcode_products` MongoDB collection
+- Found products cached with a TTL and refreshed in the background once stale
+- "Not found" results cached for a shorter TTL
+- Only genuine lookups are cached; timeouts and API errors always go back to the network
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, List, Optional, AsyncIterator
+
+from cachetools import LRUCache
+
+from barcode_ocr_service import lookup_barcode
+
+logger = logging.getLogger(__name__)
+
+# Cache policy
+FOUND_TTL = timedelta(days=7)  # Fresh window for found products
+FOUND_MAX_STALE = timedelta(days=30)  # Served stale (with background refresh) up to this age
+NOT_FOUND_TTL = timedelta(hours=12)  # Negative results expire quickly
+MEMORY_CACHE_SIZE = 5000
+WARM_CONCURRENCY = 8
+BATCH_CONCURRENCY = 8
+
+
+def _as_utc(value: datetime) -> datetime:
+    """Motor returns naive UTC datetimes - normalize for comparisons."""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class BarcodeProductCache:
+    """
+    Two-tier barcode product cache.
+
+    - Tier 1: in-process LRU (per worker), no I/O
+    - Tier 2: `barcode_products` collection shared by all workers
+    - Stale found entries are returned immediately while a refresh runs in the background
+    """
+
+    def __init__(self, maxsize: int = MEMORY_CACHE_SIZE):
+        self._memory: LRUCache = LRUCache(maxsize=maxsize)
+        self._refreshing: set = set()
+        self._background_tasks: set = set()
+        self.stats = {
+            "memory_hits": 0,
+            "db_hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "stale_refreshes": 0,
+        }
+
+    async def get_cached(self, db, barcode: str) -> Optional[Dict[str, Any]]:
+        """Return a cached lookup result without touching the network, or None on a miss."""
+        tier = "memory_hits"
+        entry = self._memory.get(barcode)
+        if entry is None:
+            tier = "db_hits"
+            entry = await db.barcode_products.find_one({"barcode": barcode}, {"_id": 0})
+
+        return self._serve(db, barcode, entry, tier)
+
+    async def get_cached_many(self, db, barcodes: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Resolve many barcodes from cache with at most one database round trip."""
+        results = {}
+        db_candidates = []
+        for barcode in barcodes:
+            entry = self._memory.get(barcode)
+            if entry is None:
+                db_candidates.append(barcode)
+                continue
+            result = self._serve(db, barcode, entry, "memory_hits")
+            if result is not None:
+                results[barcode] = result
+            else:
+                db_candidates.append(barcode)
+
+        if db_candidates:
+            entries = await db.barcode_products.find(
+                {"barcode": {"$in": db_candidates}}, {"_id": 0}
+            ).to_list(len(db_candidates))
+            for entry in entries:
+                result = self._serve(db, entry["barcode"], entry, "db_hits")
+                if result is not None:
+                    results[entry["barcode"]] = result
+
+        return results
+
+    def _serve(self, db, barcode: str, entry: Optional[Dict[str, Any]], tier: str) -> Optional[Dict[str, Any]]:
+        """Apply the TTL policy to a cache entry and return its result, or None if unusable."""
+        if entry is None:
+            return None
+
+        age = datetime.now(timezone.utc) - _as_utc(entry["fetched_at"])
+        max_age = FOUND_MAX_STALE if entry["found"] else NOT_FOUND_TTL
+        if age > max_age:
+            self._memory.pop(barcode, None)
+            return None
+
+        self._memory[barcode] = entry
+        self.stats[tier] += 1
+        if not entry["found"]:
+            self.stats["negative_hits"] += 1
+        elif age > FOUND_TTL:
+            self._schedule_refresh(db, barcode)
+
+        return {**entry["result"], "cached": True}
+
+    async def fetch_and_store(self, db, barcode: str) -> Dict[str, Any]:
+        """Look the barcode up upstream and cache genuine found / not-found answers."""
+        result = await lookup_barcode(barcode)
+
+        if result.get("success") or result.get("not_found"):
+            now = datetime.now(timezone.utc)
+            found = bool(result.get("success"))
+            entry = {
+                "barcode": barcode,
+                "found": found,
+                "result": result,
+                "fetched_at": now,
+                # TTL index purges entries once they can no longer be served
+                "purge_at": now + (FOUND_MAX_STALE if found else NOT_FOUND_TTL),
+            }
+            self._memory[barcode] = entry
+            await db.barcode_products.update_one(
+                {"barcode": barcode},
+                {"$set": entry},
+                upsert=True
+            )
+
+        return {**result, "cached": False}
+
+    async def lookup(self, db, barcode: str) -> Dict[str, Any]:
+        """Cache-first barcode lookup."""
+        cached = await self.get_cached(db, barcode)
+        if cached is not None:
+            return cached
+
+        self.stats["misses"] += 1
+        return await self.fetch_and_store(db, barcode)
+
+    async def warm(self, db, barcodes: List[str], concurrency: int = WARM_CONCURRENCY) -> Dict[str, int]:
+        """Bulk-populate the cache for barcodes that are not already cached."""
+        semaphore = asyncio.Semaphore(concurrency)
+        summary = {"requested": len(barcodes), "already_cached": 0, "found": 0, "not_found": 0, "errors": 0}
+
+        async def warm_one(barcode: str):
+            if await self.get_cached(db, barcode) is not None:
+                summary["already_cached"] += 1
+                return
+            async with semaphore:
+                result = await self.fetch_and_store(db, barcode)
+            if result.get("success"):
+                summary["found"] += 1
+            elif result.get("not_found"):
+                summary["not_found"] += 1
+            else:
+                summary["errors"] += 1
+
+        await asyncio.gather(*(warm_one(barcode) for barcode in barcodes))
+        logger.info(f"Barcode cache warm complete: {summary}")
+        return summary
+
+    async def lookup_many(self, db, barcodes: List[str], concurrency: int = BATCH_CONCURRENCY) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Resolve a batch of barcodes, yielding one status line per unique barcode.
+
+        Cached results are yielded first; misses are fetched concurrently under a
+        semaphore and yielded as they complete, so cost scales with unique misses.
+        """
+        unique = list(dict.fromkeys(barcodes))
+        cached = await self.get_cached_many(db, unique)
+
+        for barcode in unique:
+            if barcode in cached:
+                yield _batch_line(barcode, cached[barcode])
+
+        misses = [barcode for barcode in unique if barcode not in cached]
+        self.stats["misses"] += len(misses)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(barcode: str):
+            async with semaphore:
+                try:
+                    return barcode, await self.fetch_and_store(db, barcode)
+                except Exception as e:
+                    logger.error(f"Batch lookup failed for barcode {barcode}: {e}")
+                    return barcode, {"success": False, "error": str(e), "cached": False}
+
+        tasks = [asyncio.create_task(fetch(barcode)) for barcode in misses]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                barcode, result = await next_done
+                yield _batch_line(barcode, result)
+        finally:
+            # Client went away mid-stream - don't keep fetching for nobody
+            for task in tasks:
+                task.cancel()
+
+    def _schedule_refresh(self, db, barcode: str):
+        """Refresh a stale entry in the background (at most one refresh per barcode)."""
+        if barcode in self._refreshing:
+            return
+        self._refreshing.add(barcode)
+        self.stats["stale_refreshes"] += 1
+
+        async def refresh():
+            try:
+                await self.fetch_and_store(db, barcode)
+            except Exception as e:
+                logger.error(f"Background refresh failed for barcode {barcode}: {e}")
+            finally:
+                self._refreshing.discard(barcode)
+
+        task = asyncio.create_task(refresh())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current memory tier size."""
+        hits = self.stats["memory_hits"] + self.stats["db_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "memory_entries": len(self._memory),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def _batch_line(barcode: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    """Per-item status record for batch lookups."""
+    if result.get("success"):
+        status = "found"
+    elif result.get("not_found"):
+        status = "not_found"
+    else:
+        status = "error"
+
+    line = {"barcode": barcode, "status": status, "cached": result.get("cached", False)}
+    if status == "found":
+        line["product"] = result["product"]
+    elif status == "error":
+        line["error"] = result.get("error", "Lookup failed")
+    return line
+
+
+async def ensure_barcode_cache_indexes(db):
+    """Unique barcode key plus TTL purge of entries that can no longer be served."""
+    await db.barcode_products.create_index("barcode", unique=True)
+    await db.barcode_products.create_index("purge_at", expireAfterSeconds=0)
+
+
+def normalize_barcode(barcode: str) -> str:
+    """Canonical cache key for a scanned barcode."""
+    return barcode.strip()
+
+
+# Global cache instance
+barcode_cache = BarcodeProductCache()
@@ -0,0 +1,169 @@
+"""
+Offline Barcode Index for DealShaq
+- Compact, memory-mapped product index keyed by barcode
+- Built from an Open Food Facts dump by import_off_dump.py
+- Consulted by lookup_barcode before going to the network
+- Loaded once per API worker; restart the workers after an import to pick it up
+
+File layout (little-endian):
+    header   MAGIC (8 bytes) | entry count (uint64)
+    entries  count x (barcode uint64, record offset uint64, record length uint32), sorted by barcode
+    records  compact UTF-8 JSON product records, referenced by the entries
+"""
+
+import os
+import json
+import mmap
+import struct
+import shutil
+import logging
+import tempfile
+from array import array
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = Path(__file__).parent
+DEFAULT_INDEX_PATH = ROOT_DIR / "data" / "off_barcode_index.bin"
+
+MAGIC = b"DSQBIDX1"
+HEADER = struct.Struct("<8sQ")
+ENTRY = struct.Struct("<QQI")
+
+# Product fields kept in the index (ingredients and raw OFF text are dropped to stay compact)
+INDEX_FIELDS = ("name", "brand", "category", "weight", "description", "image_url", "nutriscore", "is_organic")
+
+
+def barcode_key(barcode: str) -> Optional[int]:
+    """
+    Numeric index key for a barcode.
+
+    Leading zeros are not significant, so UPC-A / EAN-13 / GTIN-14 spellings of
+    the same code share one key. Non-numeric or over-long codes are not indexable.
+    """
+    barcode = barcode.strip()
+    if not barcode.isdigit() or len(barcode) > 19:
+        return None
+    return int(barcode)
+
+
+class BarcodeIndexWriter:
+    """
+    Streams product records into a new index file.
+
+    Records are spooled to a temporary file as they arrive; only the fixed-size
+    key table is held in memory. The finished index replaces `path` atomically.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._records = tempfile.TemporaryFile(dir=self.path.parent)
+        self._keys = array("Q")
+        self._offsets = array("Q")
+        self._lengths = array("I")
+        self._size = 0
+
+    def add(self, barcode: str, product: Dict[str, Any]) -> bool:
+        """Append one product. Returns False if the barcode cannot be indexed."""
+        key = barcode_key(barcode)
+        if key is None:
+            return False
+
+        record = json.dumps(
+            {field: product.get(field) for field in INDEX_FIELDS},
+            separators=(",", ":"),
+            ensure_ascii=False
+        ).encode("utf-8")
+
+        self._records.write(record)
+        self._keys.append(key)
+        self._offsets.append(self._size)
+        self._lengths.append(len(record))
+        self._size += len(record)
+        return True
+
+    def close(self) -> int:
+        """Sort the key table, write the index file and return the number of entries."""
+        # Stable sort keeps dump order within a key; the last occurrence of a barcode wins
+        order = sorted(range(len(self._keys)), key=self._keys.__getitem__)
+        unique = [
+            i for position, i in enumerate(order)
+            if position + 1 == len(order) or self._keys[order[position + 1]] != self._keys[i]
+        ]
+
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "wb") as out:
+            out.write(HEADER.pack(MAGIC, len(unique)))
+            for i in unique:
+                out.write(ENTRY.pack(self._keys[i], self._offsets[i], self._lengths[i]))
+            self._records.seek(0)
+            shutil.copyfileobj(self._records, out)
+
+        self._records.close()
+        os.replace(tmp_path, self.path)
+        return len(unique)
+
+
+class BarcodeIndex:
+    """Read-only, memory-mapped barcode index with binary-search lookups."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{self.path} is not a DealShaq barcode index")
+
+        self._records_start = HEADER.size + self.count * ENTRY.size
+
+    def get(self, barcode: str) -> Optional[Dict[str, Any]]:
+        """Return the indexed product for a barcode, or None."""
+        key = barcode_key(barcode)
+        if key is None:
+            return None
+
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            mid_key, offset, length = ENTRY.unpack_from(self._mmap, HEADER.size + mid * ENTRY.size)
+            if mid_key < key:
+                low = mid + 1
+            elif mid_key > key:
+                high = mid
+            else:
+                start = self._records_start + offset
+                product = json.loads(self._mmap[start:start + length])
+                return {
+                    **product,
+                    "barcode": barcode,
+                    "ingredients": "",
+                    "raw_data": {}
+                }
+        return None
+
+    def close(self):
+        self._mmap.close()
+
+
+_index: Optional[BarcodeIndex] = None
+_index_checked = False
+
+
+def get_barcode_index() -> Optional[BarcodeIndex]:
+    """Return the process-wide offline index, or None if no index has been built."""
+    global _index, _index_checked
+    if not _index_checked:
+        _index_checked = True
+        path = Path(os.environ.get("OFF_INDEX_PATH", DEFAULT_INDEX_PATH))
+        if path.exists():
+            try:
+                _index = BarcodeIndex(path)
+                logger.info(f"Loaded offline barcode index {path} ({_index.count} products)")
+            except Exception as e:
+                logger.error(f"Failed to load offline barcode index {path}: {e}")
+    return _index
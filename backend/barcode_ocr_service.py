@@ -5,16 +5,62 @@ Barcode and OCR Service for DealShaq
 """
 
 import os
+import re
 import httpx
 import base64
 import logging
+import importlib.util
 from typing import Optional, Dict, Any
 
+from barcode_index_service import get_barcode_index
+from llm_gateway_service import llm_gateway, LLMUnavailableError
+
 logger = logging.getLogger(__name__)
 
 # Open Food Facts API endpoint
 OPEN_FOOD_FACTS_API = "https://world.openfoodfacts.org/api/v2/product"
 
+# Shared HTTP client settings - one pooled, keep-alive client per process
+HTTP_TIMEOUT = httpx.Timeout(connect=3.0, read=8.0, write=5.0, pool=2.0)
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0)
+HTTP2_SUPPORTED = importlib.util.find_spec("h2") is not None
+
+# Vision model used for OCR and product analysis (calls go through llm_gateway)
+VISION_MODEL = "gpt-4o"
+VISION_TIMEOUT = 45.0  # seconds per attempt
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+async def init_http_client() -> httpx.AsyncClient:
+    """Create the shared HTTP client (called on application startup)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=HTTP_LIMITS,
+            http2=HTTP2_SUPPORTED,
+            headers={"User-Agent": "DealShaq/1.0 (https://dealshaq.com)"}
+        )
+        logger.info(f"Shared HTTP client started (http2={HTTP2_SUPPORTED})")
+    return _http_client
+
+
+async def close_http_client():
+    """Close the shared HTTP client (called on application shutdown)."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+        logger.info("Shared HTTP client closed")
+
+
+async def get_http_client() -> httpx.AsyncClient:
+    """Return the shared HTTP client, creating it lazily outside the app lifecycle."""
+    if _http_client is None or _http_client.is_closed:
+        return await init_http_client()
+    return _http_client
+
 
 async def lookup_barcode(barcode: str) -> Dict[str, Any]:
     """
@@ -26,45 +72,38 @@ async def lookup_barcode(barcode: str) -> Dict[str, Any]:
     Returns:
         Dict with product info or error message
     """
+    # Offline Open Food Facts index (built by import_off_dump.py) is consulted first
+    barcode_index = get_barcode_index()
+    if barcode_index is not None:
+        product = barcode_index.get(barcode)
+        if product is not None:
+            return {"success": True, "product": product, "source": "offline_index"}
+    
     url = f"{OPEN_FOOD_FACTS_API}/{barcode}.json"
     
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(url, params={'lc': 'en'})
+        client = await get_http_client()
+        response = await client.get(url, params={'lc': 'en'})
+        # OFF v2 answers unknown barcodes with a 404 (body status 0); that is a result, not an error
+        if response.status_code == 404:
+            data = {}
+        else:
             response.raise_for_status()
             data = response.json()
+        
+        if data.get('status') == 1 and data.get('product'):
+            return {
+                "success": True,
+                "product": map_product(data['product'], barcode)
+            }
+        else:
+            return {
+                "success": False,
+                "error": "Product not found in database",
+                "not_found": True,
+                "barcode": barcode
+            }
             
-            if data.get('status') == 1 and data.get('product'):
-                product = data['product']
-                
-                # Map to DealShaq item format
-                return {
-                    "success": True,
-                    "product": {
-                        "name": product.get('product_name', product.get('product_name_en', '')),
-                        "brand": product.get('brands', ''),
-                        "category": map_category(product.get('categories_tags', [])),
-                        "barcode": barcode,
-                        "weight": extract_weight(product),
-                        "description": product.get('generic_name', ''),
-                        "image_url": product.get('image_front_url', ''),
-                        "ingredients": product.get('ingredients_text_en', product.get('ingredients_text', '')),
-                        "nutriscore": product.get('nutriscore_grade', ''),
-                        "is_organic": 'en:organic' in product.get('labels_tags', []),
-                        "raw_data": {
-                            "categories": product.get('categories', ''),
-                            "labels": product.get('labels', ''),
-                            "quantity": product.get('quantity', ''),
-                        }
-                    }
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": "Product not found in database",
-                    "barcode": barcode
-                }
-                
     except httpx.TimeoutException:
         logger.error(f"Timeout looking up barcode {barcode}")
         return {"success": False, "error": "Request timed out"}
@@ -76,88 +115,154 @@ async def lookup_barcode(barcode: str) -> Dict[str, Any]:
         return {"success": False, "error": str(e)}
 
 
+def map_product(product: Dict, barcode: str) -> Dict[str, Any]:
+    """Map an Open Food Facts product record to DealShaq item format"""
+    return {
+        "name": product.get('product_name', product.get('product_name_en', '')),
+        "brand": product.get('brands', ''),
+        "category": map_category(product.get('categories_tags', [])),
+        "barcode": barcode,
+        "weight": extract_weight(product),
+        "description": product.get('generic_name', ''),
+        "image_url": product.get('image_front_url', ''),
+        "ingredients": product.get('ingredients_text_en', product.get('ingredients_text', '')),
+        "nutriscore": product.get('nutriscore_grade', ''),
+        "is_organic": 'en:organic' in product.get('labels_tags', []),
+        "raw_data": {
+            "categories": product.get('categories', ''),
+            "labels": product.get('labels', ''),
+            "quantity": product.get('quantity', ''),
+        }
+    }
+
+
+# DealShaq valid categories
+VALID_CATEGORIES = [
+    "Fruits", "Vegetables", "Meat & Poultry", "Seafood",
+    "Dairy & Eggs", "Bakery & Bread", "Pantry Staples",
+    "Snacks & Candy", "Frozen Foods", "Beverages",
+    "Deli & Prepared Foods", "Breakfast & Cereal",
+    "Pasta, Rice & Grains", "Oils, Sauces & Spices",
+    "Baby & Kids", "Health & Nutrition", "Household Essentials",
+    "Personal Care", "Pet Supplies", "Miscellaneous"
+]
+
+# Category mapping from Open Food Facts tag fragments to DealShaq, in priority order
+CATEGORY_TAG_MAP = {
+    'fruits': 'Fruits',
+    'vegetables': 'Vegetables',
+    'meat': 'Meat & Poultry',
+    'poultry': 'Meat & Poultry',
+    'beef': 'Meat & Poultry',
+    'pork': 'Meat & Poultry',
+    'chicken': 'Meat & Poultry',
+    'fish': 'Seafood',
+    'seafood': 'Seafood',
+    'dairy': 'Dairy & Eggs',
+    'milk': 'Dairy & Eggs',
+    'cheese': 'Dairy & Eggs',
+    'yogurt': 'Dairy & Eggs',
+    'eggs': 'Dairy & Eggs',
+    'bread': 'Bakery & Bread',
+    'bakery': 'Bakery & Bread',
+    'pastries': 'Bakery & Bread',
+    'snacks': 'Snacks & Candy',
+    'candy': 'Snacks & Candy',
+    'chocolate': 'Snacks & Candy',
+    'chips': 'Snacks & Candy',
+    'frozen': 'Frozen Foods',
+    'ice-cream': 'Frozen Foods',
+    'beverages': 'Beverages',
+    'drinks': 'Beverages',
+    'juice': 'Beverages',
+    'soda': 'Beverages',
+    'water': 'Beverages',
+    'coffee': 'Beverages',
+    'tea': 'Beverages',
+    'deli': 'Deli & Prepared Foods',
+    'prepared': 'Deli & Prepared Foods',
+    'ready-to-eat': 'Deli & Prepared Foods',
+    'cereal': 'Breakfast & Cereal',
+    'breakfast': 'Breakfast & Cereal',
+    'oatmeal': 'Breakfast & Cereal',
+    'pasta': 'Pasta, Rice & Grains',
+    'rice': 'Pasta, Rice & Grains',
+    'grains': 'Pasta, Rice & Grains',
+    'noodles': 'Pasta, Rice & Grains',
+    'oil': 'Oils, Sauces & Spices',
+    'sauce': 'Oils, Sauces & Spices',
+    'spice': 'Oils, Sauces & Spices',
+    'condiment': 'Oils, Sauces & Spices',
+    'baby': 'Baby & Kids',
+    'infant': 'Baby & Kids',
+    'health': 'Health & Nutrition',
+    'vitamin': 'Health & Nutrition',
+    'supplement': 'Health & Nutrition',
+    'cleaning': 'Household Essentials',
+    'household': 'Household Essentials',
+    'personal-care': 'Personal Care',
+    'hygiene': 'Personal Care',
+    'pet': 'Pet Supplies',
+    'dog': 'Pet Supplies',
+    'cat': 'Pet Supplies',
+}
+
+# Compiled once at import: a lookahead alternation finds every fragment occurrence
+# (including overlapping ones) in a single scan; alternatives are listed in priority
+# order so the highest-priority fragment starting at each position wins.
+_CATEGORY_TAG_KEYS = list(CATEGORY_TAG_MAP)
+_CATEGORY_TAG_PRIORITY = {key: priority for priority, key in enumerate(_CATEGORY_TAG_KEYS)}
+_CATEGORY_TAG_PATTERN = re.compile("(?=(" + "|".join(re.escape(key) for key in _CATEGORY_TAG_KEYS) + "))")
+_TAG_SEPARATOR = "\n"
+
+
 def map_category(category_tags: list) -> str:
-    """Map Open Food Facts categories to DealShaq categories"""
+    """Map Open Food Facts categories to DealShaq categories
     
-    # DealShaq valid categories
-    VALID_CATEGORIES = [
-        "Fruits", "Vegetables", "Meat & Poultry", "Seafood",
-        "Dairy & Eggs", "Bakery & Bread", "Pantry Staples",
-        "Snacks & Candy", "Frozen Foods", "Beverages",
-        "Deli & Prepared Foods", "Breakfast & Cereal",
-        "Pasta, Rice & Grains", "Oils, Sauces & Spices",
-        "Baby & Kids", "Health & Nutrition", "Household Essentials",
-        "Personal Care", "Pet Supplies", "Miscellaneous"
-    ]
+    Resolves the whole tag list in one regex pass. Priority is deterministic:
+    the first tag containing any known fragment decides, and within that tag the
+    fragment listed earliest in CATEGORY_TAG_MAP wins.
+    """
+    if not category_tags:
+        return "Miscellaneous"
     
-    # Category mapping from Open Food Facts to DealShaq
-    category_map = {
-        'fruits': 'Fruits',
-        'vegetables': 'Vegetables',
-        'meat': 'Meat & Poultry',
-        'poultry': 'Meat & Poultry',
-        'beef': 'Meat & Poultry',
-        'pork': 'Meat & Poultry',
-        'chicken': 'Meat & Poultry',
-        'fish': 'Seafood',
-        'seafood': 'Seafood',
-        'dairy': 'Dairy & Eggs',
-        'milk': 'Dairy & Eggs',
-        'cheese': 'Dairy & Eggs',
-        'yogurt': 'Dairy & Eggs',
-        'eggs': 'Dairy & Eggs',
-        'bread': 'Bakery & Bread',
-        'bakery': 'Bakery & Bread',
-        'pastries': 'Bakery & Bread',
-        'snacks': 'Snacks & Candy',
-        'candy': 'Snacks & Candy',
-        'chocolate': 'Snacks & Candy',
-        'chips': 'Snacks & Candy',
-        'frozen': 'Frozen Foods',
-        'ice-cream': 'Frozen Foods',
-        'beverages': 'Beverages',
-        'drinks': 'Beverages',
-        'juice': 'Beverages',
-        'soda': 'Beverages',
-        'water': 'Beverages',
-        'coffee': 'Beverages',
-        'tea': 'Beverages',
-        'deli': 'Deli & Prepared Foods',
-        'prepared': 'Deli & Prepared Foods',
-        'ready-to-eat': 'Deli & Prepared Foods',
-        'cereal': 'Breakfast & Cereal',
-        'breakfast': 'Breakfast & Cereal',
-        'oatmeal': 'Breakfast & Cereal',
-        'pasta': 'Pasta, Rice & Grains',
-        'rice': 'Pasta, Rice & Grains',
-        'grains': 'Pasta, Rice & Grains',
-        'noodles': 'Pasta, Rice & Grains',
-        'oil': 'Oils, Sauces & Spices',
-        'sauce': 'Oils, Sauces & Spices',
-        'spice': 'Oils, Sauces & Spices',
-        'condiment': 'Oils, Sauces & Spices',
-        'baby': 'Baby & Kids',
-        'infant': 'Baby & Kids',
-        'health': 'Health & Nutrition',
-        'vitamin': 'Health & Nutrition',
-        'supplement': 'Health & Nutrition',
-        'cleaning': 'Household Essentials',
-        'household': 'Household Essentials',
-        'personal-care': 'Personal Care',
-        'hygiene': 'Personal Care',
-        'pet': 'Pet Supplies',
-        'dog': 'Pet Supplies',
-        'cat': 'Pet Supplies',
-    }
+    text = _TAG_SEPARATOR.join(tag.lower().replace('en:', '') for tag in category_tags)
     
-    # Search for matching category
-    for tag in category_tags:
-        tag_lower = tag.lower().replace('en:', '')
-        for key, value in category_map.items():
-            if key in tag_lower:
-                return value
+    best_priority = None
+    tag_end = -1
+    for match in _CATEGORY_TAG_PATTERN.finditer(text):
+        position = match.start()
+        if best_priority is None:
+            # First tag with a match decides - only scan the rest of this tag
+            tag_end = text.find(_TAG_SEPARATOR, position)
+            if tag_end == -1:
+                tag_end = len(text)
+        elif position >= tag_end:
+            break
+        
+        priority = _CATEGORY_TAG_PRIORITY[match.group(1)]
+        if best_priority is None or priority < best_priority:
+            best_priority = priority
     
-    return "Miscellaneous"
+    if best_priority is None:
+        return "Miscellaneous"
+    return CATEGORY_TAG_MAP[_CATEGORY_TAG_KEYS[best_priority]]
+
+
+def normalize_category(category: Optional[str]) -> str:
+    """Coerce a free-text category (e.g., from image analysis) onto the DealShaq taxonomy"""
+    if not category:
+        return "Miscellaneous"
+    if category in VALID_CATEGORIES:
+        return category
+    
+    # Tolerate punctuation/case drift such as "Pasta Rice & Grains"
+    folded = re.sub(r'[^a-z&]', '', category.lower())
+    for valid in VALID_CATEGORIES:
+        if re.sub(r'[^a-z&]', '', valid.lower()) == folded:
+            return valid
+    
+    return map_category([category.replace(' ', '-')])
 
 
 def extract_weight(product: Dict) -> Optional[float]:
@@ -194,7 +299,8 @@ async def extract_text_from_image(image_base64: str, prompt: str = None) -> Dict
     Extract text/information from image using OpenAI GPT-4 Vision.
     
     Args:
-        image_base64: Base64 encoded image (JPEG, PNG, or WEBP) - raw base64 without data URI prefix
+        image_base64: Raw base64 image already checked by validate_base64_image
+            (ocr_cache_service does this before calling)
         prompt: Custom prompt for extraction (default: extract price)
     
     Returns:
@@ -206,24 +312,6 @@ async def extract_text_from_image(image_base64: str, prompt: str = None) -> Dict
     if not api_key:
         return {"success": False, "error": "EMERGENT_LLM_KEY not configured"}
     
-    # Remove data URI prefix if present (e.g., "data:image/jpeg;base64,")
-    if image_base64.startswith('data:'):
-        try:
-            # Extract just the base64 part after the comma
-            image_base64 = image_base64.split(',')[1]
-        except IndexError:
-            return {"success": False, "error": "Invalid data URI format"}
-    
-    # Validate base64 string
-    try:
-        import base64
-        # Test decode to validate
-        decoded = base64.b64decode(image_base64)
-        if len(decoded) < 100:
-            return {"success": False, "error": "Image too small or invalid"}
-    except Exception as e:
-        return {"success": False, "error": f"Invalid base64 encoding: {str(e)}"}
-    
     default_prompt = """Analyze this image of a product price tag or receipt.
 Extract the following information:
 1. Price (the main price shown)
@@ -240,12 +328,12 @@ Return your response in this exact JSON format:
 
 Only return the JSON, no other text."""
 
-    try:
+    async def send():
         chat = LlmChat(
             api_key=api_key,
             session_id=f"ocr-{os.urandom(8).hex()}",
             system_message="You are a helpful assistant that extracts information from images. Always respond with valid JSON."
-        ).with_model("openai", "gpt-4o")
+        ).with_model("openai", VISION_MODEL)
         
         # Create image content with raw base64 (no data URI prefix)
         image_content = ImageContent(image_base64=image_base64)
@@ -255,8 +343,10 @@ Only return the JSON, no other text."""
             text=prompt or default_prompt,
             file_contents=[image_content]
         )
-        
-        response = await chat.send_message(user_message)
+        return await chat.send_message(user_message)
+
+    try:
+        response = await llm_gateway.call(VISION_MODEL, send, timeout=VISION_TIMEOUT)
         
         # Try to parse JSON from response
         import json
@@ -283,6 +373,9 @@ Only return the JSON, no other text."""
                 "raw_response": response
             }
             
+    except LLMUnavailableError as e:
+        logger.warning(f"Vision model unavailable: {e}")
+        return {"success": False, "error": str(e), "unavailable": True}
     except Exception as e:
         logger.error(f"Error extracting text from image: {e}")
         return {"success": False, "error": str(e)}
@@ -293,7 +386,7 @@ async def analyze_product_image(image_base64: str) -> Dict[str, Any]:
     Analyze a product image to extract product information.
     
     Args:
-        image_base64: Base64 encoded image - raw base64 without data URI prefix
+        image_base64: Raw base64 image already checked by validate_base64_image
     
     Returns:
         Dict with product info or error message
@@ -304,22 +397,6 @@ async def analyze_product_image(image_base64: str) -> Dict[str, Any]:
     if not api_key:
         return {"success": False, "error": "EMERGENT_LLM_KEY not configured"}
     
-    # Remove data URI prefix if present
-    if image_base64.startswith('data:'):
-        try:
-            image_base64 = image_base64.split(',')[1]
-        except IndexError:
-            return {"success": False, "error": "Invalid data URI format"}
-    
-    # Validate base64 string
-    try:
-        import base64
-        decoded = base64.b64decode(image_base64)
-        if len(decoded) < 100:
-            return {"success": False, "error": "Image too small or invalid"}
-    except Exception as e:
-        return {"success": False, "error": f"Invalid base64 encoding: {str(e)}"}
-    
     prompt = """Analyze this product image and extract as much information as possible.
 
 Return your response in this exact JSON format:
@@ -334,12 +411,12 @@ Return your response in this exact JSON format:
 
 Only return the JSON, no other text."""
 
-    try:
+    async def send():
         chat = LlmChat(
             api_key=api_key,
             session_id=f"product-{os.urandom(8).hex()}",
             system_message="You are a helpful assistant that identifies products from images. Always respond with valid JSON."
-        ).with_model("openai", "gpt-4o")
+        ).with_model("openai", VISION_MODEL)
         
         image_content = ImageContent(image_base64=image_base64)
         
@@ -347,8 +424,10 @@ Only return the JSON, no other text."""
             text=prompt,
             file_contents=[image_content]
         )
-        
-        response = await chat.send_message(user_message)
+        return await chat.send_message(user_message)
+
+    try:
+        response = await llm_gateway.call(VISION_MODEL, send, timeout=VISION_TIMEOUT)
         
         import json
         try:
@@ -360,6 +439,8 @@ Only return the JSON, no other text."""
             clean_response = clean_response.replace('```json', '').replace('```', '').strip()
             
             extracted_data = json.loads(clean_response)
+            if isinstance(extracted_data, dict):
+                extracted_data["category"] = normalize_category(extracted_data.get("category"))
             return {
                 "success": True,
                 "product": extracted_data,
@@ -372,6 +453,9 @@ Only return the JSON, no other text."""
                 "raw_response": response
             }
             
+    except LLMUnavailableError as e:
+        logger.warning(f"Vision model unavailable: {e}")
+        return {"success": False, "error": str(e), "unavailable": True}
     except Exception as e:
         logger.error(f"Error analyzing product image: {e}")
         return {"success": False, "error": str(e)}
@@ -1,13 +1,18 @@
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 import re
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 import os
 from dotenv import load_dotenv
 import logging
 
+from llm_gateway_service import llm_gateway
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+CATEGORIZATION_MODEL = "gpt-5.1"
+CATEGORIZATION_TIMEOUT = 15.0  # seconds per attempt; item creation waits on this
+
 # Keyword-based categorization dictionary
 CATEGORY_KEYWORDS = {
     "Fruits": ["apple", "banana", "orange", "grape", "berry", "berries", "melon", "watermelon", 
@@ -204,6 +209,26 @@ def detect_attributes(item_name: str) -> Dict[str, bool]:
     return attributes
 
 
+def build_match_keys(item_name: str, attributes: Optional[Dict[str, bool]] = None) -> Dict[str, Any]:
+    """
+    Precompute normalized match features for an RSHD item.
+
+    Stored on the item document at post time so that matching, search and
+    analytics read them directly instead of re-deriving them per comparison.
+    Explicit attributes supplied by the DRLP take precedence over detected ones.
+    """
+    brand_info = parse_brand_and_generic(item_name)
+
+    return {
+        "name_lower": item_name.lower(),
+        "tokens": sorted(set(extract_keywords(item_name))),
+        "attributes": {**detect_attributes(item_name), **(attributes or {})},
+        "brand": brand_info["brand"].lower() if brand_info["brand"] else None,
+        "generic": brand_info["generic"].lower(),
+        "has_brand": brand_info["has_brand"]
+    }
+
+
 def categorize_by_keywords(item_name: str) -> Optional[str]:
     """Categorize item using keyword matching."""
     item_lower = item_name.lower()
@@ -236,22 +261,24 @@ async def categorize_with_ai(item_name: str) -> str:
             logger.error("EMERGENT_LLM_KEY not found in environment")
             return "Miscellaneous"
         
-        # Create LLM chat instance
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"categorization_{item_name}",
-            system_message=f"""You are a grocery categorization expert. 
-            Categorize the given item into EXACTLY ONE of these 20 categories:
-            {', '.join(VALID_CATEGORIES)}
+        async def send():
+            # Fresh chat per attempt so a retry doesn't replay the failed turn
+            chat = LlmChat(
+                api_key=api_key,
+                session_id=f"categorization_{item_name}",
+                system_message=f"""You are a grocery categorization expert. 
+                Categorize the given item into EXACTLY ONE of these 20 categories:
+                {', '.join(VALID_CATEGORIES)}
+                
+                Respond with ONLY the category name, nothing else."""
+            ).with_model("openai", CATEGORIZATION_MODEL)
             
-            Respond with ONLY the category name, nothing else."""
-        ).with_model("openai", "gpt-5.1")
-        
-        user_message = UserMessage(
-            text=f"Categorize this grocery item: '{item_name}'"
-        )
+            user_message = UserMessage(
+                text=f"Categorize this grocery item: '{item_name}'"
+            )
+            return await chat.send_message(user_message)
         
-        response = await chat.send_message(user_message)
+        response = await llm_gateway.call(CATEGORIZATION_MODEL, send, timeout=CATEGORIZATION_TIMEOUT)
         category = response.strip()
         
         # Validate response is a valid category
@@ -0,0 +1,86 @@
+"""
+Conditional GET for DealShaq
+- Polled resources carry a version stamp in `resource_versions`, replaced by every
+  write that changes what the endpoint returns
+- ETag = hash of the stamps plus the request variant (role, query params)
+- A matching If-None-Match is answered 304 before the endpoint's own query runs
+"""
+
+import uuid
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+from pymongo import UpdateOne
+from starlette.requests import Request
+from starlette.responses import Response
+
+import metrics_service
+
+logger = logging.getLogger(__name__)
+
+RSHD_ITEMS = "rshd_items"  # Consumer item listing (all retailers)
+CACHE_CONTROL = "private, no-cache"  # Clients may keep a copy but must revalidate
+
+
+def favorites_key(dac_id: str) -> str:
+    return f"favorites:{dac_id}"
+
+
+def notifications_key(dac_id: str) -> str:
+    return f"notifications:{dac_id}"
+
+
+async def bump_versions(db, *keys: str):
+    """Give each resource a fresh version stamp (one round trip for any number of keys)."""
+    if not keys:
+        return
+    now = datetime.now(timezone.utc)
+    operations = [
+        UpdateOne({"key": key}, {"$set": {"version": uuid.uuid4().hex, "updated_at": now}}, upsert=True)
+        for key in dict.fromkeys(keys)
+    ]
+    await db.resource_versions.bulk_write(operations, ordered=False)
+
+
+async def get_versions(db, keys: List[str]) -> Dict[str, str]:
+    """Current stamps; resources never written since this feature shipped are "0"."""
+    versions = {key: "0" for key in keys}
+    async for doc in db.resource_versions.find({"key": {"$in": keys}}, {"_id": 0, "key": 1, "version": 1}):
+        versions[doc["key"]] = doc["version"]
+    return versions
+
+
+def make_etag(*parts: Any) -> str:
+    # Weak: the same version may be served with different content-encodings
+    digest = hashlib.sha1("\x1f".join(str(part) for part in parts).encode()).hexdigest()[:24]
+    return f'W/"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+
+def conditional_response(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """
+    A 304 response when the client already has this version; otherwise None,
+    after setting the ETag on the response the endpoint is about to return.
+    """
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request, etag):
+        metrics_service.increment("http.not_modified")
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+async def ensure_etag_indexes(db):
+    await db.resource_versions.create_index("key", unique=True)
@@ -0,0 +1,109 @@
+"""
+Deal Expiry for DealShaq
+- RSHD items carry an optional `expiry_date` (ISO string, as entered) and a derived
+  `expires_at` datetime that is indexed together with `status`
+- A scheduled sweep flips expired items from `available` to `expired` in bulk
+- `live_inventory_filter` keeps listing queries from seeing items between sweeps
+"""
+
+import time
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, Optional, Union
+
+from pymongo import UpdateOne
+
+import metrics_service
+from etag_service import bump_versions, RSHD_ITEMS
+
+logger = logging.getLogger(__name__)
+
+STATUS_EXPIRED = "expired"
+SWEEP_JOB_ID = "expire_rshd_items"
+SWEEP_INTERVAL_MINUTES = 5
+SWEEP_HISTORY_RETENTION = timedelta(days=7)
+LEGACY_BACKFILL_BATCH = 500
+
+
+def parse_expiry_date(value: Union[str, datetime, None]) -> Optional[datetime]:
+    """
+    Parse an expiry_date string into an aware UTC datetime.
+
+    A date without a time ("2024-03-25") means the deal runs through the end of
+    that day (UTC). Naive timestamps (and legacy BSON dates, which come back
+    naive) are taken as UTC. Raises ValueError if the string is not ISO-8601;
+    returns None for empty values.
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    value = value.strip()
+    if len(value) == 10:
+        return datetime.fromisoformat(value).replace(tzinfo=timezone.utc) + timedelta(days=1)
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def live_inventory_filter(now: datetime) -> Dict[str, Any]:
+    """Predicate excluding items already past their expiry (missing/None expires_at never expires)."""
+    return {"expires_at": {"$not": {"$lte": now}}}
+
+
+async def backfill_legacy_expiry(db) -> int:
+    """Derive expires_at for available items posted with only an expiry_date string."""
+    cursor = db.rshd_items.find(
+        {"status": "available", "expires_at": {"$exists": False}, "expiry_date": {"$nin": [None, ""]}},
+        {"_id": 0, "id": 1, "expiry_date": 1}
+    )
+    operations = []
+    async for item in cursor:
+        try:
+            expires_at = parse_expiry_date(item["expiry_date"])
+        except (ValueError, TypeError, AttributeError):
+            # Unparseable legacy value (bad string, number, ...): mark as never expiring so it isn't retried every sweep
+            expires_at = None
+        operations.append(UpdateOne({"id": item["id"]}, {"$set": {"expires_at": expires_at}}))
+
+    for i in range(0, len(operations), LEGACY_BACKFILL_BATCH):
+        await db.rshd_items.bulk_write(operations[i:i + LEGACY_BACKFILL_BATCH], ordered=False)
+    return len(operations)
+
+
+async def sweep_expired_items(db) -> Dict[str, Any]:
+    """Flip every available item past its expiry to `expired` and record the sweep in job_runs."""
+    started = time.perf_counter()
+    started_at = datetime.now(timezone.utc)
+
+    backfilled = await backfill_legacy_expiry(db)
+    result = await db.rshd_items.update_many(
+        {"status": "available", "expires_at": {"$lte": started_at}},
+        {"$set": {"status": STATUS_EXPIRED, "expired_at": started_at}}
+    )
+
+    duration = time.perf_counter() - started
+    stats = {"expired": result.modified_count, "legacy_backfilled": backfilled}
+    metrics_service.observe(f"jobs.{SWEEP_JOB_ID}", duration)
+    metrics_service.increment(f"jobs.{SWEEP_JOB_ID}.expired_items", result.modified_count)
+
+    await db.job_runs.insert_one({
+        "run_id": f"{SWEEP_JOB_ID}-{started_at.isoformat()}",
+        "job_id": SWEEP_JOB_ID,
+        "status": "completed",
+        "stats": stats,
+        "duration_ms": round(duration * 1000, 2),
+        "started_at": started_at,
+        "finished_at": datetime.now(timezone.utc),
+        # Frequent, small runs - keep a week of history (TTL index on job_runs.purge_at)
+        "purge_at": started_at + SWEEP_HISTORY_RETENTION,
+    })
+
+    if result.modified_count:
+        await bump_versions(db, RSHD_ITEMS)
+        logger.info(f"Expiry sweep: {stats}")
+    return stats
+
+
+async def ensure_expiry_indexes(db):
+    """Serves both the sweep and the expiring-soon admin alerts."""
+    await db.rshd_items.create_index([("status", 1), ("expires_at", 1)])
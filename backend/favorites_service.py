@@ -0,0 +1,238 @@
+"""
+DAC Favorite Items (DACFI-List) for DealShaq
+- One document per favorite in `favorite_items`, indexed by (dac_id, category),
+  instead of an unbounded array embedded in the user document
+- RSHD matching pushes the category, keyword and organic predicates into MongoDB,
+  so only favorites that can match the item are read
+- Migration: every write first moves that DAC's legacy embedded array into the
+  collection; `migrate_favorite_items.py` moves everyone else. Until that has run,
+  reads also merge any legacy array (FAVORITES_DUAL_READ, default on)
+"""
+
+import os
+import logging
+from collections import defaultdict
+from typing import Dict, Any, List, Optional, Set, Iterable
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+DUAL_READ = os.environ.get('FAVORITES_DUAL_READ', 'true').lower() == 'true'
+FAVORITE_PROJECTION = {"_id": 0, "dac_id": 0, "item_name_lower": 0}
+MIGRATION_BATCH = 500
+DUPLICATE_KEY_ERROR = 11000
+
+
+def _document(dac_id: str, favorite: Dict[str, Any]) -> Dict[str, Any]:
+    return {**favorite, "dac_id": dac_id, "item_name_lower": favorite["item_name"].lower()}
+
+
+def _upsert(dac_id: str, favorite: Dict[str, Any]) -> UpdateOne:
+    # Insert-only: an existing favorite of the same name is left as it is
+    document = _document(dac_id, favorite)
+    return UpdateOne(
+        {"dac_id": dac_id, "item_name_lower": document["item_name_lower"]},
+        {"$setOnInsert": document},
+        upsert=True
+    )
+
+
+def _merge_legacy(favorites: List[Dict[str, Any]], legacy: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    names = {favorite["item_name"].lower() for favorite in favorites}
+    return favorites + [favorite for favorite in legacy if favorite["item_name"].lower() not in names]
+
+
+def _contains_any(keywords_field: str, item_name_lower: str) -> Dict[str, Any]:
+    """Aggregation expression: some keyword is a substring of the item name (Python `kw in name`)."""
+    return {"$anyElementTrue": [{"$map": {
+        "input": {"$ifNull": [keywords_field, []]},
+        "as": "kw",
+        # $literal: a name starting with "$" must not be read as a field path or variable
+        "in": {"$gte": [{"$indexOfCP": [{"$literal": item_name_lower}, "$$kw"]}, 0]}
+    }}]}
+
+
+def favorite_matches(favorite: Dict[str, Any], item_name_lower: str, item_organic: bool) -> bool:
+    """
+    The matching engine's keyword rules (Option C hybrid): generic keywords must
+    match; branded favorites also need a brand keyword match; organic-only
+    favorites need an organic item. match_expression is the MongoDB form of this.
+    """
+    if not any(keyword in item_name_lower for keyword in favorite.get("generic_keywords", [])):
+        return False
+    if favorite.get("has_brand", False):
+        if not any(keyword in item_name_lower for keyword in favorite.get("brand_keywords", [])):
+            return False
+    if favorite.get("attributes", {}).get("organic") is True and not item_organic:
+        return False
+    return True
+
+
+def match_expression(prefix: str, item_name_lower: str, item_organic: bool) -> Dict[str, Any]:
+    """
+    favorite_matches as an aggregation expression over a favorite at `prefix`
+    ("$" for collection documents, "$$fav." inside $filter).
+    """
+    conditions = [
+        _contains_any(f"{prefix}generic_keywords", item_name_lower),
+        {"$or": [
+            {"$ne": [f"{prefix}has_brand", True]},
+            _contains_any(f"{prefix}brand_keywords", item_name_lower),
+        ]},
+    ]
+    if not item_organic:
+        conditions.append({"$ne": [f"{prefix}attributes.organic", True]})
+    return {"$and": conditions}
+
+
+async def _legacy_favorites(db, dac_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Embedded favorite_items arrays not yet migrated."""
+    legacy = {}
+    async for user in db.users.find(
+        {"id": {"$in": dac_ids}, "favorite_items.0": {"$exists": True}}, {"_id": 0, "id": 1, "favorite_items": 1}
+    ):
+        legacy[user["id"]] = user["favorite_items"]
+    return legacy
+
+
+async def _legacy_favorites_for_matching(
+    db, dac_ids: List[str], category: str, item_name_lower: Optional[str], item_organic: bool
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Only the candidate elements of unmigrated arrays, filtered server-side with $filter."""
+    condition = {"$eq": ["$$fav.category", category]}
+    if item_name_lower is not None:
+        condition = {"$and": [condition, match_expression("$$fav.", item_name_lower, item_organic)]}
+    pipeline = [
+        {"$match": {"id": {"$in": dac_ids}, "favorite_items.category": category}},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "favorite_items": {"$filter": {"input": "$favorite_items", "as": "fav", "cond": condition}}
+        }},
+        {"$match": {"favorite_items.0": {"$exists": True}}},
+    ]
+    legacy = {}
+    async for user in db.users.aggregate(pipeline):
+        legacy[user["id"]] = user["favorite_items"]
+    return legacy
+
+
+async def migrate_user_favorites(db, dac_id: str) -> int:
+    """Move one DAC's embedded favorites into the collection. Idempotent."""
+    user = await db.users.find_one(
+        {"id": dac_id, "favorite_items": {"$exists": True}}, {"_id": 0, "favorite_items": 1}
+    )
+    if not user:
+        return 0
+
+    legacy = user["favorite_items"]
+    if legacy:
+        try:
+            await db.favorite_items.bulk_write([_upsert(dac_id, favorite) for favorite in legacy], ordered=False)
+        except BulkWriteError as e:
+            # A concurrent request for the same DAC upserted these first; the favorites are in place
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+                raise
+    # Only drop the array if nobody changed it in the meantime; otherwise the next run retries
+    await db.users.update_one({"id": dac_id, "favorite_items": legacy}, {"$unset": {"favorite_items": ""}})
+    return len(legacy)
+
+
+async def migrate_all_favorites(db) -> Dict[str, int]:
+    users = 0
+    favorites = 0
+    async for user in db.users.find({"favorite_items": {"$exists": True}}, {"_id": 0, "id": 1}).batch_size(MIGRATION_BATCH):
+        favorites += await migrate_user_favorites(db, user["id"])
+        users += 1
+    return {"users": users, "favorites": favorites}
+
+
+async def get_favorites(db, dac_id: str) -> List[Dict[str, Any]]:
+    """A DAC's favorites in the order they were added."""
+    favorites = await db.favorite_items.find({"dac_id": dac_id}, FAVORITE_PROJECTION).sort("_id", 1).to_list(None)
+    if DUAL_READ:
+        legacy = await _legacy_favorites(db, [dac_id])
+        favorites = _merge_legacy(favorites, legacy.get(dac_id, []))
+    return favorites
+
+
+async def add_favorite(db, dac_id: str, favorite: Dict[str, Any]) -> bool:
+    """False if the DAC already has a favorite with this name (case-insensitive)."""
+    if DUAL_READ:
+        await migrate_user_favorites(db, dac_id)
+    try:
+        await db.favorite_items.insert_one(_document(dac_id, favorite))
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def add_favorites_bulk(db, favorites_by_dac: Dict[str, List[Dict[str, Any]]]) -> int:
+    """Insert favorites for many DACs in one round trip, skipping names they already have."""
+    operations = [
+        _upsert(dac_id, favorite)
+        for dac_id, favorites in favorites_by_dac.items()
+        for favorite in favorites
+    ]
+    if not operations:
+        return 0
+    result = await db.favorite_items.bulk_write(operations, ordered=False)
+    return result.upserted_count
+
+
+async def remove_favorite(db, dac_id: str, item_name: str, case_insensitive: bool = False) -> int:
+    """Number of favorites removed (0 or 1)."""
+    if DUAL_READ:
+        await migrate_user_favorites(db, dac_id)
+    if case_insensitive:
+        query = {"dac_id": dac_id, "item_name_lower": item_name.lower()}
+    else:
+        query = {"dac_id": dac_id, "item_name": item_name}
+    result = await db.favorite_items.delete_one(query)
+    return result.deleted_count
+
+
+async def get_favorite_names(db, dac_ids: Iterable[str]) -> Dict[str, Set[str]]:
+    """Lower-cased favorite names per DAC."""
+    dac_ids = list(dac_ids)
+    names = defaultdict(set)
+    async for favorite in db.favorite_items.find(
+        {"dac_id": {"$in": dac_ids}}, {"_id": 0, "dac_id": 1, "item_name_lower": 1}
+    ):
+        names[favorite["dac_id"]].add(favorite["item_name_lower"])
+    if DUAL_READ:
+        for dac_id, legacy in (await _legacy_favorites(db, dac_ids)).items():
+            names[dac_id].update(favorite["item_name"].lower() for favorite in legacy)
+    return names
+
+
+async def get_favorites_for_matching(
+    db,
+    dac_ids: List[str],
+    category: str,
+    item_name_lower: Optional[str] = None,
+    item_organic: bool = False
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Favorites in one category for the given DACs, grouped by DAC. With the item's
+    normalized name, only favorites whose keywords match it are returned.
+    """
+    query = {"dac_id": {"$in": dac_ids}, "category": category}  # (dac_id, category) index
+    if item_name_lower is not None:
+        query["$expr"] = match_expression("$", item_name_lower, item_organic)
+
+    favorites_by_dac = defaultdict(list)
+    async for favorite in db.favorite_items.find(query, {"_id": 0, "item_name_lower": 0}).sort("_id", 1):
+        favorites_by_dac[favorite.pop("dac_id")].append(favorite)
+    if DUAL_READ:
+        legacy_by_dac = await _legacy_favorites_for_matching(db, dac_ids, category, item_name_lower, item_organic)
+        for dac_id, legacy in legacy_by_dac.items():
+            favorites_by_dac[dac_id] = _merge_legacy(favorites_by_dac[dac_id], legacy)
+    return favorites_by_dac
+
+
+async def ensure_favorite_items_indexes(db):
+    await db.favorite_items.create_index([("dac_id", 1), ("item_name_lower", 1)], unique=True)
+    await db.favorite_items.create_index([("dac_id", 1), ("category", 1)])
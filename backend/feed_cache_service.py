@@ -0,0 +1,106 @@
+"""
+Per-DRLP Feed Cache for DealShaq
+- In-process LRU of each retailer's active items, newest first
+- Invalidated write-through by item create/update/delete, order quantity
+  decrements and admin / retailer status changes made on this worker
+- A short TTL bounds staleness from writes handled by other workers
+- Per-DAC feeds are assembled by k-way merging the cached per-store lists
+"""
+
+import time
+import heapq
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Iterable, Iterator
+
+from cachetools import LRUCache
+
+logger = logging.getLogger(__name__)
+
+MEMORY_CACHE_SIZE = 5000  # Retailers
+ENTRY_TTL_SECONDS = 60
+CACHE_PROJECTION = {"_id": 0, "match_keys": 0}
+
+
+def feed_sort_key(item: Dict[str, Any]):
+    """Feed order is (posted_at, id) descending."""
+    return item["posted_at"], item["id"]
+
+
+class DRLPFeedCache:
+    """Active (available, in-stock) items per retailer, sorted newest first."""
+
+    def __init__(self, maxsize: int = MEMORY_CACHE_SIZE, ttl_seconds: float = ENTRY_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._memory: LRUCache = LRUCache(maxsize=maxsize)
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "invalidations": 0,
+            "db_loads": 0,
+        }
+
+    async def get_many(self, db, drlp_ids: Iterable[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """Cached item lists for the retailers, loading all misses with one query."""
+        now = time.monotonic()
+        lists = {}
+        misses = []
+        for drlp_id in drlp_ids:
+            entry = self._memory.get(drlp_id)
+            if entry is not None and now - entry[0] <= self.ttl_seconds:
+                lists[drlp_id] = entry[1]
+            else:
+                misses.append(drlp_id)
+
+        self.stats["hits"] += len(lists)
+        self.stats["misses"] += len(misses)
+
+        if misses:
+            self.stats["db_loads"] += 1
+            loaded = {drlp_id: [] for drlp_id in misses}
+            async for item in db.rshd_items.find(
+                {"drlp_id": {"$in": misses}, "status": "available", "quantity": {"$gt": 0}},
+                CACHE_PROJECTION
+            ):
+                loaded[item["drlp_id"]].append(item)
+            for drlp_id, items in loaded.items():
+                items.sort(key=feed_sort_key, reverse=True)
+                self._memory[drlp_id] = (now, items)
+                lists[drlp_id] = items
+
+        return lists
+
+    def invalidate(self, *drlp_ids: str):
+        for drlp_id in drlp_ids:
+            if self._memory.pop(drlp_id, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self):
+        self._memory.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "memory_entries": len(self._memory),
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+
+def is_unexpired(item: Dict[str, Any], now: datetime) -> bool:
+    """Expiry is time-dependent, so it is checked when reading the cache, not when filling it."""
+    expires_at = item.get("expires_at")
+    if expires_at is None:
+        return True
+    if expires_at.tzinfo is None:  # Motor returns naive UTC
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at > now
+
+
+def merge_newest_first(lists: Iterable[List[Dict[str, Any]]]) -> Iterator[Dict[str, Any]]:
+    """k-way merge of newest-first per-store lists into one newest-first stream."""
+    return heapq.merge(*lists, key=feed_sort_key, reverse=True)
+
+
+# Global cache instance
+feed_cache = DRLPFeedCache()
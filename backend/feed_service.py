@@ -0,0 +1,131 @@
+"""
+Consumer Deal Feed for DealShaq
+- Scoped to the requesting DAC's DACDRLP-List (retailers inside their DACSAI plus
+  manual additions, minus manual removals), intersected with live retailers
+- Assembled from the per-DRLP feed cache by k-way merge in (posted_at, id) order
+- Keyset pagination on (posted_at, id) - no skip/offset
+- Optional distance sort using the distances stored on the DACDRLP-List
+"""
+
+import json
+import base64
+from datetime import datetime, timezone
+from itertools import dropwhile
+from typing import Dict, Any, List, Optional, Tuple, Iterator
+
+from feed_cache_service import feed_cache, feed_sort_key, is_unexpired, merge_newest_first
+from live_retailer_service import live_retailers
+
+SORT_NEWEST = "newest"
+SORT_DISTANCE = "distance"
+
+
+class InvalidCursorError(ValueError):
+    """Raised for a cursor that was tampered with or belongs to another sort order."""
+
+
+def encode_cursor(sort: str, last: Dict[str, Any], rank: Optional[int] = None) -> str:
+    payload = {"s": sort, "p": last["posted_at"], "i": last["id"]}
+    if sort == SORT_DISTANCE:
+        payload["r"] = rank
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Dict[str, Any]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if payload["s"] != sort or not isinstance(payload["p"], str) or not isinstance(payload["i"], str):
+            raise ValueError
+        if sort == SORT_DISTANCE and not isinstance(payload["r"], int):
+            raise ValueError
+    except Exception:
+        raise InvalidCursorError("Invalid or mismatched cursor")
+    return payload
+
+
+async def get_feed_retailers(db, dac_id: str) -> List[Tuple[str, Optional[float]]]:
+    """(drlp_id, distance) for the DAC's live retailers, nearest first."""
+    dacdrlp_doc = await db.dacdrlp_list.find_one({"dac_id": dac_id}, {"_id": 0, "retailers": 1})
+    if not dacdrlp_doc:
+        return []
+
+    live_ids = await live_retailers.get(db)
+    retailers = [
+        (r["drlp_id"], r.get("distance"))
+        for r in dacdrlp_doc.get("retailers", [])
+        if not r.get("manually_removed", False) and r["drlp_id"] in live_ids
+    ]
+    retailers.sort(key=lambda r: (r[1] is None, r[1] or 0.0))
+    return retailers
+
+
+def _after(items: List[Dict[str, Any]], position: Optional[Tuple[str, str]]) -> Iterator[Dict[str, Any]]:
+    """Items of a newest-first list strictly after a keyset position."""
+    if position is None:
+        return iter(items)
+    return dropwhile(lambda item: feed_sort_key(item) >= position, items)
+
+
+async def get_feed_page(
+    db,
+    dac_id: str,
+    category: Optional[str] = None,
+    min_discount_level: Optional[int] = None,
+    sort: str = SORT_NEWEST,
+    limit: int = 20,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """One page of the DAC's feed: {"items": [...], "next_cursor": str | None}."""
+    after = decode_cursor(cursor, sort) if cursor else None
+    position = (after["p"], after["i"]) if after else None
+    retailers = await get_feed_retailers(db, dac_id)
+    if not retailers:
+        return {"items": [], "next_cursor": None}
+
+    drlp_ids = [drlp_id for drlp_id, _ in retailers]
+    distances = dict(retailers)
+    lists = await feed_cache.get_many(db, drlp_ids)
+
+    if sort == SORT_DISTANCE:
+        # Stores nearest first, each store's items newest first
+        def ranked():
+            for rank, drlp_id in enumerate(drlp_ids):
+                if after and rank < after["r"]:
+                    continue
+                start = position if after and rank == after["r"] else None
+                for item in _after(lists[drlp_id], start):
+                    yield rank, item
+        stream = ranked()
+    else:
+        merged = merge_newest_first(_after(lists[drlp_id], position) for drlp_id in drlp_ids)
+        stream = ((None, item) for item in merged)
+
+    now = datetime.now(timezone.utc)
+    page = []
+    for rank, item in stream:
+        if category and item["category"] != category:
+            continue
+        if min_discount_level and item["discount_level"] < min_discount_level:
+            continue
+        if not is_unexpired(item, now):
+            continue
+        page.append((rank, item))
+        if len(page) > limit:
+            break
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    next_cursor = encode_cursor(sort, page[-1][1], page[-1][0]) if has_more else None
+
+    # Copies - the cached lists are shared between requests
+    items = []
+    for _, item in page:
+        item = {key: value for key, value in item.items() if key != "expires_at"}
+        item["distance"] = distances.get(item["drlp_id"])
+        items.append(item)
+    return {"items": items, "next_cursor": next_cursor}
+
+
+async def ensure_feed_indexes(db):
+    """Per-retailer live inventory in keyset order (feed cache loads)."""
+    await db.rshd_items.create_index([("drlp_id", 1), ("status", 1), ("posted_at", -1), ("id", -1)])
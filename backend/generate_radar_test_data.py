@@ -90,7 +90,6 @@ async def generate_radar_test_data():
             "lng": SF_LOCATION["lng"]
         },
         "dacsai_rad": 5.0,
-        "favorite_items": [],
         "notification_prefs": {"email": True, "push": True, "sms": False},
         "created_at": now
     }
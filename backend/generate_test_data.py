@@ -11,6 +11,8 @@ from datetime import datetime, timezone, timedelta
 from motor.motor_asyncio import AsyncIOMotorClient
 from passlib.context import CryptContext
 
+from favorites_service import add_favorites_bulk
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # Configuration - loads from backend/.env
@@ -184,7 +186,6 @@ async def generate_test_data():
                 "lng": location["lng"]
             },
             "dacsai_rad": 5.0 + (i * 0.5),  # Varying radii: 5.0, 5.5, 6.0, 6.5, 7.0
-            "favorite_items": [],
             "auto_favorite_threshold": 3 if i % 2 == 0 else 0,
             "notification_prefs": {"email": True, "push": True, "sms": False},
             "created_at": now
@@ -237,19 +238,20 @@ async def generate_test_data():
         {"item_name": "Sourdough Bread", "brand": None, "generic": "Bread", "has_brand": False, "category": "Bakery & Bread"},
     ]
     
+    favorites_by_dac = {}
     for i, dac in enumerate(dac_ids):
         # Add 2-3 favorites per consumer
         favorites_to_add = sample_favorites[i:i+3] if i < 3 else sample_favorites[:2]
-        for fav in favorites_to_add:
-            await db.users.update_one(
-                {"id": dac["id"]},
-                {"$push": {"favorite_items": {
-                    **fav,
-                    "keywords": [fav["generic"].lower()],
-                    "attributes": {"organic": "organic" in fav["item_name"].lower()},
-                    "added_at": now
-                }}}
-            )
+        favorites_by_dac[dac["id"]] = [
+            {
+                **fav,
+                "keywords": [fav["generic"].lower()],
+                "attributes": {"organic": "organic" in fav["item_name"].lower()},
+                "added_at": now
+            }
+            for fav in favorites_to_add
+        ]
+    await add_favorites_bulk(db, favorites_by_dac)
     print(f"  ✅ Added favorites to {len(dac_ids)} consumers")
     
     # 7. Create RSHD Items
@@ -0,0 +1,179 @@
+"""
+Image Ingestion Service for DealShaq OCR
+- Validates uploaded images from their header bytes (type) and declared size
+- Caps upload request bodies while they stream in, before anything is spooled to disk
+- Reads uploads straight from the spooled temp file the multipart parser wrote
+- Downscales and recompresses to a bounded resolution before the vision model call
+"""
+
+import io
+import base64
+import asyncio
+import logging
+from typing import Optional, Dict, Any
+
+from fastapi import HTTPException
+from PIL import Image, ImageOps
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024  # 10 MB
+MAX_IMAGE_PIXELS = 50_000_000  # Reject decompression bombs before decoding
+MAX_IMAGE_DIMENSION = 1600  # Longest side sent to the model
+JPEG_QUALITY = 85
+MIN_IMAGE_BYTES = 100
+MULTIPART_OVERHEAD_BYTES = 64 * 1024  # Boundaries, part headers and small form fields
+UPLOAD_PATH_SUFFIX = "/upload"
+
+# Magic numbers for the formats the vision model accepts
+IMAGE_SIGNATURES = {
+    "jpeg": lambda header: header[:3] == b"\xff\xd8\xff",
+    "png": lambda header: header[:8] == b"\x89PNG\r\n\x1a\n",
+    "webp": lambda header: header[:4] == b"RIFF" and header[8:12] == b"WEBP",
+}
+
+
+def _too_large_detail() -> str:
+    return f"Image exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit"
+
+
+def detect_image_type(header: bytes) -> Optional[str]:
+    """Identify JPEG / PNG / WEBP from the first 12 bytes of a file."""
+    for image_type, matches in IMAGE_SIGNATURES.items():
+        if matches(header):
+            return image_type
+    return None
+
+
+def validate_base64_image(image_base64: str) -> Dict[str, Any]:
+    """
+    Validate a base64 image without decoding all of it.
+
+    Strips an optional data URI prefix, derives the decoded size from the string
+    length and checks the type from the first decoded bytes only.
+    """
+    if image_base64.startswith('data:'):
+        try:
+            image_base64 = image_base64.split(',')[1]
+        except IndexError:
+            return {"success": False, "error": "Invalid data URI format"}
+
+    padding = len(image_base64) - len(image_base64.rstrip('='))
+    decoded_size = len(image_base64) * 3 // 4 - padding
+    if decoded_size < MIN_IMAGE_BYTES:
+        return {"success": False, "error": "Image too small or invalid"}
+    if decoded_size > MAX_UPLOAD_BYTES:
+        return {"success": False, "error": _too_large_detail()}
+
+    try:
+        header = base64.b64decode(image_base64[:16], validate=True)
+    except Exception as e:
+        return {"success": False, "error": f"Invalid base64 encoding: {str(e)}"}
+
+    if detect_image_type(header) is None:
+        return {"success": False, "error": "Unsupported image type. Use JPEG, PNG, or WEBP"}
+
+    return {"success": True, "image_base64": image_base64}
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Bound the request body of upload endpoints before the multipart parser spools it.
+
+    A declared Content-Length over the limit is answered with 413 without reading
+    the body; chunked or understated bodies are counted as they arrive and aborted
+    with 413 once they pass the limit.
+    """
+
+    def __init__(self, app, max_body_bytes: int = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].endswith(UPLOAD_PATH_SUFFIX):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length", "")
+        if content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            await JSONResponse({"detail": _too_large_detail()}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    # FastAPI re-raises HTTPExceptions from body parsing, so this becomes a 413
+                    raise HTTPException(status_code=413, detail=_too_large_detail())
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def _downscale(file_obj) -> Dict[str, Any]:
+    """Decode, orient, bound and re-encode an image as JPEG (CPU-bound; run in a thread)."""
+    with Image.open(file_obj) as image:
+        width, height = image.size
+        if width * height > MAX_IMAGE_PIXELS:
+            return {"success": False, "error": "Image resolution too large", "status_code": 413}
+
+        # JPEG can decode directly at a reduced scale, which avoids materializing full size
+        image.draft("RGB", (MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+
+    return {
+        "success": True,
+        "image_base64": base64.b64encode(output.getvalue()).decode("ascii"),
+        "width": image.width,
+        "height": image.height,
+        "prepared_bytes": output.tell(),
+    }
+
+
+async def ingest_upload(upload) -> Dict[str, Any]:
+    """
+    Prepare an uploaded image (FastAPI UploadFile) for the vision model.
+
+    Returns {"success": True, "image_base64", "width", "height", "original_bytes",
+    "prepared_bytes"} or {"success": False, "error", "status_code"}.
+    """
+    size = upload.size
+    if size is None:
+        upload.file.seek(0, io.SEEK_END)
+        size = upload.file.tell()
+    if size > MAX_UPLOAD_BYTES:
+        return {"success": False, "error": _too_large_detail(), "status_code": 413}
+    if size < MIN_IMAGE_BYTES:
+        return {"success": False, "error": "Image too small or invalid", "status_code": 400}
+
+    upload.file.seek(0)
+    header = upload.file.read(12)
+    if detect_image_type(header) is None:
+        return {"success": False, "error": "Unsupported image type. Use JPEG, PNG, or WEBP", "status_code": 415}
+
+    upload.file.seek(0)
+    try:
+        prepared = await asyncio.to_thread(_downscale, upload.file)
+    except Exception as e:
+        logger.error(f"Failed to decode uploaded image: {e}")
+        return {"success": False, "error": "Image could not be decoded", "status_code": 400}
+
+    if prepared["success"]:
+        prepared["original_bytes"] = size
+        logger.info(
+            f"Prepared upload {upload.filename}: {size} -> {prepared['prepared_bytes']} bytes "
+            f"({prepared['width']}x{prepared['height']})"
+        )
+    return prepared
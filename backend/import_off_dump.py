@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Import an Open Food Facts dump into the offline barcode index
+
+Streams the dump line by line (never loading it into memory), maps each
+product through map_category / extract_weight, and writes the compact
+memory-mapped index that lookup_barcode consults before the network.
+
+Supported dumps (optionally .gz compressed):
+    - JSONL product export (openfoodfacts-products.jsonl.gz)
+    - CSV export (en.openfoodfacts.org.products.csv.gz, tab-separated)
+
+Usage:
+    python import_off_dump.py openfoodfacts-products.jsonl.gz
+    python import_off_dump.py en.openfoodfacts.org.products.csv.gz --output data/off_barcode_index.bin
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import sys
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+
+from barcode_index_service import BarcodeIndexWriter, DEFAULT_INDEX_PATH
+from barcode_ocr_service import map_product
+
+PROGRESS_EVERY = 100000
+
+# CSV columns holding comma-separated tag lists (the JSONL export has real arrays)
+CSV_TAG_COLUMNS = ("categories_tags", "labels_tags")
+
+
+def open_dump(path: Path):
+    """Open a dump as text, transparently decompressing .gz files."""
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace", newline="")
+    return open(path, "r", encoding="utf-8", errors="replace", newline="")
+
+
+def dump_format(path: Path) -> str:
+    suffixes = [s for s in path.suffixes if s != ".gz"]
+    return "csv" if suffixes and suffixes[-1] in (".csv", ".tsv") else "jsonl"
+
+
+def iter_jsonl_products(stream) -> Iterator[Tuple[str, Dict]]:
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            product = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        yield str(product.get("code", "")), product
+
+
+def iter_csv_products(stream, delimiter: str) -> Iterator[Tuple[str, Dict]]:
+    csv.field_size_limit(sys.maxsize)
+    for row in csv.DictReader(stream, delimiter=delimiter):
+        for column in CSV_TAG_COLUMNS:
+            value = row.get(column) or ""
+            row[column] = [tag for tag in value.split(",") if tag]
+        # The CSV export names the front image column image_url
+        row.setdefault("image_front_url", row.get("image_url", ""))
+        yield row.get("code") or "", row
+
+
+def import_dump(dump_path: Path, output_path: Path, delimiter: str = "\t") -> Dict[str, int]:
+    """Stream a dump into a new index file and return import counters."""
+    stats = {"read": 0, "indexed": 0, "skipped": 0}
+    writer = BarcodeIndexWriter(output_path)
+
+    with open_dump(dump_path) as stream:
+        if dump_format(dump_path) == "csv":
+            products = iter_csv_products(stream, delimiter)
+        else:
+            products = iter_jsonl_products(stream)
+
+        for barcode, product in products:
+            stats["read"] += 1
+            if product.get("product_name") or product.get("product_name_en"):
+                if writer.add(barcode, map_product(product, barcode)):
+                    stats["indexed"] += 1
+                else:
+                    stats["skipped"] += 1
+            else:
+                stats["skipped"] += 1
+
+            if stats["read"] % PROGRESS_EVERY == 0:
+                print(f"  ... {stats['read']:,} products read, {stats['indexed']:,} indexed")
+
+    stats["unique"] = writer.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline barcode index from an Open Food Facts dump")
+    parser.add_argument("dump", type=Path, help="Path to the JSONL or CSV dump (optionally .gz)")
+    parser.add_argument("--output", type=Path, default=DEFAULT_INDEX_PATH, help="Index file to write")
+    parser.add_argument("--delimiter", default="\t", help="CSV delimiter (the OFF CSV export is tab-separated)")
+    args = parser.parse_args()
+
+    if not args.dump.exists():
+        print(f"❌ Dump not found: {args.dump}")
+        sys.exit(1)
+
+    print(f"Importing {args.dump} -> {args.output}")
+    stats = import_dump(args.dump, args.output, args.delimiter)
+    print(
+        f"✅ Indexed {stats['unique']:,} unique barcodes "
+        f"({stats['read']:,} read, {stats['skipped']:,} skipped)"
+    )
+    print("Restart the API workers to load the new index")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Inventory Reservation for DealShaq
+- Checkout reserves stock before payment with conditional decrements
+  (`quantity >= requested`) in one bulk write, so concurrent buyers cannot oversell
+- Each reserved item carries the hold id in `holds`, which makes every release
+  idempotent and tells a partial reservation exactly what to roll back
+- Holds are released on payment failure; holds left behind by a crash are
+  released by a scheduled job once they expire
+"""
+
+import time
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, List, Iterable
+
+from pymongo import UpdateOne
+
+import metrics_service
+from etag_service import bump_versions, RSHD_ITEMS
+from feed_cache_service import feed_cache
+
+logger = logging.getLogger(__name__)
+
+HOLD_TTL = timedelta(minutes=10)  # Well beyond the payment timeout
+RELEASE_JOB_ID = "release_stale_holds"
+RELEASE_INTERVAL_MINUTES = 1
+
+HOLD_PENDING = "pending"
+HOLD_RESERVED = "reserved"
+HOLD_COMMITTED = "committed"
+HOLD_RELEASED = "released"
+
+
+def _requested_quantities(items: Iterable[Any]) -> Dict[str, int]:
+    """Total quantity per RSHD (the same item may appear on several cart lines)."""
+    quantities = defaultdict(int)
+    for item in items:
+        quantities[item.rshd_id] += item.quantity
+    return dict(quantities)
+
+
+def _restore_operations(hold_id: str, quantities: Dict[str, int]) -> List[UpdateOne]:
+    # Only items still carrying the hold are restored - safe to repeat
+    return [
+        UpdateOne({"id": rshd_id, "holds": hold_id}, {"$inc": {"quantity": quantity}, "$pull": {"holds": hold_id}})
+        for rshd_id, quantity in quantities.items()
+    ]
+
+
+async def inventory_changed(db, rshd_ids: List[str]):
+    """Drop cached feeds of every retailer owning these items and bump the listing ETag."""
+    drlp_ids = await db.rshd_items.distinct("drlp_id", {"id": {"$in": rshd_ids}})
+    feed_cache.invalidate(*drlp_ids)
+    await bump_versions(db, RSHD_ITEMS)
+
+
+async def reserve_items(db, hold_id: str, dac_id: str, items: Iterable[Any]) -> Dict[str, Any]:
+    """
+    Reserve every line of an order or none of them.
+
+    Returns {"success": True} or {"success": False, "error": ...}; on failure any
+    partial decrements have already been rolled back.
+    """
+    quantities = _requested_quantities(items)
+    if not quantities or any(quantity <= 0 for quantity in quantities.values()):
+        return {"success": False, "error": "Item quantities must be positive"}
+
+    now = datetime.now(timezone.utc)
+    # Recorded first so a crash between here and commit is cleaned up by the release job
+    await db.inventory_holds.insert_one({
+        "hold_id": hold_id,
+        "dac_id": dac_id,
+        "items": [{"rshd_id": rshd_id, "quantity": quantity} for rshd_id, quantity in quantities.items()],
+        "status": HOLD_PENDING,
+        "created_at": now,
+        "expires_at": now + HOLD_TTL,
+    })
+
+    started = time.perf_counter()
+    result = await db.rshd_items.bulk_write([
+        UpdateOne(
+            {"id": rshd_id, "status": "available", "quantity": {"$gte": quantity}, "holds": {"$ne": hold_id}},
+            {"$inc": {"quantity": -quantity}, "$push": {"holds": hold_id}}
+        )
+        for rshd_id, quantity in quantities.items()
+    ], ordered=False)
+    metrics_service.observe("inventory.reserve", time.perf_counter() - started)
+
+    if result.modified_count == len(quantities):
+        await db.inventory_holds.update_one(
+            {"hold_id": hold_id, "status": HOLD_PENDING}, {"$set": {"status": HOLD_RESERVED}}
+        )
+        return {"success": True}
+
+    # Lost the race for at least one item: undo the lines that were reserved
+    metrics_service.increment("inventory.reserve_conflicts")
+    await db.rshd_items.bulk_write(_restore_operations(hold_id, quantities), ordered=False)
+    await db.inventory_holds.update_one(
+        {"hold_id": hold_id}, {"$set": {"status": HOLD_RELEASED, "released_at": datetime.now(timezone.utc)}}
+    )
+
+    available = await db.rshd_items.find(
+        {"id": {"$in": list(quantities)}}, {"_id": 0, "id": 1, "name": 1, "quantity": 1, "status": 1}
+    ).to_list(None)
+    short = [
+        item["name"] for item in available
+        if item.get("status") != "available" or item.get("quantity", 0) < quantities[item["id"]]
+    ]
+    missing = len(quantities) - len(available)
+    if short:
+        error = f"Not enough stock for: {', '.join(short)}"
+    elif missing:
+        error = "Item not found"
+    else:
+        error = "Items sold out during checkout, please try again"
+    return {"success": False, "error": error}
+
+
+async def commit_hold(db, hold_id: str) -> bool:
+    """Make a reservation permanent after payment. False if it had already been released."""
+    hold = await db.inventory_holds.find_one_and_update(
+        {"hold_id": hold_id, "status": HOLD_RESERVED},
+        {"$set": {"status": HOLD_COMMITTED, "committed_at": datetime.now(timezone.utc)}}
+    )
+    if not hold:
+        return False
+    # Scoped to the hold's items so the id index is used (there is no index on holds)
+    await db.rshd_items.update_many(
+        {"id": {"$in": [line["rshd_id"] for line in hold["items"]]}, "holds": hold_id},
+        {"$pull": {"holds": hold_id}}
+    )
+    return True
+
+
+async def release_hold(db, hold_id: str) -> bool:
+    """Return a hold's stock (payment failed or hold expired). Idempotent."""
+    hold = await db.inventory_holds.find_one_and_update(
+        {"hold_id": hold_id, "status": {"$in": [HOLD_PENDING, HOLD_RESERVED]}},
+        {"$set": {"status": HOLD_RELEASED, "released_at": datetime.now(timezone.utc)}}
+    )
+    if not hold:
+        return False
+
+    quantities = {line["rshd_id"]: line["quantity"] for line in hold["items"]}
+    result = await db.rshd_items.bulk_write(_restore_operations(hold_id, quantities), ordered=False)
+    if result.modified_count:
+        await inventory_changed(db, list(quantities))
+    logger.info(f"Released inventory hold {hold_id} ({result.modified_count} items restored)")
+    return True
+
+
+async def release_stale_holds(db) -> int:
+    """Release holds whose checkout never finished (e.g. the API process died mid-payment)."""
+    stale = await db.inventory_holds.find(
+        {"status": {"$in": [HOLD_PENDING, HOLD_RESERVED]}, "expires_at": {"$lte": datetime.now(timezone.utc)}},
+        {"_id": 0, "hold_id": 1}
+    ).to_list(None)
+
+    released = 0
+    for hold in stale:
+        if await release_hold(db, hold["hold_id"]):
+            released += 1
+    if released:
+        metrics_service.increment("inventory.stale_holds_released", released)
+        logger.warning(f"Released {released} stale inventory holds")
+    return released
+
+
+async def ensure_inventory_indexes(db):
+    await db.rshd_items.create_index("id")  # Reservation decrements and restores by item id
+    await db.inventory_holds.create_index("hold_id", unique=True)
+    await db.inventory_holds.create_index([("status", 1), ("expires_at", 1)])
+    # Finished holds are kept for a month for support lookups
+    await db.inventory_holds.create_index("created_at", expireAfterSeconds=30 * 24 * 3600)
@@ -0,0 +1,111 @@
+"""
+Distributed Job Locks for DealShaq
+- MongoDB lease locks in `job_locks` so a scheduled job runs on one instance per cluster
+- The holder renews its lease with a heartbeat; a crashed holder's lease simply expires
+- If the lease is lost mid-run (e.g. a long GC pause or network partition) the job is cancelled
+"""
+
+import os
+import uuid
+import socket
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = 60
+HEARTBEAT_SECONDS = 20
+
+# Identifies this process as a lock holder (also recorded on job runs)
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+async def acquire_lock(db, name: str, owner: str = INSTANCE_ID, lease_seconds: int = LEASE_SECONDS) -> bool:
+    """Take the lock if it is free, expired, or already ours."""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.job_locks.find_one_and_update(
+            {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"owner": owner}]},
+            {
+                "$set": {"owner": owner, "expires_at": now + timedelta(seconds=lease_seconds), "heartbeat_at": now},
+                "$setOnInsert": {"acquired_at": now},
+            },
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The document exists and the filter didn't match: someone else holds a live lease
+        return False
+    return True
+
+
+async def renew_lock(db, name: str, owner: str = INSTANCE_ID, lease_seconds: int = LEASE_SECONDS) -> bool:
+    """Extend our lease. Returns False if the lock is no longer ours."""
+    now = datetime.now(timezone.utc)
+    result = await db.job_locks.update_one(
+        {"_id": name, "owner": owner},
+        {"$set": {"expires_at": now + timedelta(seconds=lease_seconds), "heartbeat_at": now}}
+    )
+    return result.matched_count == 1
+
+
+async def release_lock(db, name: str, owner: str = INSTANCE_ID):
+    await db.job_locks.delete_one({"_id": name, "owner": owner})
+
+
+class JobLock:
+    """
+    Async context manager holding a lease lock for the duration of a job.
+
+        async with JobLock(db, "auto_add_favorites") as lock:
+            if not lock.acquired:
+                return
+            ...
+    """
+
+    def __init__(self, db, name: str, lease_seconds: int = LEASE_SECONDS, heartbeat_seconds: int = HEARTBEAT_SECONDS):
+        self.db = db
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.acquired = False
+        self.lost = False
+        self._heartbeat = None
+        self._holder = None
+
+    async def __aenter__(self):
+        self.acquired = await acquire_lock(self.db, self.name, lease_seconds=self.lease_seconds)
+        if self.acquired:
+            self._holder = asyncio.current_task()
+            self._heartbeat = asyncio.create_task(self._renew_forever())
+        return self
+
+    async def _renew_forever(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                renewed = await renew_lock(self.db, self.name, lease_seconds=self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Heartbeat for job lock {self.name} failed: {e}")
+                continue
+            if not renewed:
+                logger.error(f"Lost job lock {self.name}; cancelling the job on this instance")
+                self.lost = True
+                self._holder.cancel()
+                return
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if not self.acquired:
+            return False
+        self._heartbeat.cancel()
+        if not self.lost:
+            await release_lock(self.db, self.name)
+        # Swallow only the cancellation we caused ourselves
+        return self.lost and exc_type is asyncio.CancelledError
+
+
+async def ensure_job_lock_indexes(db):
+    """Housekeeping only: correctness never depends on expired locks being purged."""
+    await db.job_locks.create_index("expires_at", expireAfterSeconds=3600)
@@ -0,0 +1,173 @@
+"""
+Sharded Job Runner for DealShaq
+- Splits batch jobs into shards by the first hex character of a uuid4 id
+- Runs shards with bounded concurrency
+- Checkpoints per-shard progress in the `job_runs` collection so an interrupted
+  run resumes with the shards it had not finished
+"""
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Any, Callable, Awaitable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Entity ids are str(uuid4()), so the first hex character splits them into 16 even shards
+SHARDS: List[str] = list("0123456789abcdef")
+SHARD_CONCURRENCY = 2  # Low on purpose: shards share the loop with API requests when run in-process
+# A run that still has failed shards after this many attempts is abandoned, so the
+# next run starts fresh (new params) instead of retrying a poisoned shard forever
+MAX_RUN_ATTEMPTS = 3
+
+RUN_RUNNING = "running"
+RUN_COMPLETED = "completed"
+RUN_FAILED = "failed"
+RUN_ABANDONED = "abandoned"
+
+
+def shard_filter(field: str, shard: str) -> Dict[str, Any]:
+    """
+    Mongo filter selecting ids in `shard` (served by the index on `field`).
+
+    The first and last shards are open-ended, so legacy ids that don't start with
+    a lowercase hex character (e.g. uppercase or non-uuid ids) still land in a
+    shard: below "1" goes to "0", "9"-"a" (incl. uppercase) to "9", "f" and up to "f".
+    """
+    index = SHARDS.index(shard)
+    bounds = {}
+    if index > 0:
+        bounds["$gte"] = shard
+    if index < len(SHARDS) - 1:
+        bounds["$lt"] = SHARDS[index + 1]
+    return {field: bounds}
+
+
+async def get_resumable_run(db, job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    The most recent unfinished run of a job, if any.
+
+    A run that has used up MAX_RUN_ATTEMPTS is marked abandoned and not returned.
+    """
+    run = await db.job_runs.find_one(
+        {"job_id": job_id, "status": {"$in": [RUN_RUNNING, RUN_FAILED]}},
+        {"_id": 0},
+        sort=[("started_at", -1)]
+    )
+    if run and run.get("attempts", 1) >= MAX_RUN_ATTEMPTS:
+        logger.warning(f"Abandoning {job_id} run {run['run_id']} after {run.get('attempts', 1)} attempts")
+        await db.job_runs.update_one(
+            {"run_id": run["run_id"]},
+            {"$set": {"status": RUN_ABANDONED, "finished_at": datetime.now(timezone.utc)}}
+        )
+        return None
+    return run
+
+
+async def get_last_completed_run(db, job_id: str) -> Optional[Dict[str, Any]]:
+    """The most recent completed run of a job, if any."""
+    return await db.job_runs.find_one(
+        {"job_id": job_id, "status": RUN_COMPLETED},
+        {"_id": 0},
+        sort=[("started_at", -1)]
+    )
+
+
+async def start_run(db, job_id: str, params: Dict[str, Any], owner: Optional[str] = None) -> Dict[str, Any]:
+    """Create a new run with every shard pending."""
+    run = {
+        "run_id": str(uuid.uuid4()),
+        "job_id": job_id,
+        "status": RUN_RUNNING,
+        "attempts": 1,
+        "owner": owner,
+        "params": params,
+        "shards": {shard: {"status": "pending"} for shard in SHARDS},
+        "started_at": datetime.now(timezone.utc),
+        "finished_at": None,
+    }
+    await db.job_runs.insert_one(dict(run))
+    return run
+
+
+async def run_sharded_job(
+    db,
+    job_id: str,
+    process_shard: Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]],
+    prepare: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None,
+    concurrency: int = SHARD_CONCURRENCY,
+    owner: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Run (or resume) a sharded job.
+
+    `prepare` runs once per new run and returns the run params (persisted, so a
+    resumed run uses the same inputs). `process_shard(shard, params)` returns the
+    shard's stats. `owner` (the lock holder) is recorded on the run for the
+    run history. Returns the final run document.
+    """
+    run = await get_resumable_run(db, job_id)
+    if run:
+        run["attempts"] = run.get("attempts", 1) + 1
+        logger.info(f"Resuming {job_id} run {run['run_id']} (attempt {run['attempts']})")
+        await db.job_runs.update_one(
+            {"run_id": run["run_id"]},
+            {"$set": {"status": RUN_RUNNING, "owner": owner, "attempts": run["attempts"]}}
+        )
+    else:
+        params = await prepare() if prepare else {}
+        run = await start_run(db, job_id, params, owner)
+        logger.info(f"Started {job_id} run {run['run_id']}")
+
+    pending = [shard for shard, state in run["shards"].items() if state["status"] != "done"]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_shard(shard: str):
+        async with semaphore:
+            shard_started = datetime.now(timezone.utc)
+            try:
+                stats = await process_shard(shard, run["params"])
+            except Exception as e:
+                logger.error(f"{job_id} shard {shard} failed: {e}", exc_info=True)
+                run["shards"][shard] = {"status": "failed", "error": str(e)}
+            else:
+                run["shards"][shard] = {
+                    "status": "done",
+                    "stats": stats,
+                    "started_at": shard_started,
+                    "finished_at": datetime.now(timezone.utc),
+                }
+            # Checkpoint after every shard so a crash only repeats in-flight shards
+            await db.job_runs.update_one(
+                {"run_id": run["run_id"]},
+                {"$set": {f"shards.{shard}": run["shards"][shard]}}
+            )
+
+    await asyncio.gather(*(run_shard(shard) for shard in pending))
+
+    failed = [shard for shard, state in run["shards"].items() if state["status"] != "done"]
+    run["status"] = RUN_FAILED if failed else RUN_COMPLETED
+    run["finished_at"] = datetime.now(timezone.utc)
+    await db.job_runs.update_one(
+        {"run_id": run["run_id"]},
+        {"$set": {"status": run["status"], "finished_at": run["finished_at"]}}
+    )
+    logger.info(f"{job_id} run {run['run_id']} {run['status']} ({len(failed)} failed shards)")
+    return run
+
+
+def summarize_run(run: Dict[str, Any]) -> Dict[str, int]:
+    """Sum the numeric stats reported by each completed shard."""
+    totals: Dict[str, int] = {}
+    for state in run["shards"].values():
+        for key, value in state.get("stats", {}).items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+async def ensure_job_runs_indexes(db):
+    await db.job_runs.create_index("run_id", unique=True)
+    await db.job_runs.create_index([("job_id", 1), ("status", 1), ("started_at", -1)])
+    # Only runs that set purge_at (e.g. frequent sweeps) are purged
+    await db.job_runs.create_index("purge_at", expireAfterSeconds=0)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Standalone batch job worker
+
+Runs the nightly scheduler in its own process so batch work never shares an
+event loop with API requests. Start the API with RUN_SCHEDULER_IN_API=false
+when this worker is deployed.
+
+Usage:
+    python job_worker.py                                  # run the scheduler until stopped
+    python job_worker.py --run-once auto_add_favorites    # run (or resume) one job now and exit
+    python job_worker.py --run-once auto_add_favorites --rebuild
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+async def run_worker(run_once: str = None, rebuild: bool = False):
+    from scheduler_service import start_scheduler, process_auto_add_favorites
+    from job_runner_service import ensure_job_runs_indexes
+    from job_lock_service import ensure_job_lock_indexes
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    await ensure_job_runs_indexes(db)
+    await ensure_job_lock_indexes(db)
+
+    try:
+        if run_once == "auto_add_favorites":
+            await process_auto_add_favorites(db, rebuild=rebuild)
+            return
+
+        scheduler = start_scheduler(db)
+        logger.info("Job worker running; press Ctrl+C to stop")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            scheduler.shutdown(wait=False)
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DealShaq batch job worker")
+    parser.add_argument("--run-once", choices=["auto_add_favorites"], help="Run one job immediately and exit")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute purchase-day counters from order history first")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run_worker(args.run_once, args.rebuild))
+    except KeyboardInterrupt:
+        logger.info("Job worker stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Live Retailer Set for DealShaq
+- Which DRLPs consumers may see: store_status "live" (or legacy retailers with no
+  store_status) and an account that is not suspended
+- Cached per worker, refreshed on every store/account status transition and on a short TTL
+- Denormalized onto RSHD items as `retailer_live` so consumer listings filter in the indexed query
+"""
+
+import time
+import asyncio
+import logging
+from typing import Dict, Any, FrozenSet
+
+from feed_cache_service import feed_cache
+from etag_service import bump_versions, RSHD_ITEMS
+
+logger = logging.getLogger(__name__)
+
+STORE_STATUS_LIVE = "live"  # Mirrors server.STORE_STATUS_LIVE
+REFRESH_TTL_SECONDS = 30  # Safety net for transitions made by other workers
+
+
+def live_retailer_query() -> Dict[str, Any]:
+    return {
+        "role": "DRLP",
+        "$or": [{"store_status": STORE_STATUS_LIVE}, {"store_status": {"$exists": False}}],
+        "account_status": {"$ne": "suspended"},
+    }
+
+
+def is_retailer_live(retailer: Dict[str, Any]) -> bool:
+    """Same rule as live_retailer_query, for a user document already in hand."""
+    return (
+        retailer.get("store_status", STORE_STATUS_LIVE) == STORE_STATUS_LIVE
+        and retailer.get("account_status") != "suspended"
+    )
+
+
+class LiveRetailerSet:
+    """Per-worker cache of live DRLP ids."""
+
+    def __init__(self, ttl_seconds: float = REFRESH_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._ids: FrozenSet[str] = frozenset()
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self.refreshes = 0
+
+    async def get(self, db) -> FrozenSet[str]:
+        if time.monotonic() - self._loaded_at > self.ttl_seconds:
+            async with self._lock:
+                # Another request may have refreshed while we waited
+                if time.monotonic() - self._loaded_at > self.ttl_seconds:
+                    await self.refresh(db)
+        return self._ids
+
+    async def refresh(self, db) -> FrozenSet[str]:
+        retailers = await db.users.find(live_retailer_query(), {"_id": 0, "id": 1}).to_list(None)
+        self._ids = frozenset(r["id"] for r in retailers)
+        self._loaded_at = time.monotonic()
+        self.refreshes += 1
+        return self._ids
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "live_retailers": len(self._ids),
+            "refreshes": self.refreshes,
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+        }
+
+
+async def sync_retailer_live(db, retailer_id: str) -> bool:
+    """
+    Re-derive one retailer's visibility after a status transition: update the
+    `retailer_live` flag on its items, refresh this worker's live set and drop
+    the retailer's cached feed.
+    """
+    retailer = await db.users.find_one(
+        {"id": retailer_id}, {"_id": 0, "store_status": 1, "account_status": 1}
+    )
+    live = bool(retailer) and is_retailer_live(retailer)
+    await db.rshd_items.update_many(
+        {"drlp_id": retailer_id, "retailer_live": {"$ne": live}},
+        {"$set": {"retailer_live": live}}
+    )
+    await live_retailers.refresh(db)
+    feed_cache.invalidate(retailer_id)
+    await bump_versions(db, RSHD_ITEMS)
+    logger.info(f"Retailer {retailer_id} visibility synced (live={live})")
+    return live
+
+
+async def ensure_live_retailer_indexes(db):
+    """Consumer listing: live inventory from visible retailers, newest first."""
+    await db.rshd_items.create_index([("status", 1), ("retailer_live", 1), ("posted_at", -1)])
+
+
+# Global cache instance
+live_retailers = LiveRetailerSet()
@@ -0,0 +1,245 @@
+"""
+LLM Gateway for DealShaq
+- Single choke point for every LLM call (categorization, OCR, product analysis)
+- Per-model concurrency limits so a slow provider can't absorb every event-loop task
+- Request deadlines propagated through a context variable
+- Retries with jittered exponential backoff, bounded by the deadline
+- Per-model circuit breaker that fails fast while the provider is erroring
+- Latency histograms per model (see metrics_service)
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Callable, Awaitable, Optional
+
+import metrics_service
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENCY_PER_MODEL = int(os.environ.get("LLM_MAX_CONCURRENCY", "4"))
+DEFAULT_CALL_TIMEOUT = float(os.environ.get("LLM_CALL_TIMEOUT_SECONDS", "30"))
+DEFAULT_RETRIES = 2
+BACKOFF_BASE = 0.5  # seconds
+BACKOFF_CAP = 4.0
+
+# Circuit breaker policy
+BREAKER_WINDOW = 20  # Most recent outcomes considered
+BREAKER_MIN_CALLS = 10  # Don't judge the error rate on fewer calls
+BREAKER_FAILURE_RATE = 0.5
+BREAKER_COOLDOWN = 30.0  # Seconds to stay open before allowing a probe
+
+# Absolute time.monotonic() deadline for the current request, if any
+_deadline: ContextVar[Optional[float]] = ContextVar("llm_deadline", default=None)
+
+
+class LLMUnavailableError(Exception):
+    """The call was not attempted or abandoned: breaker open, deadline spent, or queue wait too long."""
+
+
+@contextmanager
+def llm_deadline(seconds: float):
+    """
+    Bound every LLM call made inside the block (including in tasks it spawns) by
+    one overall deadline. Nested deadlines can only tighten the outer one.
+    """
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    if outer is not None:
+        deadline = min(deadline, outer)
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the current deadline, or None if no deadline is set."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+class CircuitBreaker:
+    """
+    Failure-rate circuit breaker.
+
+    closed -> open when the recent failure rate crosses the threshold;
+    open -> half_open after the cooldown, letting one probe call through;
+    half_open -> closed on success, back to open on failure.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.outcomes: deque = deque(maxlen=BREAKER_WINDOW)
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < BREAKER_COOLDOWN:
+                self.rejected += 1
+                return False
+            self.state = "half_open"
+            self.probe_in_flight = False
+
+        if self.state == "half_open":
+            if self.probe_in_flight:
+                self.rejected += 1
+                return False
+            self.probe_in_flight = True
+        return True
+
+    def record(self, success: bool):
+        if self.state == "half_open":
+            self.probe_in_flight = False
+            if success:
+                logger.info(f"LLM circuit for {self.name} closed")
+                self.state = "closed"
+                self.outcomes.clear()
+            else:
+                self._open()
+            return
+
+        self.outcomes.append(success)
+        failures = self.outcomes.count(False)
+        if len(self.outcomes) >= BREAKER_MIN_CALLS and failures / len(self.outcomes) >= BREAKER_FAILURE_RATE:
+            self._open()
+
+    def _open(self):
+        logger.warning(f"LLM circuit for {self.name} opened")
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.outcomes.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "recent_calls": len(self.outcomes),
+            "recent_failures": self.outcomes.count(False),
+            "rejected": self.rejected,
+        }
+
+
+class LLMGateway:
+    """Concurrency limits, deadlines, retries and circuit breaking for LLM calls, per model."""
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY_PER_MODEL):
+        self.max_concurrency = max_concurrency
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._in_flight: Dict[str, int] = {}
+
+    def _semaphore(self, model: str) -> asyncio.Semaphore:
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[model]
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        if model not in self._breakers:
+            self._breakers[model] = CircuitBreaker(model)
+        return self._breakers[model]
+
+    async def call(
+        self,
+        model: str,
+        send: Callable[[], Awaitable[Any]],
+        timeout: float = DEFAULT_CALL_TIMEOUT,
+        retries: int = DEFAULT_RETRIES
+    ) -> Any:
+        """
+        Run `send` (a zero-argument coroutine factory, invoked once per attempt).
+
+        Raises LLMUnavailableError when the breaker is open or the deadline is
+        spent; otherwise re-raises the last provider error after retries.
+        """
+        breaker = self.breaker(model)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                metrics_service.increment(f"llm.{model}.rejected")
+                raise LLMUnavailableError(f"LLM provider for {model} is unavailable (circuit open)")
+
+            # allow() just handed this call the half-open probe
+            probe = breaker.state == "half_open"
+            try:
+                return await self._attempt(model, send, timeout)
+            except LLMUnavailableError:
+                # Never judged the provider (no slot, deadline spent) - the finally releases a probe
+                raise
+            except Exception as e:
+                breaker.record(False)
+                metrics_service.increment(f"llm.{model}.errors")
+                attempt += 1
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                remaining = remaining_time()
+                if attempt > retries or (remaining is not None and remaining <= delay):
+                    raise
+                logger.warning(f"LLM call to {model} failed ({type(e).__name__}: {e}); retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+            finally:
+                # Also runs on cancellation (client disconnect), which would otherwise wedge the breaker half-open
+                if probe and breaker.state == "half_open":
+                    breaker.probe_in_flight = False
+
+    async def _attempt(self, model: str, send: Callable[[], Awaitable[Any]], timeout: float) -> Any:
+        """One attempt: wait for a slot and call the provider, both within the deadline."""
+        semaphore = self._semaphore(model)
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self._bounded(timeout))
+        except asyncio.TimeoutError:
+            metrics_service.increment(f"llm.{model}.queue_timeouts")
+            raise LLMUnavailableError(f"Timed out waiting for an LLM slot for {model}")
+
+        self._in_flight[model] = self._in_flight.get(model, 0) + 1
+        started = time.monotonic()
+        try:
+            call_timeout = self._bounded(timeout)
+            try:
+                result = await asyncio.wait_for(send(), call_timeout)
+            except asyncio.TimeoutError:
+                if call_timeout >= timeout:
+                    raise
+                # Our deadline ran out, not the provider's patience - don't count it against the breaker
+                metrics_service.increment(f"llm.{model}.deadline_exceeded")
+                raise LLMUnavailableError(f"Request deadline exceeded during LLM call to {model}")
+        finally:
+            self._in_flight[model] -= 1
+            semaphore.release()
+            metrics_service.observe(f"llm.{model}", time.monotonic() - started)
+
+        self.breaker(model).record(True)
+        return result
+
+    @staticmethod
+    def _bounded(timeout: float) -> float:
+        """Clip a timeout to the current deadline."""
+        remaining = remaining_time()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise LLMUnavailableError("Request deadline exceeded before LLM call")
+        return min(timeout, remaining)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            model: {
+                "in_flight": self._in_flight.get(model, 0),
+                "max_concurrency": self.max_concurrency,
+                "circuit": breaker.get_stats(),
+            }
+            for model, breaker in self._breakers.items()
+        }
+
+
+# Global gateway instance
+llm_gateway = LLMGateway()
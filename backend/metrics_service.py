@@ -0,0 +1,96 @@
+"""
+In-Process Metrics for DealShaq
+- Fixed-bucket latency histograms and simple counters, per worker
+- Exposed to admins through /api/admin/metrics
+"""
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Any, Tuple
+
+# Upper bounds (seconds) of the latency buckets; the last bucket is open-ended
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+
+class LatencyHistogram:
+    """Cumulative latency histogram with approximate percentiles."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound of the bucket holding the given fraction of observations."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.50) * 1000, 2),
+            "p95_ms": round(self.percentile(0.95) * 1000, 2),
+            "p99_ms": round(self.percentile(0.99) * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+            "buckets": {
+                **{f"le_{bound}": count for bound, count in zip(self.buckets, self.counts)},
+                "le_inf": self.counts[-1],
+            },
+        }
+
+
+_histograms: Dict[str, LatencyHistogram] = {}
+_counters: Dict[str, int] = {}
+
+
+def get_histogram(name: str) -> LatencyHistogram:
+    """Return the named histogram, creating it on first use."""
+    histogram = _histograms.get(name)
+    if histogram is None:
+        histogram = _histograms[name] = LatencyHistogram()
+    return histogram
+
+
+def observe(name: str, seconds: float):
+    get_histogram(name).observe(seconds)
+
+
+def increment(name: str, amount: int = 1):
+    _counters[name] = _counters.get(name, 0) + amount
+
+
+@contextmanager
+def timed(name: str):
+    """Record the duration of the enclosed block (including failures) in a histogram."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def get_metrics_snapshot() -> Dict[str, Any]:
+    """All histograms and counters for this worker."""
+    return {
+        "latency": {name: histogram.snapshot() for name, histogram in sorted(_histograms.items())},
+        "counters": dict(sorted(_counters.items())),
+    }
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Move embedded users.favorite_items arrays into the favorite_items collection
+
+Favorites now live one document per item, indexed by (dac_id, category). A DAC's
+legacy array is migrated the first time they add or remove a favorite; this
+one-off script migrates everyone else. It is idempotent and can be re-run.
+Once it reports zero remaining users, set FAVORITES_DUAL_READ=false.
+
+Usage:
+    python migrate_favorite_items.py
+"""
+
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+import os
+from dotenv import load_dotenv
+from pathlib import Path
+
+from favorites_service import migrate_all_favorites, ensure_favorite_items_indexes
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+async def migrate_favorite_items():
+    mongo_url = os.environ['MONGO_URL']
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[os.environ['DB_NAME']]
+
+    # The unique (dac_id, item_name_lower) index is what makes re-runs safe
+    await ensure_favorite_items_indexes(db)
+
+    stats = await migrate_all_favorites(db)
+    remaining = await db.users.count_documents({"favorite_items": {"$exists": True}})
+
+    print(f"Migrated {stats['favorites']} favorites from {stats['users']} users")
+    print(f"Users still holding an embedded array: {remaining}")
+
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(migrate_favorite_items())
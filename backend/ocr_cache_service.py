@@ -0,0 +1,168 @@
+"""
+OCR Result Cache for DealShaq
+- Vision model results keyed by a SHA-256 of the normalized base64 image plus the prompt
+- In-process LRU in front of the `ocr_results` MongoDB collection (TTL-purged)
+- Only successful analyses are cached; failures always go back to the model
+"""
+
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+from cachetools import LRUCache
+
+from image_ingest_service import validate_base64_image
+
+logger = logging.getLogger(__name__)
+
+# Cache policy
+OCR_RESULT_TTL = timedelta(days=30)
+MEMORY_CACHE_SIZE = 1000
+HASH_CHUNK_CHARS = 1024 * 1024
+HASH_IN_THREAD_CHARS = 256 * 1024  # Larger images are hashed off the event loop
+
+KIND_PRICE = "extract_price"
+KIND_PRODUCT = "analyze_product"
+
+
+def _as_utc(value: datetime) -> datetime:
+    """Motor returns naive UTC datetimes - normalize for comparisons."""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def content_hash(image_base64: str, kind: str, prompt: Optional[str] = None) -> str:
+    """
+    Cache key for an analysis request.
+
+    Hashes the base64 text as returned by validate_base64_image (data URI prefix
+    stripped) together with the analysis kind and the prompt. The image is never
+    decoded; it is fed to the digest in bounded chunks.
+    """
+    digest = hashlib.sha256()
+    digest.update(kind.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update((prompt or "").strip().encode("utf-8"))
+    digest.update(b"\0")
+    for start in range(0, len(image_base64), HASH_CHUNK_CHARS):
+        digest.update(image_base64[start:start + HASH_CHUNK_CHARS].encode("ascii"))
+    return digest.hexdigest()
+
+
+class OCRResultCache:
+    """
+    Two-tier cache for vision model results.
+
+    - Tier 1: in-process LRU (per worker), no I/O
+    - Tier 2: `ocr_results` collection shared by all workers
+    """
+
+    def __init__(self, maxsize: int = MEMORY_CACHE_SIZE):
+        self._memory: LRUCache = LRUCache(maxsize=maxsize)
+        self.stats = {
+            "memory_hits": 0,
+            "db_hits": 0,
+            "misses": 0,
+        }
+
+    async def get_cached(self, db, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached result for the key, or None on a miss."""
+        tier = "memory_hits"
+        entry = self._memory.get(key)
+        if entry is None:
+            tier = "db_hits"
+            entry = await db.ocr_results.find_one({"key": key}, {"_id": 0})
+            if entry is None:
+                return None
+
+        if datetime.now(timezone.utc) - _as_utc(entry["created_at"]) > OCR_RESULT_TTL:
+            self._memory.pop(key, None)
+            return None
+
+        self._memory[key] = entry
+        self.stats[tier] += 1
+        return {**entry["result"], "cached": True}
+
+    async def store(self, db, key: str, kind: str, result: Dict[str, Any]):
+        """Cache a successful result in both tiers."""
+        now = datetime.now(timezone.utc)
+        entry = {
+            "key": key,
+            "kind": kind,
+            "result": result,
+            "created_at": now,
+            "purge_at": now + OCR_RESULT_TTL,
+        }
+        self._memory[key] = entry
+        await db.ocr_results.update_one({"key": key}, {"$set": entry}, upsert=True)
+
+    async def get_or_analyze(
+        self,
+        db,
+        kind: str,
+        image_base64: str,
+        analyze: Callable[[str], Awaitable[Dict[str, Any]]],
+        prompt: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Serve a repeat image from cache, otherwise run `analyze` and cache a success.
+
+        The image is validated here, once; `analyze` receives the normalized base64.
+        """
+        validated = validate_base64_image(image_base64)
+        if not validated["success"]:
+            return validated
+        image_base64 = validated["image_base64"]
+
+        try:
+            if len(image_base64) >= HASH_IN_THREAD_CHARS:
+                key = await asyncio.to_thread(content_hash, image_base64, kind, prompt)
+            else:
+                key = content_hash(image_base64, kind, prompt)
+        except UnicodeEncodeError:
+            return {"success": False, "error": "Invalid base64 encoding: non-ASCII characters"}
+
+        cached = await self.get_cached(db, key)
+        if cached is not None:
+            return cached
+
+        self.stats["misses"] += 1
+        result = await analyze(image_base64)
+        if result.get("success"):
+            await self.store(db, key, kind, result)
+        return {**result, "cached": False}
+
+    async def extract_price(self, db, image_base64: str, prompt: Optional[str] = None) -> Dict[str, Any]:
+        """Cached extract_text_from_image."""
+        from barcode_ocr_service import extract_text_from_image
+        return await self.get_or_analyze(
+            db, KIND_PRICE, image_base64,
+            lambda image: extract_text_from_image(image, prompt),
+            prompt
+        )
+
+    async def analyze_product(self, db, image_base64: str) -> Dict[str, Any]:
+        """Cached analyze_product_image."""
+        from barcode_ocr_service import analyze_product_image
+        return await self.get_or_analyze(db, KIND_PRODUCT, image_base64, analyze_product_image)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current memory tier size."""
+        hits = self.stats["memory_hits"] + self.stats["db_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "memory_entries": len(self._memory),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+async def ensure_ocr_cache_indexes(db):
+    """Unique content key plus TTL purge of expired results."""
+    await db.ocr_results.create_index("key", unique=True)
+    await db.ocr_results.create_index("purge_at", expireAfterSeconds=0)
+
+
+# Global cache instance
+ocr_cache = OCRResultCache()
@@ -0,0 +1,52 @@
+"""
+Password Hashing for DealShaq
+- bcrypt costs 100-300 ms of CPU per call; hashing and verification run on a
+  small thread pool (bcrypt releases the GIL) instead of the event loop
+- The pool size caps concurrent bcrypt work per API worker; bursts queue up
+  without stalling unrelated requests
+- Queue wait and total latency are recorded separately in metrics_service
+"""
+
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+import metrics_service
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_CONCURRENCY', str(min(4, os.cpu_count() or 1))))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+
+async def _run(metric: str, fn, *args):
+    loop = asyncio.get_running_loop()
+    submitted = time.perf_counter()
+
+    def work():
+        # Only time on the worker; metrics_service isn't thread-safe, so observe on the loop
+        return time.perf_counter(), fn(*args)
+
+    with metrics_service.timed(metric):
+        started, result = await loop.run_in_executor(_executor, work)
+    metrics_service.observe(f"{metric}.queue_wait", started - submitted)
+    return result
+
+
+async def hash_password(password: str) -> str:
+    return await _run("auth.password_hash", pwd_context.hash, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run("auth.password_verify", pwd_context.verify, plain_password, hashed_password)
+
+
+def shutdown_password_executor():
+    _executor.shutdown(wait=False)
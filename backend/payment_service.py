@@ -0,0 +1,80 @@
+"""
+Stripe Payments for DealShaq
+- The Stripe SDK is synchronous; calls run on a small dedicated thread pool so a
+  slow payment round trip never blocks the event loop (other requests, WebSockets)
+- Each call is bounded by the HTTP client's own timeout, so the request that
+  started a charge always learns its outcome - nothing is abandoned mid-flight
+- Idempotency keys derive from the order id, so network retries cannot double-charge
+"""
+
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import stripe
+
+import metrics_service
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_WORKERS = int(os.environ.get('STRIPE_MAX_CONCURRENCY', '8'))
+STRIPE_TIMEOUT = 30.0  # seconds per HTTP request to Stripe
+STRIPE_NETWORK_RETRIES = 2  # Safe: every request carries an idempotency key
+
+_executor = ThreadPoolExecutor(max_workers=PAYMENT_WORKERS, thread_name_prefix="stripe")
+
+stripe.max_network_retries = STRIPE_NETWORK_RETRIES
+stripe.default_http_client = stripe.new_default_http_client(timeout=STRIPE_TIMEOUT)
+
+
+def order_idempotency_key(order_id: str, action: str = "payment") -> str:
+    return f"order-{order_id}-{action}"
+
+
+async def _call(metric: str, fn, *args, **kwargs) -> Any:
+    loop = asyncio.get_running_loop()
+    try:
+        with metrics_service.timed(metric):
+            return await loop.run_in_executor(_executor, lambda: fn(*args, **kwargs))
+    except stripe.error.APIConnectionError:
+        # Timeouts and connection failures (after the SDK's own retries)
+        metrics_service.increment(f"{metric}.timeouts")
+        raise
+    except stripe.error.StripeError:
+        metrics_service.increment(f"{metric}.errors")
+        raise
+
+
+async def create_payment_intent(order_id: str, amount_cents: int, payment_method_id: str):
+    """Create and confirm the PaymentIntent for an order. Raises stripe.error.StripeError."""
+    return await _call(
+        "stripe.payment_intent.create",
+        stripe.PaymentIntent.create,
+        amount=amount_cents,
+        currency="usd",
+        payment_method=payment_method_id,
+        confirm=True,
+        automatic_payment_methods={
+            "enabled": True,
+            "allow_redirects": "never"
+        },
+        metadata={"order_id": order_id},
+        idempotency_key=order_idempotency_key(order_id),
+    )
+
+
+async def refund_payment_intent(order_id: str, payment_intent_id: str):
+    """Fully refund an order's PaymentIntent. Raises stripe.error.StripeError."""
+    return await _call(
+        "stripe.refund.create",
+        stripe.Refund.create,
+        payment_intent=payment_intent_id,
+        metadata={"order_id": order_id},
+        idempotency_key=order_idempotency_key(order_id, "refund"),
+    )
+
+
+def shutdown_payment_executor():
+    _executor.shutdown(wait=False)
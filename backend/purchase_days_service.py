@@ -0,0 +1,139 @@
+"""
+Purchase-Day Counters for DealShaq
+- One small document per (DAC, item name) in `purchase_days`
+- `days` holds the distinct purchase days (days since the Unix epoch) within the
+  auto-add window, maintained by create_order with a single pipeline update
+- `changed_at` lets the nightly auto-add job look only at counters touched since its last run
+"""
+
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+AUTO_ADD_WINDOW_DAYS = 21
+MIN_AUTO_FAVORITE_THRESHOLD = 3  # Smallest non-zero auto_favorite_threshold (0, 3 or 6)
+
+
+def epoch_day(moment: datetime) -> int:
+    """Whole UTC days since 1970-01-01."""
+    return int(moment.timestamp() // 86400)
+
+
+def days_in_window(days: List[int], now: datetime) -> int:
+    """Purchase days still inside the auto-add window as of `now` (stored counts may be stale)."""
+    today = epoch_day(now)
+    return sum(1 for day in days if day > today - AUTO_ADD_WINDOW_DAYS)
+
+
+def _pruned_days(today: int) -> Dict:
+    """Aggregation expression: the counter's days still inside the window ending `today`."""
+    return {"$filter": {
+        "input": {"$ifNull": ["$days", []]},
+        "cond": {"$gt": ["$$this", today - AUTO_ADD_WINDOW_DAYS]}
+    }}
+
+
+def purchase_day_update(dac_id: str, item_name: str, rshd_id: str, purchased_at: datetime) -> UpdateOne:
+    """
+    Upsert that adds `purchased_at`'s day to the counter and drops days that left the window.
+
+    Written as an update pipeline so the prune, the set-union and the count happen
+    atomically on the server.
+    """
+    today = epoch_day(purchased_at)
+    return UpdateOne(
+        {"dac_id": dac_id, "item_name": item_name},
+        [
+            {"$set": {
+                "rshd_id": rshd_id,
+                "days": {"$setUnion": [_pruned_days(today), [today]]},
+                "changed_at": purchased_at
+            }},
+            {"$set": {"day_count": {"$size": "$days"}}}
+        ],
+        upsert=True
+    )
+
+
+async def record_order_purchase_days(db, order: Dict):
+    """Update the purchase-day counters for every distinct item in a new order."""
+    purchased_at = datetime.fromisoformat(order["created_at"])
+    latest_rshd_ids = {item["name"]: item["rshd_id"] for item in order["items"]}
+    operations = [
+        purchase_day_update(order["dac_id"], item_name, rshd_id, purchased_at)
+        for item_name, rshd_id in latest_rshd_ids.items()
+    ]
+    if operations:
+        await db.purchase_days.bulk_write(operations, ordered=False)
+
+
+async def reprune_purchase_days(db, dac_id: str, now: datetime):
+    """
+    Drop a DAC's purchase days that have left the window as of `now` and mark
+    their counters changed, so the nightly job re-checks them on fresh counts.
+    """
+    await db.purchase_days.update_many(
+        {"dac_id": dac_id},
+        [
+            {"$set": {"days": _pruned_days(epoch_day(now)), "changed_at": now}},
+            {"$set": {"day_count": {"$size": "$days"}}}
+        ]
+    )
+
+
+def rebuild_pipeline(now: datetime) -> List[Dict]:
+    """Recompute every counter from the last window of orders and merge into `purchase_days`.
+
+    `created_at` is an ISO-8601 UTC string, so its first 10 characters are the purchase day.
+    """
+    since = now - timedelta(days=AUTO_ADD_WINDOW_DAYS)
+    return [
+        {"$match": {"created_at": {"$gte": since.isoformat()}}},
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": {"dac_id": "$dac_id", "item_name": "$items.name"},
+            "days": {"$addToSet": {"$floor": {"$divide": [
+                {"$toLong": {"$dateFromString": {
+                    "dateString": {"$substrBytes": ["$created_at", 0, 10]},
+                    "format": "%Y-%m-%d"
+                }}},
+                86400000
+            ]}}},
+            "rshd_id": {"$last": "$items.rshd_id"}
+        }},
+        {"$project": {
+            "_id": 0,
+            "dac_id": "$_id.dac_id",
+            "item_name": "$_id.item_name",
+            "rshd_id": 1,
+            "days": 1,
+            "day_count": {"$size": "$days"},
+            "changed_at": now
+        }},
+        {"$merge": {
+            "into": "purchase_days",
+            "on": ["dac_id", "item_name"],
+            "whenMatched": "merge",
+            "whenNotMatched": "insert"
+        }}
+    ]
+
+
+async def rebuild_purchase_days(db) -> datetime:
+    """Full rescan of recent orders into the counters (first run, or after data repair)."""
+    now = datetime.now(timezone.utc)
+    await ensure_purchase_days_indexes(db)
+    # $merge produces no output documents; draining the cursor runs the pipeline
+    await db.orders.aggregate(rebuild_pipeline(now), allowDiskUse=True).to_list(None)
+    logger.info("Rebuilt purchase-day counters from order history")
+    return now
+
+
+async def ensure_purchase_days_indexes(db):
+    """Counter key (also required by the rebuild's $merge) and change-feed index."""
+    await db.purchase_days.create_index([("dac_id", 1), ("item_name", 1)], unique=True)
+    await db.purchase_days.create_index([("changed_at", 1), ("day_count", 1)])
@@ -0,0 +1,171 @@
+"""
+API Response Encoding for DealShaq
+- orjson serialization (default response class for the app)
+- Trusted list responses: DB documents projected to a response model's fields are
+  returned without Pydantic re-validation or jsonable_encoder passes
+- Negotiated brotli/gzip compression for complete responses above a size threshold;
+  streamed responses (NDJSON) pass through untouched so lines are not held back
+"""
+
+import gzip
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Type
+
+import brotli
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+
+import metrics_service
+
+logger = logging.getLogger(__name__)
+
+MIN_COMPRESS_SIZE = 1024  # bytes; smaller bodies aren't worth the CPU or the header
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4  # Fast levels: these are dynamic responses, not static assets
+OFFLOAD_SIZE = 256 * 1024  # Compress larger bodies in a thread, off the event loop
+SKIP_CONTENT_TYPES = ("application/x-ndjson", "text/event-stream")
+
+
+# ===== TRUSTED RESPONSES =====
+
+@lru_cache(maxsize=None)
+def model_projection(model: Type[BaseModel]) -> Dict[str, int]:
+    """Mongo projection returning exactly the model's fields."""
+    return {"_id": 0, **{name: 1 for name in model.model_fields}}
+
+
+@lru_cache(maxsize=None)
+def _model_defaults(model: Type[BaseModel]) -> Dict[str, Any]:
+    return {
+        name: field.get_default(call_default_factory=True)
+        for name, field in model.model_fields.items()
+        if not field.is_required()
+    }
+
+
+def trusted_json(
+    docs: List[Dict[str, Any]],
+    model: Optional[Type[BaseModel]] = None,
+    response: Optional[Response] = None
+) -> ORJSONResponse:
+    """
+    Serialize our own DB documents directly. Fetch them with model_projection(model)
+    so the shape matches the declared response_model; optional fields the document
+    lacks get the model default, as validation would have filled in.
+    Headers already set on the endpoint's injected `response` (ETag etc.) are kept.
+    """
+    if model is not None:
+        defaults = _model_defaults(model)
+        for doc in docs:
+            for name, default in defaults.items():
+                doc.setdefault(name, default)
+
+    headers = None
+    if response is not None:
+        headers = {
+            key: value for key, value in response.headers.items()
+            if key not in ("content-length", "content-type")
+        }
+    return ORJSONResponse(docs, headers=headers)
+
+
+# ===== COMPRESSION =====
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Preferred supported coding from an Accept-Encoding header (q=0 means refused)."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+
+    for coding in ("br", "gzip"):
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """
+    Compress single-message HTTP responses when the client accepts it.
+
+    Only responses delivered in one body message are compressed; anything streamed
+    (more_body=True) is forwarded as-is, which keeps NDJSON streams incremental.
+    """
+
+    def __init__(self, app, minimum_size: int = MIN_COMPRESS_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = Headers(raw=message["headers"])
+                passthrough = (
+                    "content-encoding" in headers
+                    or headers.get("content-type", "").startswith(SKIP_CONTENT_TYPES)
+                )
+                return
+
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            if passthrough or message.get("more_body", False):
+                # Streamed or not compressible: forward untouched from here on
+                if start_message is not None:
+                    await send(start_message)
+                    start_message = None
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start_message["headers"])
+            if len(body) >= self.minimum_size:
+                if len(body) >= OFFLOAD_SIZE:
+                    compressed = await asyncio.to_thread(compress, body, encoding)
+                else:
+                    compressed = compress(body, encoding)
+                metrics_service.increment(f"http.compressed.{encoding}")
+                metrics_service.increment("http.compressed.bytes_saved", len(body) - len(compressed))
+                body = compressed
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+
+            await send(start_message)
+            start_message = None
+            await send({"type": "http.response.body", "body": body, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,5 +1,6 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timezone, timedelta
 import os
@@ -10,127 +11,212 @@ from collections import defaultdict
 logger = logging.getLogger(__name__)
 
 
-async def process_auto_add_favorites(db):
+AUTO_ADD_JOB_ID = "auto_add_favorites"
+MIN_RUN_INTERVAL = timedelta(hours=1)
+
+
+def _as_utc(value: datetime) -> datetime:
+    """Motor returns naive UTC datetimes - normalize for comparisons."""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+async def process_auto_add_favorites(db, rebuild: bool = False):
     """Daily job to auto-add items to DACFI-List based on purchase history.
     
     Runs at 11 PM daily.
     Checks last 21 days of purchases for each DAC.
     Adds items purchased on threshold days (3 or 6 separate days).
+    
+    create_order keeps per-(DAC, item) purchase-day counters current, so the job
+    only checks counters that changed since its last successful run. The first run
+    (or rebuild=True) recomputes all counters from the order history.
+    
+    Work is split into DAC id shards and checkpointed in job_runs; an interrupted
+    run resumes with its unfinished shards.
     """
+    from job_lock_service import JobLock, INSTANCE_ID
+    
+    # Every API worker runs this scheduler; the lease lock lets exactly one execute the run
+    async with JobLock(db, AUTO_ADD_JOB_ID) as lock:
+        if not lock.acquired:
+            logger.info("Auto-add favorites job is running on another instance; skipping")
+            return
+        await _run_auto_add_favorites(db, rebuild, INSTANCE_ID)
+
+
+async def _run_auto_add_favorites(db, rebuild: bool, owner: str):
     logger.info("Starting auto-add favorites job")
     
     try:
-        # Get all DACs with auto_favorite_threshold > 0
-        users = await db.users.find(
-            {"role": "DAC", "auto_favorite_threshold": {"$gt": 0}},
-            {"_id": 0}
-        ).to_list(10000)
+        from job_runner_service import (
+            run_sharded_job, summarize_run, get_resumable_run, get_last_completed_run, RUN_COMPLETED
+        )
+        from purchase_days_service import rebuild_purchase_days, AUTO_ADD_WINDOW_DAYS
         
-        logger.info(f"Found {len(users)} DACs with auto-add enabled")
+        # A slower instance whose trigger fires just after another finished shouldn't start a second run
+        last_run = await get_last_completed_run(db, AUTO_ADD_JOB_ID)
+        if (
+            not rebuild
+            and last_run
+            and not await get_resumable_run(db, AUTO_ADD_JOB_ID)
+            and datetime.now(timezone.utc) - _as_utc(last_run["started_at"]) < MIN_RUN_INTERVAL
+        ):
+            logger.info(f"Auto-add favorites already ran at {last_run['started_at']}; skipping")
+            return
         
-        # Calculate 21 days ago
-        twenty_one_days_ago = datetime.now(timezone.utc) - timedelta(days=21)
+        async def prepare():
+            started_at = datetime.now(timezone.utc)
+            state = await db.scheduler_state.find_one({"_id": AUTO_ADD_JOB_ID})
+            if rebuild or not state:
+                await rebuild_purchase_days(db)
+                changed_since = started_at - timedelta(days=AUTO_ADD_WINDOW_DAYS)
+            else:
+                changed_since = state["last_success_at"]
+            return {"started_at": started_at, "changed_since": changed_since}
         
-        for user in users:
-            dac_id = user["id"]
-            threshold = user["auto_favorite_threshold"]
-            
-            logger.info(f"Processing DAC {dac_id} with threshold {threshold}")
-            
-            # Get orders from last 21 days
-            orders = await db.orders.find(
-                {
-                    "dac_id": dac_id,
-                    "created_at": {"$gte": twenty_one_days_ago.isoformat()}
-                },
-                {"_id": 0}
-            ).to_list(10000)
-            
-            if not orders:
-                logger.info(f"No orders found for DAC {dac_id} in last 21 days")
-                continue
-            
-            # Get current favorite items
-            current_favorites = user.get("favorite_items", [])
-            favorite_item_names = {fav["item_name"].lower() for fav in current_favorites}
-            
-            # Track unique days each item was purchased
-            # Structure: {item_name: {category: str, dates: set()}}
-            item_purchase_days = defaultdict(lambda: {"category": None, "dates": set()})
-            
-            for order in orders:
-                order_date = datetime.fromisoformat(order["created_at"]).date()
-                
-                for item in order["items"]:
-                    item_name = item["name"]
-                    item_name_lower = item_name.lower()
-                    
-                    # Skip if already in favorites
-                    if item_name_lower in favorite_item_names:
-                        continue
-                    
-                    # Get item details from rshd_items to find category
-                    rshd_item = await db.rshd_items.find_one(
-                        {"id": item["rshd_id"]},
-                        {"_id": 0, "category": 1}
-                    )
-                    
-                    if rshd_item:
-                        item_purchase_days[item_name]["category"] = rshd_item["category"]
-                        item_purchase_days[item_name]["dates"].add(order_date)
-            
-            # Find items that meet the threshold
-            items_to_add = []
-            
-            for item_name, data in item_purchase_days.items():
-                unique_days = len(data["dates"])
-                
-                if unique_days >= threshold:
-                    # Extract keywords for matching
-                    from categorization_service import extract_keywords, detect_attributes
-                    
-                    keywords = extract_keywords(item_name)
-                    attributes = detect_attributes(item_name)
-                    
-                    items_to_add.append({
-                        "item_name": item_name,
-                        "category": data["category"],
-                        "keywords": keywords,
-                        "attributes": attributes,
-                        "auto_added_date": datetime.now(timezone.utc).isoformat()
-                    })
-                    
-                    logger.info(
-                        f"Auto-adding '{item_name}' for DAC {dac_id} "
-                        f"(purchased on {unique_days} separate days)"
-                    )
-            
-            # Update user's favorite_items (auto-added items don't have brand specified)
-            if items_to_add:
-                # Note: Auto-added items from purchases won't have brand separation
-                # They are added as generic items (has_brand=False) for flexible matching
-                for item in items_to_add:
-                    item["has_brand"] = False
-                    item["brand"] = None
-                    item["generic"] = item["item_name"]
-                    item["brand_keywords"] = []
-                    # generic_keywords are already set from extract_keywords
-                
-                result = await db.users.update_one(
-                    {"id": dac_id},
-                    {"$push": {"favorite_items": {"$each": items_to_add}}}
-                )
-                
-                logger.info(
-                    f"Added {len(items_to_add)} items to DAC {dac_id}'s DACFI-List (auto-add)"
-                )
+        async def process_shard(shard, params):
+            return await auto_add_favorites_shard(db, shard, params["changed_since"])
         
-        logger.info("Auto-add favorites job completed successfully")
+        run = await run_sharded_job(db, AUTO_ADD_JOB_ID, process_shard, prepare, owner=owner)
+        
+        if run["status"] == RUN_COMPLETED:
+            # Counters changed while this run was in progress are picked up next time
+            await db.scheduler_state.update_one(
+                {"_id": AUTO_ADD_JOB_ID},
+                {"$set": {"last_success_at": run["params"]["started_at"]}},
+                upsert=True
+            )
+            logger.info(f"Auto-add favorites job completed successfully: {summarize_run(run)}")
+        else:
+            logger.warning(f"Auto-add favorites run {run['run_id']} incomplete; it will resume on the next trigger")
     
     except Exception as e:
         logger.error(f"Error in auto-add favorites job: {str(e)}", exc_info=True)
 
 
+async def auto_add_favorites_shard(db, shard: str, changed_since: datetime) -> Dict[str, int]:
+    """Auto-add favorites for the DACs in one id shard. Safe to re-run."""
+    from categorization_service import extract_keywords, detect_attributes
+    from job_runner_service import shard_filter
+    from purchase_days_service import MIN_AUTO_FAVORITE_THRESHOLD, days_in_window
+    from favorites_service import get_favorite_names, add_favorites_bulk
+    
+    counters = await db.purchase_days.find(
+        {
+            "changed_at": {"$gte": changed_since},
+            "day_count": {"$gte": MIN_AUTO_FAVORITE_THRESHOLD},
+            **shard_filter("dac_id", shard)
+        },
+        {"_id": 0, "dac_id": 1, "item_name": 1, "rshd_id": 1, "days": 1}
+    ).to_list(None)
+    
+    # Stored day_count was pruned at the last purchase; recount against today's window
+    now = datetime.now(timezone.utc)
+    for counter in counters:
+        counter["day_count"] = days_in_window(counter.get("days", []), now)
+    
+    # Only the DACs behind changed counters: threshold and existing favorite names
+    thresholds = {}
+    favorite_names = {}
+    if counters:
+        async for user in db.users.find(
+            {
+                "id": {"$in": list({counter["dac_id"] for counter in counters})},
+                "role": "DAC",
+                "auto_favorite_threshold": {"$gt": 0}
+            },
+            {"_id": 0, "id": 1, "auto_favorite_threshold": 1}
+        ):
+            thresholds[user["id"]] = user["auto_favorite_threshold"]
+        # Existing favorites are skipped, which also makes a resumed shard idempotent
+        favorite_names = await get_favorite_names(db, thresholds)
+    
+    candidates = [
+        counter for counter in counters
+        if counter["day_count"] >= thresholds.get(counter["dac_id"], float("inf"))
+        and counter["item_name"].lower() not in favorite_names[counter["dac_id"]]
+    ]
+    
+    # Preload categories for every qualifying item
+    categories = {}
+    if candidates:
+        async for item in db.rshd_items.find(
+            {"id": {"$in": list({counter["rshd_id"] for counter in candidates})}},
+            {"_id": 0, "id": 1, "category": 1}
+        ):
+            categories[item["id"]] = item["category"]
+    
+    items_by_dac = defaultdict(list)
+    auto_added_date = now.isoformat()
+    for counter in candidates:
+        category = categories.get(counter["rshd_id"])
+        if category is None:
+            continue
+        
+        item_name = counter["item_name"]
+        # Auto-added items from purchases won't have brand separation
+        # They are added as generic items (has_brand=False) for flexible matching
+        items_by_dac[counter["dac_id"]].append({
+            "item_name": item_name,
+            "category": category,
+            "keywords": extract_keywords(item_name),
+            "attributes": detect_attributes(item_name),
+            "auto_added_date": auto_added_date,
+            "has_brand": False,
+            "brand": None,
+            "generic": item_name,
+            "brand_keywords": []
+        })
+        logger.info(
+            f"Auto-adding '{item_name}' for DAC {counter['dac_id']} "
+            f"(purchased on {counter['day_count']} separate days)"
+        )
+    
+    await add_favorites_bulk(db, items_by_dac)
+    if items_by_dac:
+        from etag_service import bump_versions, favorites_key
+        await bump_versions(db, *(favorites_key(dac_id) for dac_id in items_by_dac))
+    
+    return {
+        "changed_counters": len(counters),
+        "items_added": sum(len(items) for items in items_by_dac.values()),
+        "dacs_updated": len(items_by_dac),
+    }
+
+
+async def run_expiry_sweep(db):
+    """Flip expired deals to `expired` (one instance per cluster)."""
+    from job_lock_service import JobLock
+    from expiry_service import sweep_expired_items, SWEEP_JOB_ID
+    
+    try:
+        async with JobLock(db, SWEEP_JOB_ID) as lock:
+            if lock.acquired:
+                await sweep_expired_items(db)
+    except Exception as e:
+        logger.error(f"Error in expiry sweep: {str(e)}", exc_info=True)
+
+
+async def run_hold_release(db):
+    """Return stock held by checkouts that never finished (one instance per cluster)."""
+    from job_lock_service import JobLock
+    from inventory_service import release_stale_holds, RELEASE_JOB_ID
+    
+    try:
+        async with JobLock(db, RELEASE_JOB_ID) as lock:
+            if lock.acquired:
+                await release_stale_holds(db)
+    except Exception as e:
+        logger.error(f"Error releasing stale inventory holds: {str(e)}", exc_info=True)
+
+
+async def resume_interrupted_jobs(db):
+    """Pick up a run that was cut short by a restart instead of waiting for its next trigger."""
+    from job_runner_service import get_resumable_run
+    if await get_resumable_run(db, AUTO_ADD_JOB_ID):
+        await process_auto_add_favorites(db)
+
+
 def start_scheduler(db):
     """Initialize and start the APScheduler."""
     scheduler = AsyncIOScheduler()
@@ -145,7 +231,38 @@ def start_scheduler(db):
         replace_existing=True
     )
     
+    # Expire deals past their expiry_date every few minutes
+    from expiry_service import SWEEP_INTERVAL_MINUTES
+    scheduler.add_job(
+        run_expiry_sweep,
+        trigger=IntervalTrigger(minutes=SWEEP_INTERVAL_MINUTES),
+        args=[db],
+        id="expire_rshd_items",
+        name="Expire RSHD items past their expiry date",
+        replace_existing=True
+    )
+    
+    # Release inventory held by abandoned checkouts
+    from inventory_service import RELEASE_INTERVAL_MINUTES
+    scheduler.add_job(
+        run_hold_release,
+        trigger=IntervalTrigger(minutes=RELEASE_INTERVAL_MINUTES),
+        args=[db],
+        id="release_stale_holds",
+        name="Release expired inventory holds",
+        replace_existing=True
+    )
+    
+    # Resume anything interrupted by the last shutdown
+    scheduler.add_job(
+        resume_interrupted_jobs,
+        args=[db],
+        id="resume_interrupted_jobs",
+        name="Resume interrupted job runs",
+        replace_existing=True
+    )
+    
     scheduler.start()
-    logger.info("Scheduler started - Auto-add job scheduled for 11 PM daily")
+    logger.info("Scheduler started - Auto-add job scheduled for 11 PM daily, expiry sweep every 5 minutes")
     
     return scheduler
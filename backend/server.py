@@ -1,21 +1,23 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, WebSocket, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, WebSocket, Query, UploadFile, File, Form, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError
 from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime, timezone, timedelta
-from passlib.context import CryptContext
 import jwt
 import stripe
 import resend
 import secrets
 import hashlib
+import json
 import re
 
 ROOT_DIR = Path(__file__).parent
@@ -31,9 +33,6 @@ SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-product
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # Stripe configuration
 stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
 
@@ -46,7 +45,7 @@ FRONTEND_URL = os.environ.get('FRONTEND_URL', 'https://dealshaq.com')
 security = HTTPBearer()
 
 # Create the main app
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 # Logging
@@ -175,6 +174,30 @@ class RSHDItemCreate(BaseModel):
     image_url: Optional[str] = ""
     is_taxable: bool = True
     attributes: Optional[Dict[str, Any]] = {}  # organic, gluten-free, etc.
+    expiry_date: Optional[str] = None  # ISO date or datetime; deal expires after this
+
+class RSHDItemUpdate(BaseModel):
+    """Fields a DRLP may edit on a posted item; everything else is derived or server-owned"""
+    name: Optional[str] = None
+    description: Optional[str] = None
+    category: Optional[str] = None
+    subcategory: Optional[str] = None
+    regular_price: Optional[float] = None
+    discount_level: Optional[int] = None
+    quantity: Optional[int] = None
+    barcode: Optional[str] = None
+    weight: Optional[float] = None
+    image_url: Optional[str] = None
+    is_taxable: Optional[bool] = None
+    attributes: Optional[Dict[str, Any]] = None
+    expiry_date: Optional[str] = None
+
+# Never taken from an update payload: identity, pricing and match features are derived,
+# retailer_live is the go-live gate, status/holds belong to the sweeper and checkout
+SERVER_OWNED_ITEM_FIELDS = {
+    "id", "drlp_id", "drlp_name", "drlp_address", "posted_at", "status", "retailer_live",
+    "match_keys", "expires_at", "holds", "drlp_discount_percent", "consumer_discount_percent", "deal_price"
+}
 
 class RSHDItem(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -198,7 +221,8 @@ class RSHDItem(BaseModel):
     is_taxable: bool
     attributes: Optional[Dict[str, Any]] = {}  # organic, gluten-free, etc.
     posted_at: str
-    status: str = "available"
+    expiry_date: Optional[str] = None
+    status: str = "available"  # available, unavailable, expired, admin_removed, retailer_suspended
 
 # Item-Level Favorite Models (DACFI-List)
 class FavoriteItemCreate(BaseModel):
@@ -266,11 +290,14 @@ class Notification(BaseModel):
 
 # ===== HELPER FUNCTIONS =====
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    # bcrypt runs on the password thread pool, never on the event loop
+    import password_service
+    return await password_service.hash_password(password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    import password_service
+    return await password_service.verify_password(plain_password, hashed_password)
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
@@ -287,7 +314,9 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
         
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        # Slim principal (no password_hash / favorite_items), cached per worker
+        from user_cache_service import user_cache
+        user = await user_cache.get(db, user_id)
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
         return user
@@ -586,13 +615,12 @@ async def register(user_data: UserCreate):
     
     user_dict = user_data.model_dump()
     user_dict["id"] = str(uuid.uuid4())
-    user_dict["password_hash"] = hash_password(user_data.password)
+    user_dict["password_hash"] = await hash_password(user_data.password)
     user_dict["created_at"] = datetime.now(timezone.utc).isoformat()
     user_dict["notification_prefs"] = {"email": True, "push": True, "sms": False}
     
     # Initialize Enhanced DACFI-List fields for DAC users
     if user_data.role == "DAC":
-        user_dict["favorite_items"] = []
         user_dict["auto_favorite_threshold"] = 0  # Default: Never
     
     # Initialize store_status for DRLP users (Sandbox feature)
@@ -637,7 +665,7 @@ async def login(credentials: UserLogin):
         else:
             raise HTTPException(status_code=401, detail="Invalid email or password")
     
-    if not verify_password(credentials.password, user["password_hash"]):
+    if not await verify_password(credentials.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     access_token = create_access_token(data={"sub": user["id"]})
@@ -652,7 +680,9 @@ async def login(credentials: UserLogin):
 
 @api_router.get("/auth/me", response_model=User)
 async def get_me(current_user: Dict = Depends(get_current_user)):
-    return current_user
+    # The cached principal omits favorites; this is the one endpoint that returns them
+    from favorites_service import get_favorites
+    return {**current_user, "favorite_items": await get_favorites(db, current_user["id"])}
 
 @api_router.post("/auth/password-reset/request")
 async def request_password_reset(request: PasswordResetRequest):
@@ -788,7 +818,7 @@ async def confirm_password_reset(request: PasswordResetConfirm):
             detail="User not found"
         )
     
-    hashed_password = hash_password(request.new_password)
+    hashed_password = await hash_password(request.new_password)
     
     await db.users.update_one(
         {"id": user["id"]},
@@ -798,6 +828,9 @@ async def confirm_password_reset(request: PasswordResetConfirm):
         }}
     )
     
+    from user_cache_service import user_cache
+    user_cache.invalidate(user["id"])
+    
     await db.password_reset_tokens.update_one(
         {"id": token_record["id"]},
         {"$set": {"used": True}}
@@ -871,21 +904,21 @@ async def change_password(request: PasswordChangeRequest, current_user: Dict = D
         )
     
     # Verify current password
-    if not verify_password(request.current_password, user["password_hash"]):
+    if not await verify_password(request.current_password, user["password_hash"]):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Current password is incorrect"
         )
     
     # Check if new password is same as current
-    if verify_password(request.new_password, user["password_hash"]):
+    if await verify_password(request.new_password, user["password_hash"]):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="New password must be different from current password"
         )
     
     # Hash and save new password
-    new_password_hash = hash_password(request.new_password)
+    new_password_hash = await hash_password(request.new_password)
     
     await db.users.update_one(
         {"id": current_user["id"]},
@@ -895,6 +928,9 @@ async def change_password(request: PasswordChangeRequest, current_user: Dict = D
         }}
     )
     
+    from user_cache_service import user_cache
+    user_cache.invalidate(current_user["id"])
+    
     logger.info(f"Password changed for user {current_user['id']}")
     
     return {
@@ -982,6 +1018,15 @@ async def create_rshd_item(item_data: RSHDItemCreate, current_user: Dict = Depen
     if not location:
         raise HTTPException(status_code=404, detail="DRLP location not found")
     
+    # Derive the indexed expiry timestamp the sweeper and listings use
+    from expiry_service import parse_expiry_date
+    try:
+        expires_at = parse_expiry_date(item_data.expiry_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid expiry_date. Use an ISO date (YYYY-MM-DD) or datetime")
+    if expires_at and expires_at <= datetime.now(timezone.utc):
+        raise HTTPException(status_code=400, detail="expiry_date is already in the past")
+    
     # Calculate discount percentages and final price
     discount_info = calculate_discount_mapping(item_data.discount_level, item_data.regular_price)
     
@@ -994,10 +1039,27 @@ async def create_rshd_item(item_data: RSHDItemCreate, current_user: Dict = Depen
     item_dict["consumer_discount_percent"] = discount_info["consumer_discount_percent"]
     item_dict["deal_price"] = discount_info["deal_price"]
     item_dict["posted_at"] = datetime.now(timezone.utc).isoformat()
+    item_dict["expires_at"] = expires_at
     item_dict["status"] = "available"
     
+    # Denormalized retailer visibility so consumer listings filter in the indexed query.
+    # Read fresh: the cached principal may predate a suspension handled by another worker
+    from live_retailer_service import is_retailer_live
+    from user_cache_service import user_cache
+    retailer = await user_cache.get_fresh(db, current_user["id"])
+    item_dict["retailer_live"] = bool(retailer) and is_retailer_live(retailer)
+    
+    # Normalized match features are derived once here, not per DAC-favorite comparison
+    from categorization_service import build_match_keys
+    item_dict["match_keys"] = build_match_keys(item_data.name, item_data.attributes)
+    
     await db.rshd_items.insert_one(item_dict)
     
+    from feed_cache_service import feed_cache
+    from etag_service import bump_versions, RSHD_ITEMS
+    feed_cache.invalidate(item_dict["drlp_id"])
+    await bump_versions(db, RSHD_ITEMS)
+    
     # Create notifications for matching DACs (stores in DB)
     await create_matching_notifications(item_dict)
     
@@ -1019,6 +1081,7 @@ async def create_matching_notifications(item: Dict):
     """
     notified_dacs = set()  # Track DACs already notified
     drlp_id = item["drlp_id"]
+    match_keys = get_item_match_keys(item)
     
     # STEP 1: GEOGRAPHIC FILTER - Get DACs from DRLPDAC-List
     # This list contains all DACs who have this DRLP in their DACDRLP-List
@@ -1036,25 +1099,24 @@ async def create_matching_notifications(item: Dict):
     
     logger.info(f"Found {len(eligible_dac_ids)} DACs in DRLPDAC-List for DRLP {drlp_id}")
     
-    # STEP 2: PREFERENCE FILTER - Check each DAC's favorite_items
-    # Only query users who are in the DRLPDAC-List (geographic filter already applied)
-    users_with_item_favs = await db.users.find({
-        "id": {"$in": eligible_dac_ids},
-        "favorite_items": {"$exists": True, "$ne": []}
-    }, {"_id": 0, "id": 1, "favorite_items": 1}).to_list(10000)
+    item_name_lower = match_keys["name_lower"]
+    item_organic = match_keys["attributes"].get("organic", False)
     
-    item_name_lower = item["name"].lower()
-    item_organic = item.get("attributes", {}).get("organic", False)
+    # STEP 2: PREFERENCE FILTER - Check each DAC's favorites in this item's category
+    # Only DACs in the DRLPDAC-List (geographic filter already applied), via the (dac_id, category) index.
+    # Category, keyword and organic predicates run in MongoDB; the checks below confirm and log the match.
+    from favorites_service import get_favorites_for_matching, favorite_matches
+    favorites_by_dac = await get_favorites_for_matching(
+        db, eligible_dac_ids, item["category"], item_name_lower, item_organic
+    )
     
-    for user in users_with_item_favs:
-        dac_id = user["id"]
-        
+    for dac_id, favorites in favorites_by_dac.items():
         # Skip if already notified (stop-after-first-hit)
         if dac_id in notified_dacs:
             continue
         
         # Check item-level favorites (DACFI-List)
-        for fav_item in user.get("favorite_items", []):
+        for fav_item in favorites:
             # Must match category first
             if fav_item.get("category") != item["category"]:
                 continue
@@ -1062,57 +1124,32 @@ async def create_matching_notifications(item: Dict):
             # OPTION C (HYBRID) MATCHING LOGIC:
             # If favorite has brand specified (has_brand=True) → strict brand matching
             # If favorite has no brand (has_brand=False) → flexible generic matching
-            
-            has_brand = fav_item.get("has_brand", False)
-            
-            if has_brand:
-                # STRICT BRAND MATCHING: Brand must match
-                fav_brand_keywords = fav_item.get("brand_keywords", [])
-                brand_match = any(
-                    brand_kw in item_name_lower 
-                    for brand_kw in fav_brand_keywords
-                )
-                
-                if not brand_match:
-                    continue  # Brand doesn't match, skip this favorite
-                
-                # Brand matches, now check generic
-                generic_keywords = fav_item.get("generic_keywords", [])
-                generic_match = any(
-                    gen_kw in item_name_lower 
-                    for gen_kw in generic_keywords
-                )
-                
-                if not generic_match:
-                    continue  # Generic doesn't match either
-                
-            else:
-                # FLEXIBLE GENERIC MATCHING: Any brand is OK
-                generic_keywords = fav_item.get("generic_keywords", [])
-                generic_match = any(
-                    gen_kw in item_name_lower 
-                    for gen_kw in generic_keywords
-                )
-                
-                if not generic_match:
-                    continue  # Generic doesn't match
-            
-            # Check organic attribute if specified
-            fav_organic = fav_item.get("attributes", {}).get("organic")
-            if fav_organic is True and not item_organic:
-                continue  # DAC wants organic only, item is not organic
+            # Organic-only favorites skip non-organic items
+            if not favorite_matches(fav_item, item_name_lower, item_organic):
+                continue
             
             # Match found! Create notification and stop checking for this DAC
             await _create_notification(dac_id, item)
             notified_dacs.add(dac_id)
             logger.info(
                 f"Match: RSHD '{item['name']}' matched DAC {dac_id} favorite "
-                f"'{fav_item.get('item_name')}' (brand_match: {has_brand})"
+                f"'{fav_item.get('item_name')}' (brand_match: {fav_item.get('has_brand', False)})"
             )
             break  # STOP after first match for this DAC
     
+    from etag_service import bump_versions, notifications_key
+    await bump_versions(db, *(notifications_key(dac_id) for dac_id in notified_dacs))
+    
     logger.info(f"Notification matching complete: {len(notified_dacs)} DACs notified for RSHD '{item['name']}'")
 
+def get_item_match_keys(item: Dict) -> Dict[str, Any]:
+    """Return the item's precomputed match keys, deriving them for legacy items"""
+    match_keys = item.get("match_keys")
+    if not match_keys:
+        from categorization_service import build_match_keys
+        match_keys = build_match_keys(item["name"], item.get("attributes"))
+    return match_keys
+
 async def _create_notification(dac_id: str, item: Dict):
     """Helper to create a single notification"""
     notification = {
@@ -1127,47 +1164,153 @@ async def _create_notification(dac_id: str, item: Dict):
     logger.info(f"Created notification for DAC {dac_id} for RSHD {item['id']} ({item['name']})")
 
 @api_router.get("/rshd/items", response_model=List[RSHDItem])
-async def get_rshd_items(category: Optional[str] = None, current_user: Dict = Depends(get_current_user)):
-    query = {"status": "available", "quantity": {"$gt": 0}}
+async def get_rshd_items(
+    request: Request,
+    response: Response,
+    category: Optional[str] = None,
+    q: Optional[str] = None,
+    current_user: Dict = Depends(get_current_user)
+):
+    # Revalidation polls are answered from the version stamp without running the listing query.
+    # Items passing their expiry between sweeps stay in a cached copy until the next sweep.
+    from etag_service import get_versions, make_etag, conditional_response, RSHD_ITEMS
+    versions = await get_versions(db, [RSHD_ITEMS])
+    not_modified = conditional_response(
+        request, response, make_etag(versions[RSHD_ITEMS], current_user["role"], category, q)
+    )
+    if not_modified:
+        return not_modified
+    
+    from expiry_service import live_inventory_filter
+    query = {"status": "available", "quantity": {"$gt": 0}, **live_inventory_filter(datetime.now(timezone.utc))}
     if category:
         query["category"] = category
-    
-    items = await db.rshd_items.find(query, {"_id": 0}).sort("posted_at", -1).to_list(1000)
-    
-    # For DAC users, filter out items from non-live retailers (sandbox feature)
+    if q:
+        # Search against the precomputed token set (multikey index on match_keys.tokens)
+        from categorization_service import extract_keywords
+        search_tokens = extract_keywords(q)
+        if search_tokens:
+            query["match_keys.tokens"] = {"$all": search_tokens}
+    
+    # For DAC users, only items from live retailers (sandbox feature).
+    # retailer_live is kept in sync on every retailer status transition; items
+    # posted before the flag existed fall back to the cached live-retailer set.
     if current_user["role"] == "DAC":
-        # Get all live retailer IDs
-        live_retailers = await db.users.find(
-            {"role": "DRLP", "store_status": STORE_STATUS_LIVE},
-            {"_id": 0, "id": 1}
-        ).to_list(10000)
-        live_retailer_ids = set(r["id"] for r in live_retailers)
-        
-        # Also include retailers without store_status (legacy data - treat as live)
-        legacy_retailers = await db.users.find(
-            {"role": "DRLP", "store_status": {"$exists": False}},
-            {"_id": 0, "id": 1}
-        ).to_list(10000)
-        live_retailer_ids.update(r["id"] for r in legacy_retailers)
-        
-        # Filter items to only include those from live retailers
-        items = [item for item in items if item.get("drlp_id") in live_retailer_ids]
+        from live_retailer_service import live_retailers
+        live_retailer_ids = await live_retailers.get(db)
+        query["$or"] = [
+            {"retailer_live": True},
+            {"retailer_live": {"$exists": False}, "drlp_id": {"$in": list(live_retailer_ids)}}
+        ]
+    
+    from response_service import model_projection, trusted_json
+    items = await db.rshd_items.find(query, model_projection(RSHDItem)).sort("posted_at", -1).to_list(1000)
+    
+    return trusted_json(items, RSHDItem, response)
+
+class RSHDFeedItem(RSHDItem):
+    distance: Optional[float] = None  # Miles from the DAC's delivery location (DACDRLP-List)
+
+class RSHDFeedPage(BaseModel):
+    items: List[RSHDFeedItem]
+    next_cursor: Optional[str] = None
+
+@api_router.get("/rshd/feed", response_model=RSHDFeedPage)
+async def get_rshd_feed(
+    category: Optional[str] = None,
+    min_discount_level: Optional[int] = Query(None, ge=1, le=3),
+    sort: str = Query("newest", pattern="^(newest|distance)$"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: Dict = Depends(get_current_user)
+):
+    """DAC deal feed scoped to the DAC's DACDRLP-List, keyset-paginated
+    
+    Pass `next_cursor` from the previous page as `cursor` to continue.
+    sort=distance orders by retailer distance (nearest first), then newest.
+    """
+    if current_user["role"] != "DAC":
+        raise HTTPException(status_code=403, detail="Only DAC users have a deal feed")
     
-    return items
+    from feed_service import get_feed_page, InvalidCursorError
+    try:
+        return await get_feed_page(
+            db, current_user["id"],
+            category=category,
+            min_discount_level=min_discount_level,
+            sort=sort,
+            limit=limit,
+            cursor=cursor
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @api_router.get("/rshd/my-items", response_model=List[RSHDItem])
 async def get_my_rshd_items(current_user: Dict = Depends(get_current_user)):
     if current_user["role"] != "DRLP":
         raise HTTPException(status_code=403, detail="Only DRLP users can view their items")
     
-    items = await db.rshd_items.find({"drlp_id": current_user["id"]}, {"_id": 0}).sort("posted_at", -1).to_list(1000)
-    return items
+    from response_service import model_projection, trusted_json
+    items = await db.rshd_items.find(
+        {"drlp_id": current_user["id"]}, model_projection(RSHDItem)
+    ).sort("posted_at", -1).to_list(1000)
+    return trusted_json(items, RSHDItem)
 
 @api_router.put("/rshd/items/{item_id}")
 async def update_rshd_item(item_id: str, update_data: Dict, current_user: Dict = Depends(get_current_user)):
     if current_user["role"] != "DRLP":
         raise HTTPException(status_code=403, detail="Only DRLP users can update items")
     
+    # Server-owned fields are dropped; anything else outside RSHDItemUpdate is rejected
+    update_data = {k: v for k, v in update_data.items() if k not in SERVER_OWNED_ITEM_FIELDS}
+    unknown = sorted(set(update_data) - set(RSHDItemUpdate.model_fields))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Fields cannot be updated: {', '.join(unknown)}")
+    try:
+        update_data = RSHDItemUpdate(**update_data).model_dump(exclude_unset=True)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not update_data:
+        raise HTTPException(status_code=400, detail="No updatable fields provided")
+    
+    if "category" in update_data and update_data["category"] not in VALID_CATEGORIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid category. Must be one of: {', '.join(VALID_CATEGORIES)}"
+        )
+    if "discount_level" in update_data and update_data["discount_level"] not in [1, 2, 3]:
+        raise HTTPException(status_code=400, detail="Invalid discount level. Only levels 1, 2, and 3 are supported in Version 1.0.")
+    
+    # Keep match keys and prices in sync when the fields they are derived from change
+    if update_data.keys() & {"name", "attributes", "regular_price", "discount_level"}:
+        existing = await db.rshd_items.find_one(
+            {"id": item_id, "drlp_id": current_user["id"]},
+            {"_id": 0, "name": 1, "attributes": 1, "regular_price": 1, "discount_level": 1}
+        )
+        if not existing:
+            raise HTTPException(status_code=404, detail="Item not found")
+        if "name" in update_data or "attributes" in update_data:
+            from categorization_service import build_match_keys
+            update_data["match_keys"] = build_match_keys(
+                update_data.get("name", existing["name"]),
+                update_data.get("attributes", existing.get("attributes"))
+            )
+        if "regular_price" in update_data or "discount_level" in update_data:
+            update_data.update(calculate_discount_mapping(
+                update_data.get("discount_level", existing["discount_level"]),
+                update_data.get("regular_price", existing["regular_price"])
+            ))
+    
+    # Keep the indexed expiry timestamp in sync with expiry_date
+    if "expiry_date" in update_data:
+        from expiry_service import parse_expiry_date
+        try:
+            update_data["expires_at"] = parse_expiry_date(update_data["expiry_date"])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid expiry_date. Use an ISO date (YYYY-MM-DD) or datetime")
+        if update_data["expires_at"] and update_data["expires_at"] <= datetime.now(timezone.utc):
+            raise HTTPException(status_code=400, detail="expiry_date is already in the past")
+    
     result = await db.rshd_items.update_one(
         {"id": item_id, "drlp_id": current_user["id"]},
         {"$set": update_data}
@@ -1176,6 +1319,11 @@ async def update_rshd_item(item_id: str, update_data: Dict, current_user: Dict =
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Item not found")
     
+    from feed_cache_service import feed_cache
+    from etag_service import bump_versions, RSHD_ITEMS
+    feed_cache.invalidate(current_user["id"])
+    await bump_versions(db, RSHD_ITEMS)
+    
     return {"message": "Item updated successfully"}
 
 @api_router.delete("/rshd/items/{item_id}")
@@ -1188,27 +1336,28 @@ async def delete_rshd_item(item_id: str, current_user: Dict = Depends(get_curren
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Item not found")
     
+    from feed_cache_service import feed_cache
+    from etag_service import bump_versions, RSHD_ITEMS
+    feed_cache.invalidate(current_user["id"])
+    await bump_versions(db, RSHD_ITEMS)
+    
     return {"message": "Item deleted successfully"}
 
 # ===== ITEM-LEVEL FAVORITES ROUTES (Enhanced DACFI-List) =====
 
+CATEGORIZATION_DEADLINE = 20.0  # seconds; past this the item falls back to Miscellaneous
+
 @api_router.post("/favorites/items")
 async def add_favorite_item(item_data: FavoriteItemCreate, current_user: Dict = Depends(get_current_user)):
     if current_user["role"] != "DAC":
         raise HTTPException(status_code=403, detail="Only DAC users can add favorite items")
     
     from categorization_service import categorize_item
+    from llm_gateway_service import llm_deadline
     
-    # Categorize item with brand/generic parsing
-    category, keywords, attributes, brand_info = await categorize_item(item_data.item_name)
-    
-    # Check if item already exists in favorites
-    user = await db.users.find_one({"id": current_user["id"]}, {"_id": 0, "favorite_items": 1})
-    existing_items = user.get("favorite_items", [])
-    
-    for existing_item in existing_items:
-        if existing_item["item_name"].lower() == item_data.item_name.lower():
-            raise HTTPException(status_code=400, detail="Item already in favorites")
+    # Categorize item with brand/generic parsing (AI fallback bounded by the request deadline)
+    with llm_deadline(CATEGORIZATION_DEADLINE):
+        category, keywords, attributes, brand_info = await categorize_item(item_data.item_name)
     
     # Create favorite item with brand/generic structure
     favorite_item = {
@@ -1224,14 +1373,13 @@ async def add_favorite_item(item_data: FavoriteItemCreate, current_user: Dict =
         "auto_added_date": None  # Explicit addition
     }
     
-    # Add to user's favorite_items
-    result = await db.users.update_one(
-        {"id": current_user["id"]},
-        {"$push": {"favorite_items": favorite_item}}
-    )
+    # Add to the DAC's favorites (unique per DAC and lower-cased name)
+    from favorites_service import add_favorite
+    if not await add_favorite(db, current_user["id"], favorite_item):
+        raise HTTPException(status_code=400, detail="Item already in favorites")
     
-    if result.modified_count == 0:
-        raise HTTPException(status_code=500, detail="Failed to add favorite item")
+    from etag_service import bump_versions, favorites_key
+    await bump_versions(db, favorites_key(current_user["id"]))
     
     logger.info(
         f"Added favorite item '{item_data.item_name}' "
@@ -1245,13 +1393,19 @@ async def add_favorite_item(item_data: FavoriteItemCreate, current_user: Dict =
     }
 
 @api_router.get("/favorites/items")
-async def get_favorite_items(current_user: Dict = Depends(get_current_user)):
+async def get_favorite_items(request: Request, response: Response, current_user: Dict = Depends(get_current_user)):
     if current_user["role"] != "DAC":
         raise HTTPException(status_code=403, detail="Only DAC users can view favorite items")
     
-    user = await db.users.find_one({"id": current_user["id"]}, {"_id": 0, "favorite_items": 1})
+    from etag_service import get_versions, make_etag, conditional_response, favorites_key
+    key = favorites_key(current_user["id"])
+    versions = await get_versions(db, [key])
+    not_modified = conditional_response(request, response, make_etag(key, versions[key]))
+    if not_modified:
+        return not_modified
     
-    favorite_items = user.get("favorite_items", [])
+    from favorites_service import get_favorites
+    favorite_items = await get_favorites(db, current_user["id"])
     
     # Organize by category
     organized = {}
@@ -1273,21 +1427,20 @@ async def test_delete_favorite_item(item_data: FavoriteItemDelete, current_user:
 
 @api_router.delete("/favorites/items/remove")
 async def remove_favorite_item(item_name: str, current_user: Dict = Depends(get_current_user)):
-    print(f"REMOVE FUNCTION CALLED: item_name='{item_name}', user_role='{current_user['role']}'")
     if current_user["role"] != "DAC":
         raise HTTPException(status_code=403, detail="Only DAC users can remove favorite items")
     
-    # Remove item from user's favorite_items (exact match)
-    result = await db.users.update_one(
-        {"id": current_user["id"]},
-        {"$pull": {"favorite_items": {"item_name": item_name}}}
-    )
-    
-    print(f"REMOVE: Delete result: matched={result.matched_count}, modified={result.modified_count}")
+    # Remove item from the DAC's favorites (exact match)
+    from favorites_service import remove_favorite
+    removed = await remove_favorite(db, current_user["id"], item_name)
+    logger.debug(f"Remove favorite '{item_name}' for user {current_user['id']}: removed={removed}")
     
-    if result.modified_count == 0:
+    if removed == 0:
         raise HTTPException(status_code=404, detail="Favorite item not found")
     
+    from etag_service import bump_versions, favorites_key
+    await bump_versions(db, favorites_key(current_user["id"]))
+    
     return {"message": "Favorite item removed"}
 
 @api_router.post("/favorites/items/delete")
@@ -1296,15 +1449,16 @@ async def delete_favorite_item_post(item_data: FavoriteItemDelete, current_user:
     if current_user["role"] != "DAC":
         raise HTTPException(status_code=403, detail="Only DAC users can remove favorite items")
     
-    # Remove item from user's favorite_items (case-insensitive match)
-    result = await db.users.update_one(
-        {"id": current_user["id"]},
-        {"$pull": {"favorite_items": {"item_name": {"$regex": f"^{item_data.item_name}$", "$options": "i"}}}}
-    )
+    # Remove item from the DAC's favorites (case-insensitive match)
+    from favorites_service import remove_favorite
+    removed = await remove_favorite(db, current_user["id"], item_data.item_name, case_insensitive=True)
     
-    if result.modified_count == 0:
+    if removed == 0:
         raise HTTPException(status_code=404, detail="Favorite item not found")
     
+    from etag_service import bump_versions, favorites_key
+    await bump_versions(db, favorites_key(current_user["id"]))
+    
     logger.info(f"Removed favorite item '{item_data.item_name}' for user {current_user['id']}")
     
     return {"message": "Favorite item removed"}
@@ -1327,11 +1481,20 @@ async def update_auto_threshold(threshold_data: AutoThresholdUpdate, current_use
         {"$set": {"auto_favorite_threshold": threshold_data.auto_favorite_threshold}}
     )
     
+    from user_cache_service import user_cache
+    user_cache.invalidate(current_user["id"])
+    
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
     # Note: modified_count can be 0 if the value is the same, which is OK
     
+    # Re-evaluate this DAC's existing purchase counters against the new threshold tonight,
+    # pruned to today's window (they were last pruned at the DAC's last purchase of each item)
+    if threshold_data.auto_favorite_threshold > 0:
+        from purchase_days_service import reprune_purchase_days
+        await reprune_purchase_days(db, current_user["id"], datetime.now(timezone.utc))
+    
     threshold_text = {0: "Never", 3: "3 days", 6: "6 days"}
     logger.info(f"Updated auto-add threshold to '{threshold_text[threshold_data.auto_favorite_threshold]}' for user {current_user['id']}")
     
@@ -1343,11 +1506,21 @@ async def update_auto_threshold(threshold_data: AutoThresholdUpdate, current_use
 # ===== DACDRLP-LIST MANAGEMENT ROUTES =====
 
 @api_router.get("/dac/retailers")
-async def get_dacdrlp_list(current_user: Dict = Depends(get_current_user)):
+async def get_dacdrlp_list(request: Request, response: Response, current_user: Dict = Depends(get_current_user)):
     """Get current DAC's DACDRLP-List (retailers they receive notifications from)"""
     if current_user["role"] != "DAC":
         raise HTTPException(status_code=403, detail="Only DAC users can view their retailer list")
     
+    # Every DACDRLP-List write sets updated_at, so it doubles as the version stamp
+    from etag_service import make_etag, conditional_response
+    stamp = await db.dacdrlp_list.find_one({"dac_id": current_user["id"]}, {"_id": 0, "updated_at": 1})
+    not_modified = conditional_response(
+        request, response,
+        make_etag("dacdrlp", current_user["id"], (stamp or {}).get("updated_at"), current_user.get("dacsai_rad"))
+    )
+    if not_modified:
+        return not_modified
+    
     dacdrlp_doc = await db.dacdrlp_list.find_one({"dac_id": current_user["id"]}, {"_id": 0})
     
     if not dacdrlp_doc:
@@ -1497,6 +1670,9 @@ async def update_dac_location(location_data: DeliveryLocationUpdate, current_use
         {"$set": {"delivery_location": location_data.model_dump()}}
     )
     
+    from user_cache_service import user_cache
+    user_cache.invalidate(dac_id)
+    
     logger.info(f"Updated delivery location for DAC {dac_id}")
     return {"message": "Delivery location updated", "delivery_location": location_data.model_dump()}
 
@@ -1536,6 +1712,9 @@ async def update_dacsai(dacsai_rad: float, delivery_location: Optional[DeliveryL
         {"$set": {"dacsai_rad": dacsai_rad}}
     )
     
+    from user_cache_service import user_cache
+    user_cache.invalidate(dac_id)
+    
     # Get current DACDRLP-List
     dacdrlp_doc = await db.dacdrlp_list.find_one({"dac_id": dac_id})
     current_retailers = dacdrlp_doc.get("retailers", []) if dacdrlp_doc else []
@@ -1613,12 +1792,22 @@ async def update_dacsai(dacsai_rad: float, delivery_location: Optional[DeliveryL
 # ===== NOTIFICATION ROUTES =====
 
 @api_router.get("/notifications", response_model=List[Notification])
-async def get_notifications(current_user: Dict = Depends(get_current_user)):
+async def get_notifications(request: Request, response: Response, current_user: Dict = Depends(get_current_user)):
     if current_user["role"] != "DAC":
         raise HTTPException(status_code=403, detail="Only DAC users can view notifications")
     
-    notifications = await db.notifications.find({"dac_id": current_user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return notifications
+    from etag_service import get_versions, make_etag, conditional_response, notifications_key
+    key = notifications_key(current_user["id"])
+    versions = await get_versions(db, [key])
+    not_modified = conditional_response(request, response, make_etag(key, versions[key]))
+    if not_modified:
+        return not_modified
+    
+    from response_service import model_projection, trusted_json
+    notifications = await db.notifications.find(
+        {"dac_id": current_user["id"]}, model_projection(Notification)
+    ).sort("created_at", -1).to_list(1000)
+    return trusted_json(notifications, Notification, response)
 
 @api_router.put("/notifications/{notification_id}/read")
 async def mark_notification_read(notification_id: str, current_user: Dict = Depends(get_current_user)):
@@ -1628,6 +1817,9 @@ async def mark_notification_read(notification_id: str, current_user: Dict = Depe
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Notification not found")
+    
+    from etag_service import bump_versions, notifications_key
+    await bump_versions(db, notifications_key(current_user["id"]))
     return {"message": "Notification marked as read"}
 
 # ===== ORDER ROUTES =====
@@ -1637,6 +1829,12 @@ async def create_order(order_data: OrderCreate, current_user: Dict = Depends(get
     if current_user["role"] != "DAC":
         raise HTTPException(status_code=403, detail="Only DAC users can create orders")
     
+    # Account status is read fresh: the cached principal may predate a suspension on another worker
+    from user_cache_service import user_cache
+    account = await user_cache.get_fresh(db, current_user["id"])
+    if not account or account.get("account_status") == "suspended":
+        raise HTTPException(status_code=403, detail="Account is suspended. Contact admin.")
+    
     # Calculate totals
     subtotal = sum(item.price * item.quantity for item in order_data.items)
     
@@ -1654,23 +1852,45 @@ async def create_order(order_data: OrderCreate, current_user: Dict = Depends(get
     
     total = subtotal + tax + delivery_fee + order_data.charity_roundup
     
-    # Process Stripe payment
+    # Reserve stock before charging: all lines or none (the order id doubles as the hold id)
+    from inventory_service import reserve_items, release_hold, commit_hold
+    order_id = str(uuid.uuid4())
+    reservation = await reserve_items(db, order_id, current_user["id"], order_data.items)
+    if not reservation["success"]:
+        raise HTTPException(status_code=409, detail=reservation["error"])
+    
+    # Process Stripe payment (off the event loop, idempotent per order)
+    from payment_service import create_payment_intent
     try:
-        payment_intent = stripe.PaymentIntent.create(
-            amount=int(total * 100),  # Convert to cents
-            currency="usd",
-            payment_method=order_data.payment_method_id,
-            confirm=True,
-            automatic_payment_methods={
-                "enabled": True,
-                "allow_redirects": "never"
-            }
+        payment_intent = await create_payment_intent(
+            order_id,
+            int(total * 100),  # Convert to cents
+            order_data.payment_method_id
         )
     except stripe.error.StripeError as e:
+        await release_hold(db, order_id)
         raise HTTPException(status_code=400, detail=f"Payment failed: {str(e)}")
+    except Exception:
+        await release_hold(db, order_id)
+        raise
+    
+    # Quantities were decremented by the reservation; make it permanent before confirming.
+    # If the stale-hold job already returned the stock, it may have been sold again: refund instead
+    if not await commit_hold(db, order_id):
+        from payment_service import refund_payment_intent
+        try:
+            await refund_payment_intent(order_id, payment_intent.id)
+        except stripe.error.StripeError as e:
+            logger.error(f"Order {order_id}: inventory hold expired and refund of {payment_intent.id} failed: {e}")
+            raise HTTPException(
+                status_code=409,
+                detail="Items are no longer reserved and the refund could not be issued. Please contact support."
+            )
+        logger.warning(f"Order {order_id}: inventory hold expired before payment completed; payment refunded")
+        raise HTTPException(status_code=409, detail="Checkout took too long and items are no longer reserved. Your payment has been refunded.")
     
     order_dict = {
-        "id": str(uuid.uuid4()),
+        "id": order_id,
         "dac_id": current_user["id"],
         "dac_name": current_user["name"],
         "drlp_id": first_item["drlp_id"],
@@ -1693,25 +1913,31 @@ async def create_order(order_data: OrderCreate, current_user: Dict = Depends(get
     
     await db.orders.insert_one(order_dict)
     
-    # Update item quantities
-    for item in order_data.items:
-        await db.rshd_items.update_one(
-            {"id": item.rshd_id},
-            {"$inc": {"quantity": -item.quantity}}
-        )
+    # Keep the auto-add purchase-day counters current (never fail a paid order over them)
+    try:
+        from purchase_days_service import record_order_purchase_days
+        await record_order_purchase_days(db, order_dict)
+    except Exception as e:
+        logger.error(f"Failed to record purchase days for order {order_dict['id']}: {e}")
+    
+    # Sold-out items must drop out of consumer feeds - of every retailer in the cart
+    from inventory_service import inventory_changed
+    await inventory_changed(db, [item.rshd_id for item in order_data.items])
     
     return order_dict
 
 @api_router.get("/orders", response_model=List[Order])
 async def get_orders(current_user: Dict = Depends(get_current_user)):
+    from response_service import model_projection, trusted_json
+    projection = model_projection(Order)
     if current_user["role"] == "DAC":
-        orders = await db.orders.find({"dac_id": current_user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+        orders = await db.orders.find({"dac_id": current_user["id"]}, projection).sort("created_at", -1).to_list(1000)
     elif current_user["role"] == "DRLP":
-        orders = await db.orders.find({"drlp_id": current_user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+        orders = await db.orders.find({"drlp_id": current_user["id"]}, projection).sort("created_at", -1).to_list(1000)
     else:  # Admin
-        orders = await db.orders.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+        orders = await db.orders.find({}, projection).sort("created_at", -1).to_list(1000)
     
-    return orders
+    return trusted_json(orders, Order)
 
 # ===== ADMIN ROUTES =====
 
@@ -1760,7 +1986,7 @@ async def create_admin(user_data: UserCreate, current_user: Dict = Depends(get_c
     
     user_dict = user_data.model_dump()
     user_dict["id"] = str(uuid.uuid4())
-    user_dict["password_hash"] = hash_password(user_data.password)
+    user_dict["password_hash"] = await hash_password(user_data.password)
     user_dict["created_at"] = datetime.now(timezone.utc).isoformat()
     user_dict["notification_prefs"] = {"email": True, "push": True, "sms": False}
     del user_dict["password"]
@@ -1776,16 +2002,18 @@ async def get_all_users(current_user: Dict = Depends(get_current_user)):
     if current_user["role"] != "Admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
+    from response_service import trusted_json
     users = await db.users.find({}, {"_id": 0, "password_hash": 0}).to_list(10000)
-    return users
+    return trusted_json(users)
 
 @api_router.get("/admin/items")
 async def get_all_items(current_user: Dict = Depends(get_current_user)):
     if current_user["role"] != "Admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
+    from response_service import trusted_json
     items = await db.rshd_items.find({}, {"_id": 0}).to_list(10000)
-    return items
+    return trusted_json(items)
 
 
 # ===== ENHANCED ADMIN ENDPOINTS =====
@@ -1819,8 +2047,12 @@ async def get_admin_analytics(current_user: Dict = Depends(get_current_user)):
     # Get RSHDs for category breakdown
     items = await db.rshd_items.find({"status": "available"}, {"_id": 0}).to_list(10000)
     category_breakdown = defaultdict(int)
+    attribute_breakdown = defaultdict(int)
     for item in items:
         category_breakdown[item.get("category", "Unknown")] += 1
+        for attribute, enabled in item.get("match_keys", {}).get("attributes", {}).items():
+            if enabled:
+                attribute_breakdown[attribute] += 1
     
     # Top performing retailers (by number of items)
     retailer_stats = defaultdict(lambda: {"items": 0, "name": ""})
@@ -1848,6 +2080,7 @@ async def get_admin_analytics(current_user: Dict = Depends(get_current_user)):
     return {
         "orders_trend": orders_trend,
         "category_breakdown": [{"category": k, "count": v} for k, v in category_breakdown.items()],
+        "attribute_breakdown": [{"attribute": k, "count": v} for k, v in attribute_breakdown.items()],
         "top_retailers": top_retailers
     }
 
@@ -1904,6 +2137,9 @@ async def update_user_status(user_id: str, status: Dict, current_user: Dict = De
         {"$set": {"account_status": new_status, "updated_at": datetime.now(timezone.utc).isoformat()}}
     )
     
+    from user_cache_service import user_cache
+    user_cache.invalidate(user_id)
+    
     logger.info(f"User {user_id} status changed to {new_status} by admin {current_user['email']}")
     return {"message": f"User status updated to {new_status}"}
 
@@ -1926,6 +2162,11 @@ async def update_item_status(item_id: str, status: Dict, current_user: Dict = De
         {"$set": {"status": new_status, "updated_at": datetime.now(timezone.utc).isoformat()}}
     )
     
+    from feed_cache_service import feed_cache
+    from etag_service import bump_versions, RSHD_ITEMS
+    feed_cache.invalidate(item["drlp_id"])
+    await bump_versions(db, RSHD_ITEMS)
+    
     logger.info(f"Item {item_id} status changed to {new_status} by admin {current_user['email']}")
     return {"message": f"Item status updated to {new_status}"}
 
@@ -1953,22 +2194,21 @@ async def get_admin_alerts(current_user: Dict = Depends(get_current_user)):
             "item_id": item["id"]
         })
     
-    # Expiring deals (within 2 days)
-    items = await db.rshd_items.find({"status": "available"}, {"_id": 0}).to_list(10000)
-    for item in items:
-        try:
-            expiry = datetime.fromisoformat(item.get("expiry_date", "").replace("Z", "+00:00"))
-            days_until = (expiry - now).days
-            if 0 <= days_until <= 2:
-                alerts.append({
-                    "type": "expiring_soon",
-                    "severity": "info" if days_until > 0 else "critical",
-                    "message": f"{item['name']} expires {'today' if days_until == 0 else f'in {days_until} day(s)'}",
-                    "item_id": item["id"],
-                    "drlp_name": item.get("drlp_name", "Unknown")
-                })
-        except:
-            pass
+    # Expiring deals (within 2 days) - range scan on the (status, expires_at) index
+    expiring = await db.rshd_items.find(
+        {"status": "available", "expires_at": {"$gt": now, "$lt": now + timedelta(days=3)}},
+        {"_id": 0, "id": 1, "name": 1, "drlp_name": 1, "expires_at": 1}
+    ).sort("expires_at", 1).to_list(100)
+    for item in expiring:
+        expires_at = item["expires_at"].replace(tzinfo=timezone.utc)  # Motor returns naive UTC
+        days_until = (expires_at - now).days
+        alerts.append({
+            "type": "expiring_soon",
+            "severity": "info" if days_until > 0 else "critical",
+            "message": f"{item['name']} expires {'today' if days_until == 0 else f'in {days_until} day(s)'}",
+            "item_id": item["id"],
+            "drlp_name": item.get("drlp_name", "Unknown")
+        })
     
     # Sort by severity
     severity_order = {"critical": 0, "warning": 1, "info": 2}
@@ -2127,7 +2367,7 @@ async def request_go_live(current_user: Dict = Depends(get_current_user)):
     if current_status == STORE_STATUS_PENDING_APPROVAL:
         raise HTTPException(status_code=400, detail="Registration approval is still pending")
     
-    if current_status == STORE_STATUS_SUSPENDED:
+    if current_status == STORE_STATUS_SUSPENDED or retailer.get("account_status") == "suspended":
         raise HTTPException(status_code=400, detail="Store is suspended. Contact admin.")
     
     # Verify launch readiness
@@ -2160,6 +2400,12 @@ async def request_go_live(current_user: Dict = Depends(get_current_user)):
         }}
     )
     
+    from user_cache_service import user_cache
+    user_cache.invalidate(retailer_id)
+    
+    from live_retailer_service import sync_retailer_live
+    await sync_retailer_live(db, retailer_id)
+    
     logger.info(f"Retailer {retailer_id} requested to go live")
     return {"message": "Go-live request submitted. Awaiting admin approval.", "status": STORE_STATUS_PENDING_LIVE}
 
@@ -2185,6 +2431,9 @@ async def update_retailer_profile(profile_data: Dict, current_user: Dict = Depen
         {"$set": update_data}
     )
     
+    from user_cache_service import user_cache
+    user_cache.invalidate(retailer_id)
+    
     return {"message": "Profile updated successfully"}
 
 # ===== ADMIN SANDBOX APPROVAL ENDPOINTS =====
@@ -2242,6 +2491,12 @@ async def approve_registration(retailer_id: str, current_user: Dict = Depends(ge
         }}
     )
     
+    from user_cache_service import user_cache
+    user_cache.invalidate(retailer_id)
+    
+    from live_retailer_service import sync_retailer_live
+    await sync_retailer_live(db, retailer_id)
+    
     logger.info(f"Retailer {retailer_id} registration approved by admin {current_user['email']}")
     return {"message": "Registration approved. Retailer is now in sandbox mode.", "status": STORE_STATUS_SANDBOX}
 
@@ -2267,6 +2522,12 @@ async def reject_registration(retailer_id: str, rejection_data: Dict, current_us
         }}
     )
     
+    from user_cache_service import user_cache
+    user_cache.invalidate(retailer_id)
+    
+    from live_retailer_service import sync_retailer_live
+    await sync_retailer_live(db, retailer_id)
+    
     logger.info(f"Retailer {retailer_id} registration rejected by admin {current_user['email']}: {reason}")
     return {"message": "Registration rejected", "reason": reason}
 
@@ -2306,6 +2567,12 @@ async def approve_go_live(retailer_id: str, current_user: Dict = Depends(get_cur
         }}
     )
     
+    from user_cache_service import user_cache
+    user_cache.invalidate(retailer_id)
+    
+    from live_retailer_service import sync_retailer_live
+    await sync_retailer_live(db, retailer_id)
+    
     logger.info(f"Retailer {retailer_id} approved to go live by admin {current_user['email']}")
     return {"message": "Retailer is now live and visible to consumers!", "status": STORE_STATUS_LIVE}
 
@@ -2331,6 +2598,12 @@ async def reject_go_live(retailer_id: str, rejection_data: Dict, current_user: D
         }}
     )
     
+    from user_cache_service import user_cache
+    user_cache.invalidate(retailer_id)
+    
+    from live_retailer_service import sync_retailer_live
+    await sync_retailer_live(db, retailer_id)
+    
     logger.info(f"Retailer {retailer_id} go-live rejected by admin {current_user['email']}: {reason}")
     return {"message": "Go-live request rejected. Retailer returned to sandbox.", "reason": reason}
 
@@ -2573,6 +2846,9 @@ async def update_retailer_status(retailer_id: str, status: Dict, current_user: D
         {"$set": {"account_status": new_status, "updated_at": datetime.now(timezone.utc).isoformat()}}
     )
     
+    from user_cache_service import user_cache
+    user_cache.invalidate(retailer_id)
+    
     # If suspended, also mark all their items as unavailable
     if new_status == "suspended":
         await db.rshd_items.update_many(
@@ -2586,6 +2862,9 @@ async def update_retailer_status(retailer_id: str, status: Dict, current_user: D
             {"$set": {"status": "available"}}
         )
     
+    from live_retailer_service import sync_retailer_live
+    await sync_retailer_live(db, retailer_id)
+    
     logger.info(f"Retailer {retailer_id} status changed to {new_status} by admin {current_user['email']}")
     return {"message": f"Retailer status updated to {new_status}"}
 
@@ -2596,49 +2875,199 @@ async def update_retailer_status(retailer_id: str, status: Dict, current_user: D
 class BarcodeRequest(BaseModel):
     barcode: str
 
+class BarcodeBatchRequest(BaseModel):
+    barcodes: List[str]
+
 class ImageOCRRequest(BaseModel):
     image_base64: str
     prompt: Optional[str] = None
 
+MAX_BARCODE_BATCH = 500
+MAX_BARCODE_WARM_BATCH = 1000
+OCR_REQUEST_DEADLINE = 60.0  # seconds across queueing and retries
+
 @api_router.post("/barcode/lookup")
 async def barcode_lookup(request: BarcodeRequest, current_user: Dict = Depends(get_current_user)):
-    """Look up product information by barcode using Open Food Facts API"""
+    """Look up product information by barcode (local cache first, then Open Food Facts API)"""
     if current_user["role"] != "DRLP":
         raise HTTPException(status_code=403, detail="Only DRLP users can use barcode lookup")
     
-    from barcode_ocr_service import lookup_barcode
-    result = await lookup_barcode(request.barcode)
+    from barcode_cache_service import barcode_cache, normalize_barcode
+    result = await barcode_cache.lookup(db, normalize_barcode(request.barcode))
     
     if not result.get("success"):
         raise HTTPException(status_code=404, detail=result.get("error", "Product not found"))
     
     return result
 
+@api_router.post("/barcode/lookup/batch")
+async def barcode_lookup_batch(request: BarcodeBatchRequest, current_user: Dict = Depends(get_current_user)):
+    """Look up many barcodes at once, streaming NDJSON results as they resolve
+    
+    Duplicate scans are collapsed, cached barcodes are answered first and misses are
+    fetched concurrently. Each line: {barcode, status: found|not_found|error, cached, product|error}
+    """
+    if current_user["role"] != "DRLP":
+        raise HTTPException(status_code=403, detail="Only DRLP users can use barcode lookup")
+    
+    from barcode_cache_service import barcode_cache, normalize_barcode
+    barcodes = list(dict.fromkeys(normalize_barcode(b) for b in request.barcodes if b.strip()))
+    
+    if not barcodes:
+        raise HTTPException(status_code=400, detail="No barcodes provided")
+    if len(barcodes) > MAX_BARCODE_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BARCODE_BATCH} barcodes per batch")
+    
+    async def ndjson_lines():
+        async for line in barcode_cache.lookup_many(db, barcodes):
+            yield json.dumps(line) + "\n"
+    
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+@api_router.post("/admin/barcode-cache/warm")
+async def warm_barcode_cache(request: BarcodeBatchRequest, current_user: Dict = Depends(get_current_user)):
+    """Bulk-populate the barcode product cache (e.g., ahead of a retailer onboarding)"""
+    if current_user["role"] != "Admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    from barcode_cache_service import barcode_cache, normalize_barcode
+    barcodes = list(dict.fromkeys(normalize_barcode(b) for b in request.barcodes if b.strip()))
+    
+    if len(barcodes) > MAX_BARCODE_WARM_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BARCODE_WARM_BATCH} barcodes per warm request")
+    
+    summary = await barcode_cache.warm(db, barcodes)
+    logger.info(f"Barcode cache warmed by admin {current_user['email']}: {summary}")
+    return summary
+
+@api_router.get("/admin/metrics")
+async def get_metrics(current_user: Dict = Depends(get_current_user)):
+    """Latency histograms, counters and LLM gateway state for this worker"""
+    if current_user["role"] != "Admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    import metrics_service
+    from llm_gateway_service import llm_gateway
+    return {
+        **metrics_service.get_metrics_snapshot(),
+        "llm": llm_gateway.get_stats()
+    }
+
+@api_router.get("/admin/job-runs")
+async def get_job_runs(
+    job_id: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    current_user: Dict = Depends(get_current_user)
+):
+    """Recent scheduled job runs (newest first) and the current lock holders"""
+    if current_user["role"] != "Admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    query = {"job_id": job_id} if job_id else {}
+    runs = await db.job_runs.find(query, {"_id": 0}).sort("started_at", -1).to_list(limit)
+    locks = await db.job_locks.find({}).to_list(100)
+    return {"runs": runs, "locks": locks}
+
+@api_router.get("/admin/cache-stats")
+async def get_cache_stats(current_user: Dict = Depends(get_current_user)):
+    """Hit-rate statistics for this worker's in-process caches"""
+    if current_user["role"] != "Admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    from barcode_cache_service import barcode_cache
+    from ocr_cache_service import ocr_cache
+    from live_retailer_service import live_retailers
+    from feed_cache_service import feed_cache
+    from user_cache_service import user_cache
+    return {
+        "barcode_products": barcode_cache.get_stats(),
+        "ocr_results": ocr_cache.get_stats(),
+        "live_retailers": live_retailers.get_stats(),
+        "feed": feed_cache.get_stats(),
+        "principals": user_cache.get_stats()
+    }
+
 @api_router.post("/ocr/extract-price")
 async def ocr_extract_price(request: ImageOCRRequest, current_user: Dict = Depends(get_current_user)):
-    """Extract price information from image using OCR (GPT-4 Vision)"""
+    """Extract price information from image using OCR (GPT-4 Vision), cached by image content"""
     if current_user["role"] != "DRLP":
         raise HTTPException(status_code=403, detail="Only DRLP users can use OCR")
     
-    from barcode_ocr_service import extract_text_from_image
-    result = await extract_text_from_image(request.image_base64, request.prompt)
+    from ocr_cache_service import ocr_cache
+    from llm_gateway_service import llm_deadline
+    with llm_deadline(OCR_REQUEST_DEADLINE):
+        result = await ocr_cache.extract_price(db, request.image_base64, request.prompt)
     
     if not result.get("success"):
-        raise HTTPException(status_code=500, detail=result.get("error", "OCR extraction failed"))
+        raise HTTPException(status_code=503 if result.get("unavailable") else 500, detail=result.get("error", "OCR extraction failed"))
     
     return result
 
 @api_router.post("/ocr/analyze-product")
 async def ocr_analyze_product(request: ImageOCRRequest, current_user: Dict = Depends(get_current_user)):
-    """Analyze product image to extract product information using GPT-4 Vision"""
+    """Analyze product image to extract product information using GPT-4 Vision, cached by image content"""
+    if current_user["role"] != "DRLP":
+        raise HTTPException(status_code=403, detail="Only DRLP users can use product analysis")
+    
+    from ocr_cache_service import ocr_cache
+    from llm_gateway_service import llm_deadline
+    with llm_deadline(OCR_REQUEST_DEADLINE):
+        result = await ocr_cache.analyze_product(db, request.image_base64)
+    
+    if not result.get("success"):
+        raise HTTPException(status_code=503 if result.get("unavailable") else 500, detail=result.get("error", "Product analysis failed"))
+    
+    return result
+
+@api_router.post("/ocr/extract-price/upload")
+async def ocr_extract_price_upload(
+    image: UploadFile = File(...),
+    prompt: Optional[str] = Form(None),
+    current_user: Dict = Depends(get_current_user)
+):
+    """Extract price information from an uploaded image file (multipart/form-data)
+    
+    The image is validated from its header bytes and downscaled before the vision model call.
+    """
+    if current_user["role"] != "DRLP":
+        raise HTTPException(status_code=403, detail="Only DRLP users can use OCR")
+    
+    from image_ingest_service import ingest_upload
+    prepared = await ingest_upload(image)
+    if not prepared["success"]:
+        raise HTTPException(status_code=prepared["status_code"], detail=prepared["error"])
+    
+    from ocr_cache_service import ocr_cache
+    from llm_gateway_service import llm_deadline
+    with llm_deadline(OCR_REQUEST_DEADLINE):
+        result = await ocr_cache.extract_price(db, prepared["image_base64"], prompt)
+    
+    if not result.get("success"):
+        raise HTTPException(status_code=503 if result.get("unavailable") else 500, detail=result.get("error", "OCR extraction failed"))
+    
+    return result
+
+@api_router.post("/ocr/analyze-product/upload")
+async def ocr_analyze_product_upload(
+    image: UploadFile = File(...),
+    current_user: Dict = Depends(get_current_user)
+):
+    """Analyze an uploaded product image file (multipart/form-data)"""
     if current_user["role"] != "DRLP":
         raise HTTPException(status_code=403, detail="Only DRLP users can use product analysis")
     
-    from barcode_ocr_service import analyze_product_image
-    result = await analyze_product_image(request.image_base64)
+    from image_ingest_service import ingest_upload
+    prepared = await ingest_upload(image)
+    if not prepared["success"]:
+        raise HTTPException(status_code=prepared["status_code"], detail=prepared["error"])
+    
+    from ocr_cache_service import ocr_cache
+    from llm_gateway_service import llm_deadline
+    with llm_deadline(OCR_REQUEST_DEADLINE):
+        result = await ocr_cache.analyze_product(db, prepared["image_base64"])
     
     if not result.get("success"):
-        raise HTTPException(status_code=500, detail=result.get("error", "Product analysis failed"))
+        raise HTTPException(status_code=503 if result.get("unavailable") else 500, detail=result.get("error", "Product analysis failed"))
     
     return result
 
@@ -2673,6 +3102,14 @@ async def websocket_handler(websocket: WebSocket, token: str = Query(...)):
     from websocket_service import websocket_endpoint
     await websocket_endpoint(websocket, token)
 
+# Upload bodies are capped innermost, so early 413s still get CORS headers
+from image_ingest_service import UploadSizeLimitMiddleware
+app.add_middleware(UploadSizeLimitMiddleware)
+
+# Compression sits inside CORS so preflight and error responses are handled first
+from response_service import CompressionMiddleware
+app.add_middleware(CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -2681,14 +3118,55 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+async def ensure_indexes():
+    """Create indexes backing hot query paths (idempotent)"""
+    await db.rshd_items.create_index([("match_keys.tokens", 1)])
+    await db.orders.create_index([("created_at", 1)])
+    await db.dacdrlp_list.create_index([("dac_id", 1)])
+    from purchase_days_service import ensure_purchase_days_indexes
+    await ensure_purchase_days_indexes(db)
+    from job_runner_service import ensure_job_runs_indexes
+    await ensure_job_runs_indexes(db)
+    from job_lock_service import ensure_job_lock_indexes
+    await ensure_job_lock_indexes(db)
+    from expiry_service import ensure_expiry_indexes
+    await ensure_expiry_indexes(db)
+    from live_retailer_service import ensure_live_retailer_indexes
+    await ensure_live_retailer_indexes(db)
+    from feed_service import ensure_feed_indexes
+    await ensure_feed_indexes(db)
+    from etag_service import ensure_etag_indexes
+    await ensure_etag_indexes(db)
+    from inventory_service import ensure_inventory_indexes
+    await ensure_inventory_indexes(db)
+    from favorites_service import ensure_favorite_items_indexes
+    await ensure_favorite_items_indexes(db)
+    from barcode_cache_service import ensure_barcode_cache_indexes
+    await ensure_barcode_cache_indexes(db)
+    from ocr_cache_service import ensure_ocr_cache_indexes
+    await ensure_ocr_cache_indexes(db)
+
 # Initialize scheduler on startup
 @app.on_event("startup")
 async def startup_event():
     from scheduler_service import start_scheduler
     logger.info("Starting application...")
-    scheduler = start_scheduler(db)
-    logger.info("Scheduler initialized")
+    await ensure_indexes()
+    from barcode_ocr_service import init_http_client
+    await init_http_client()
+    # Batch jobs can run in a separate worker process instead (see job_worker.py)
+    if os.environ.get('RUN_SCHEDULER_IN_API', 'true').lower() == 'true':
+        scheduler = start_scheduler(db)
+        logger.info("Scheduler initialized")
+    else:
+        logger.info("Scheduler disabled in API process (RUN_SCHEDULER_IN_API=false)")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    from barcode_ocr_service import close_http_client
+    await close_http_client()
+    from payment_service import shutdown_payment_executor
+    shutdown_payment_executor()
+    from password_service import shutdown_password_executor
+    shutdown_password_executor()
     client.close()
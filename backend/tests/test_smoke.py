@@ -96,6 +96,16 @@ class TestCategorizationService:
         result = categorization_service.parse_brand_and_generic("Granola")
         assert result.get("has_brand") == False
 
+    def test_build_match_keys(self):
+        """Test that match keys are normalized once for an RSHD item"""
+        import categorization_service
+        result = categorization_service.build_match_keys("Organic Valley, 2% Milk", {"gluten_free": True})
+        assert result["name_lower"] == "organic valley, 2% milk"
+        assert result["tokens"] == ["2%", "milk", "organic", "valley"]
+        assert result["attributes"] == {"organic": True, "gluten_free": True}
+        assert result["brand"] == "organic valley"
+        assert result["generic"] == "2% milk"
+
 
 class TestBarcodeOCRService:
     """Test the barcode and OCR service"""
@@ -120,6 +130,55 @@ class TestBarcodeOCRService:
         result = barcode_ocr_service.map_category(["dairy", "milk", "cheese"])
         assert result == "Dairy & Eggs"
 
+    def test_category_mapping_priority(self):
+        """Test that the first matching tag decides, then fragment priority within it"""
+        import barcode_ocr_service
+        # "catfish" contains both 'fish' and 'cat' - 'fish' is listed first
+        assert barcode_ocr_service.map_category(["en:catfish", "en:beverages"]) == "Seafood"
+        assert barcode_ocr_service.map_category(["en:unknown", "en:ice-cream"]) == "Frozen Foods"
+        assert barcode_ocr_service.map_category([]) == "Miscellaneous"
+
+    def test_normalize_llm_category(self):
+        """Test that free-text categories are coerced onto the taxonomy"""
+        import barcode_ocr_service
+        assert barcode_ocr_service.normalize_category("Pasta Rice & Grains") == "Pasta, Rice & Grains"
+        assert barcode_ocr_service.normalize_category("Beverages") == "Beverages"
+        assert barcode_ocr_service.normalize_category("dog treats") == "Pet Supplies"
+
+    def test_shared_http_client_lifecycle(self):
+        """Test that barcode lookups reuse one pooled HTTP client until shutdown"""
+        import asyncio
+        import barcode_ocr_service
+
+        async def lifecycle():
+            first = await barcode_ocr_service.init_http_client()
+            second = await barcode_ocr_service.get_http_client()
+            assert first is second
+            await barcode_ocr_service.close_http_client()
+            assert first.is_closed
+
+        asyncio.run(lifecycle())
+
+    def test_unknown_barcode_404_is_not_found(self):
+        """Test that OFF's 404 for an unknown barcode is a cacheable not_found, and 5xx is an error"""
+        import asyncio
+        import httpx
+        import barcode_ocr_service
+
+        def respond(status):
+            def handler(request):
+                return httpx.Response(status, json={"status": 0, "status_verbose": "product not found"})
+            return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        with patch.object(barcode_ocr_service, "get_barcode_index", return_value=None):
+            with patch.object(barcode_ocr_service, "get_http_client", return_value=respond(404)):
+                missing = asyncio.run(barcode_ocr_service.lookup_barcode("0000000000000"))
+            with patch.object(barcode_ocr_service, "get_http_client", return_value=respond(503)):
+                failed = asyncio.run(barcode_ocr_service.lookup_barcode("0000000000000"))
+
+        assert missing["success"] is False and missing["not_found"] is True
+        assert "not_found" not in failed
+
 
 class TestWebSocketService:
     """Test the WebSocket service"""
@@ -135,3 +194,1412 @@ class TestWebSocketService:
         manager = websocket_service.ConnectionManager()
         assert hasattr(manager, 'active_connections')
         assert len(manager.active_connections) == 0
+
+
+class TestBarcodeProductCache:
+    """Test the barcode product cache"""
+
+    def test_not_found_results_are_cached(self):
+        """Test that a 'not found' answer is served from memory on repeat scans"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        import barcode_cache_service
+
+        db = MagicMock()
+        db.barcode_products.find_one = AsyncMock(return_value=None)
+        db.barcode_products.update_one = AsyncMock()
+        upstream = AsyncMock(return_value={"success": False, "not_found": True, "barcode": "000"})
+
+        async def scan_twice():
+            cache = barcode_cache_service.BarcodeProductCache()
+            with patch.object(barcode_cache_service, "lookup_barcode", upstream):
+                first = await cache.lookup(db, "000")
+                second = await cache.lookup(db, "000")
+            return cache, first, second
+
+        cache, first, second = asyncio.run(scan_twice())
+        assert first["cached"] is False
+        assert second["cached"] is True
+        assert upstream.await_count == 1
+        assert cache.get_stats()["negative_hits"] == 1
+
+    def test_transient_errors_are_not_cached(self):
+        """Test that timeouts go back to the network on the next scan"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        import barcode_cache_service
+
+        db = MagicMock()
+        db.barcode_products.find_one = AsyncMock(return_value=None)
+        db.barcode_products.update_one = AsyncMock()
+        upstream = AsyncMock(return_value={"success": False, "error": "Request timed out"})
+
+        async def scan_twice():
+            cache = barcode_cache_service.BarcodeProductCache()
+            with patch.object(barcode_cache_service, "lookup_barcode", upstream):
+                await cache.lookup(db, "123")
+                await cache.lookup(db, "123")
+
+        asyncio.run(scan_twice())
+        assert upstream.await_count == 2
+        db.barcode_products.update_one.assert_not_awaited()
+
+    def test_batch_lookup_deduplicates_and_serves_cache_first(self):
+        """Test that a batch fetches each unique miss once and streams per-item status"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        import barcode_cache_service
+
+        db = MagicMock()
+        db.barcode_products.find.return_value.to_list = AsyncMock(return_value=[])
+        db.barcode_products.update_one = AsyncMock()
+
+        async def upstream(barcode):
+            if barcode == "111":
+                return {"success": True, "product": {"name": "Milk", "barcode": barcode}}
+            return {"success": False, "not_found": True, "barcode": barcode}
+
+        async def scan_batch():
+            cache = barcode_cache_service.BarcodeProductCache()
+            with patch.object(barcode_cache_service, "lookup_barcode", AsyncMock(side_effect=upstream)) as mocked:
+                await cache.fetch_and_store(db, "222")
+                lines = [line async for line in cache.lookup_many(db, ["111", "222", "111", "333"])]
+            return mocked, lines
+
+        mocked, lines = asyncio.run(scan_batch())
+        assert lines[0] == {"barcode": "222", "status": "not_found", "cached": True}
+        assert {line["barcode"]: line["status"] for line in lines} == {"111": "found", "222": "not_found", "333": "not_found"}
+        # One call to seed "222", then one per unique miss
+        assert mocked.await_count == 3
+
+    def test_batch_cap_counts_unique_barcodes(self):
+        """Test that repeated scans don't count against the batch cap"""
+        import asyncio
+        import server
+        from barcode_cache_service import barcode_cache
+
+        async def lookup_many(db, barcodes):
+            for barcode in barcodes:
+                yield {"barcode": barcode, "status": "found", "cached": True}
+
+        async def read(response):
+            return [chunk async for chunk in response.body_iterator]
+
+        request = server.BarcodeBatchRequest(barcodes=["111", " 222 "] * server.MAX_BARCODE_BATCH)
+        with patch.object(barcode_cache, "lookup_many", side_effect=lookup_many) as mocked:
+            response = asyncio.run(server.barcode_lookup_batch(request, {"role": "DRLP"}))
+            lines = asyncio.run(read(response))
+        assert mocked.call_args.args[1] == ["111", "222"]
+        assert len(lines) == 2
+
+
+class TestOfflineBarcodeIndex:
+    """Test the Open Food Facts dump importer and offline barcode index"""
+
+    FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+    def test_import_jsonl_dump(self, tmp_path):
+        """Test that a JSONL dump is indexed and looked up by barcode"""
+        from pathlib import Path
+        import import_off_dump
+        import barcode_index_service
+
+        index_path = tmp_path / "index.bin"
+        stats = import_off_dump.import_dump(Path(self.FIXTURES) / "off_products_sample.jsonl", index_path)
+        assert stats["read"] == 6
+        assert stats["unique"] == 3
+
+        index = barcode_index_service.BarcodeIndex(index_path)
+        nutella = index.get("3017620422003")
+        assert nutella["name"] == "Nutella"
+        assert nutella["category"] == "Snacks & Candy"
+        assert nutella["weight"] == 0.88
+        # Last occurrence of a duplicated barcode wins
+        assert index.get("5449000000996")["name"] == "Coca-Cola Original Taste"
+        # Leading zeros are not significant
+        assert index.get("41196910759")["is_organic"] is True
+        assert index.get("0000000000000") is None
+        index.close()
+
+    def test_import_csv_dump(self, tmp_path):
+        """Test that the tab-separated CSV export is indexed"""
+        from pathlib import Path
+        import import_off_dump
+        import barcode_index_service
+
+        index_path = tmp_path / "index.bin"
+        import_off_dump.import_dump(Path(self.FIXTURES) / "off_products_sample.csv", index_path)
+
+        index = barcode_index_service.BarcodeIndex(index_path)
+        pepsi = index.get("0012000161155")
+        assert pepsi["category"] == "Beverages"
+        assert pepsi["image_url"] == "https://images.openfoodfacts.org/pepsi.jpg"
+        assert index.get("0070038640387")["is_organic"] is True
+        index.close()
+
+    def test_lookup_barcode_uses_offline_index(self, tmp_path):
+        """Test that lookup_barcode answers from the offline index without the network"""
+        import asyncio
+        from pathlib import Path
+        import import_off_dump
+        import barcode_index_service
+        import barcode_ocr_service
+
+        index_path = tmp_path / "index.bin"
+        import_off_dump.import_dump(Path(self.FIXTURES) / "off_products_sample.jsonl", index_path)
+
+        index = barcode_index_service.BarcodeIndex(index_path)
+        with patch.object(barcode_ocr_service, "get_barcode_index", return_value=index):
+            with patch.object(barcode_ocr_service, "get_http_client") as network:
+                result = asyncio.run(barcode_ocr_service.lookup_barcode("3017620422003"))
+        index.close()
+
+        assert result["success"] is True
+        assert result["source"] == "offline_index"
+        assert result["product"]["barcode"] == "3017620422003"
+        network.assert_not_called()
+
+
+class TestImageIngest:
+    """Test OCR image validation and upload preparation"""
+
+    def _jpeg_bytes(self, size=(3200, 2400)):
+        import io
+        from PIL import Image
+        output = io.BytesIO()
+        Image.new("RGB", size, (200, 30, 30)).save(output, format="JPEG")
+        return output.getvalue()
+
+    def test_validate_base64_image(self):
+        """Test that base64 images are checked from their header bytes"""
+        import base64
+        from image_ingest_service import validate_base64_image
+
+        encoded = base64.b64encode(self._jpeg_bytes((64, 64))).decode()
+        result = validate_base64_image("data:image/jpeg;base64," + encoded)
+        assert result["success"] is True
+        assert result["image_base64"] == encoded
+
+        gif = base64.b64encode(b"GIF89a" + b"\x00" * 200).decode()
+        assert "Unsupported" in validate_base64_image(gif)["error"]
+        assert validate_base64_image("abcd")["success"] is False
+
+    def test_ingest_upload_downscales(self):
+        """Test that uploads are rejected by type and bounded in resolution"""
+        import io
+        import asyncio
+        from starlette.datastructures import UploadFile
+        from image_ingest_service import ingest_upload, MAX_IMAGE_DIMENSION
+
+        data = self._jpeg_bytes()
+        prepared = asyncio.run(ingest_upload(UploadFile(io.BytesIO(data), size=len(data), filename="shelf.jpg")))
+        assert prepared["success"] is True
+        assert max(prepared["width"], prepared["height"]) == MAX_IMAGE_DIMENSION
+        assert prepared["original_bytes"] == len(data)
+
+        text = b"not an image at all " * 10
+        rejected = asyncio.run(ingest_upload(UploadFile(io.BytesIO(text), size=len(text), filename="notes.txt")))
+        assert rejected["status_code"] == 415
+
+
+    def test_upload_body_capped_while_streaming(self):
+        """Test 413 from Content-Length up front, and mid-stream for chunked bodies"""
+        import asyncio
+        from fastapi import FastAPI, UploadFile, File
+        from image_ingest_service import UploadSizeLimitMiddleware
+
+        app = FastAPI()
+        spooled = []
+
+        @app.post("/ocr/upload")
+        async def upload(image: UploadFile = File(...)):
+            spooled.append(image.filename)
+            return {"ok": True}
+
+        limited = UploadSizeLimitMiddleware(app, max_body_bytes=1000)
+        chunk = b"--b\r\nContent-Disposition: form-data; name=\"image\"; filename=\"a.jpg\"\r\n\r\n" + b"x" * 400
+
+        def call(headers, chunks):
+            messages = [{"type": "http.request", "body": c, "more_body": i < len(chunks) - 1} for i, c in enumerate(chunks)]
+            pulled = []
+            sent = []
+
+            async def receive():
+                pulled.append(1)
+                return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {
+                "type": "http", "method": "POST", "path": "/ocr/upload", "root_path": "", "query_string": b"",
+                "headers": [(b"content-type", b"multipart/form-data; boundary=b")] + headers,
+            }
+            asyncio.run(limited(scope, receive, send))
+            return sent[0]["status"], len(pulled)
+
+        assert call([(b"content-length", b"5000")], [chunk]) == (413, 0)
+        status, pulled = call([], [chunk, b"x" * 400, b"x" * 400, b"x" * 400, b"x" * 400])
+        assert (status, pulled) == (413, 3)
+        assert spooled == []
+
+class TestOCRResultCache:
+    """Test the content-hash cache for vision model results"""
+
+    def test_repeat_image_served_from_cache(self):
+        """Test that re-submitting the same image skips the model, and failures are not cached"""
+        import asyncio
+        import base64
+        from unittest.mock import AsyncMock
+        from ocr_cache_service import OCRResultCache, KIND_PRICE
+
+        db = MagicMock()
+        db.ocr_results.find_one = AsyncMock(return_value=None)
+        db.ocr_results.update_one = AsyncMock()
+        image = base64.b64encode(b"\x89PNG\r\n\x1a\n" + b"\x00" * 200).decode()
+        model = AsyncMock(return_value={"success": True, "extracted": {"price": "1.99"}})
+        failing = AsyncMock(return_value={"success": False, "error": "timeout"})
+
+        async def submit():
+            cache = OCRResultCache()
+            first = await cache.get_or_analyze(db, KIND_PRICE, image, model)
+            second = await cache.get_or_analyze(db, KIND_PRICE, "data:image/png;base64," + image, model)
+            other_prompt = await cache.get_or_analyze(db, KIND_PRICE, image, model, prompt="Name only")
+            await cache.get_or_analyze(db, "analyze_product", image, failing)
+            await cache.get_or_analyze(db, "analyze_product", image, failing)
+            return cache, first, second, other_prompt
+
+        cache, first, second, other_prompt = asyncio.run(submit())
+        assert first["cached"] is False
+        assert second["cached"] is True
+        assert other_prompt["cached"] is False
+        assert model.await_count == 2
+        assert model.await_args[0][0] == image
+        assert failing.await_count == 2
+        assert cache.get_stats()["memory_hits"] == 1
+
+
+class TestLLMGateway:
+    """Test the LLM gateway's retries, circuit breaker and concurrency limit"""
+
+    def test_retries_then_succeeds(self):
+        """Test that a transient provider error is retried"""
+        import asyncio
+        import llm_gateway_service
+
+        calls = []
+
+        async def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                raise ConnectionError("reset")
+            return "Dairy & Eggs"
+
+        gateway = llm_gateway_service.LLMGateway()
+        with patch.object(llm_gateway_service, "BACKOFF_BASE", 0.001):
+            result = asyncio.run(gateway.call("test-model", flaky))
+        assert result == "Dairy & Eggs"
+        assert len(calls) == 2
+
+    def test_circuit_opens_and_fails_fast(self):
+        """Test that a failing provider trips the breaker and later calls are rejected"""
+        import asyncio
+        import llm_gateway_service
+
+        calls = []
+
+        async def broken():
+            calls.append(1)
+            raise TimeoutError("provider down")
+
+        async def run():
+            gateway = llm_gateway_service.LLMGateway()
+            for _ in range(llm_gateway_service.BREAKER_MIN_CALLS):
+                with pytest.raises(TimeoutError):
+                    await gateway.call("test-model", broken, retries=0)
+            with pytest.raises(llm_gateway_service.LLMUnavailableError):
+                await gateway.call("test-model", broken, retries=0)
+            return gateway
+
+        gateway = asyncio.run(run())
+        assert len(calls) == llm_gateway_service.BREAKER_MIN_CALLS
+        assert gateway.get_stats()["test-model"]["circuit"]["state"] == "open"
+
+    def test_concurrency_limit_and_deadline(self):
+        """Test that calls queue behind the per-model limit and give up at the deadline"""
+        import asyncio
+        import llm_gateway_service
+
+        async def slow():
+            await asyncio.sleep(0.2)
+            return "ok"
+
+        async def run():
+            gateway = llm_gateway_service.LLMGateway(max_concurrency=1)
+            first = asyncio.create_task(gateway.call("test-model", slow))
+            await asyncio.sleep(0)
+            with llm_gateway_service.llm_deadline(0.05):
+                with pytest.raises(llm_gateway_service.LLMUnavailableError):
+                    await gateway.call("test-model", slow)
+            return await first
+
+        assert asyncio.run(run()) == "ok"
+
+    def test_cancelled_half_open_probe_is_released(self):
+        """Test that cancelling the probe call does not leave the breaker wedged"""
+        import asyncio
+        import llm_gateway_service
+
+        async def hang():
+            await asyncio.sleep(3600)
+
+        async def ok():
+            return "ok"
+
+        async def run():
+            gateway = llm_gateway_service.LLMGateway()
+            breaker = gateway.breaker("test-model")
+            breaker._open()
+            breaker.opened_at -= llm_gateway_service.BREAKER_COOLDOWN
+            probe = asyncio.create_task(gateway.call("test-model", hang))
+            await asyncio.sleep(0.01)
+            assert breaker.probe_in_flight
+            probe.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await probe
+            assert not breaker.probe_in_flight
+            return await gateway.call("test-model", ok), breaker.state
+
+        assert asyncio.run(run()) == ("ok", "closed")
+
+    def test_deadline_timeout_not_counted_against_breaker(self):
+        """Test that a call clipped by the request deadline is not a provider failure"""
+        import asyncio
+        import llm_gateway_service
+
+        async def slow():
+            await asyncio.sleep(0.2)
+
+        async def run():
+            gateway = llm_gateway_service.LLMGateway()
+            with llm_gateway_service.llm_deadline(0.02):
+                with pytest.raises(llm_gateway_service.LLMUnavailableError):
+                    await gateway.call("test-model", slow)
+            return gateway.get_stats()["test-model"]["circuit"]
+
+        circuit = asyncio.run(run())
+        assert (circuit["recent_calls"], circuit["recent_failures"]) == (0, 0)
+
+
+class AsyncCursor:
+    """Minimal stand-in for a Motor cursor: async iteration over fixed documents"""
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+
+    def __aiter__(self):
+        self._iter = iter(self.documents)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class TestAutoAddFavorites:
+    """Test the incremental auto-add favorites job"""
+
+    def test_purchase_day_update_prunes_window(self):
+        """Test that the counter upsert keeps only days inside the 21-day window"""
+        from datetime import datetime, timezone
+        from purchase_days_service import purchase_day_update, epoch_day
+
+        purchased_at = datetime(2024, 3, 22, 18, 30, tzinfo=timezone.utc)
+        operation = purchase_day_update("dac-1", "Whole Milk", "r1", purchased_at)
+        stage = operation._doc[0]["$set"]
+        kept, added = stage["days"]["$setUnion"]
+        assert added == [epoch_day(purchased_at)]
+        assert kept["$filter"]["cond"] == {"$gt": ["$$this", epoch_day(purchased_at) - 21]}
+        assert operation._filter == {"dac_id": "dac-1", "item_name": "Whole Milk"}
+
+    def test_threshold_change_reprunes_counters(self):
+        """Test that a threshold change recounts stale counters against today's window"""
+        import asyncio
+        from datetime import datetime, timezone
+        from unittest.mock import AsyncMock
+        from purchase_days_service import reprune_purchase_days, epoch_day
+
+        now = datetime(2024, 4, 30, 12, 0, tzinfo=timezone.utc)
+        db = MagicMock()
+        db.purchase_days.update_many = AsyncMock()
+        asyncio.run(reprune_purchase_days(db, "dac-1", now))
+
+        query, pipeline = db.purchase_days.update_many.await_args[0]
+        assert query == {"dac_id": "dac-1"}
+        assert pipeline[0]["$set"]["days"]["$filter"]["cond"] == {"$gt": ["$$this", epoch_day(now) - 21]}
+        assert pipeline[0]["$set"]["changed_at"] == now
+        assert pipeline[1] == {"$set": {"day_count": {"$size": "$days"}}}
+
+    def test_checks_only_changed_counters(self):
+        """Test that qualifying changed counters in a shard are added per DAC threshold in one bulk write"""
+        import asyncio
+        from datetime import datetime, timezone
+        from unittest.mock import AsyncMock
+        from scheduler_service import auto_add_favorites_shard
+
+        from purchase_days_service import epoch_day
+
+        last_run = datetime(2024, 3, 21, 23, 0, tzinfo=timezone.utc)
+        today = epoch_day(datetime.now(timezone.utc))
+        days = lambda count: [today - i for i in range(count)]
+        db = MagicMock()
+        db.purchase_days.find.return_value.to_list = AsyncMock(return_value=[
+            {"dac_id": "a1", "item_name": "Whole Milk", "rshd_id": "r1", "days": days(3)},
+            {"dac_id": "a1", "item_name": "bread", "rshd_id": "r2", "days": days(5)},
+            {"dac_id": "a1", "item_name": "Old Cheese", "rshd_id": "r5", "days": [today - 30, today - 25, today - 22]},
+            {"dac_id": "a2", "item_name": "Eggs", "rshd_id": "r3", "days": days(4)},
+            {"dac_id": "a3", "item_name": "Apples", "rshd_id": "r4", "days": days(9)},
+        ])
+        db.users.find.side_effect = [
+            AsyncCursor([
+                {"id": "a1", "auto_favorite_threshold": 3},
+                {"id": "a2", "auto_favorite_threshold": 6},
+            ]),
+            # Not yet migrated: a1's legacy embedded favorites (dual read)
+            AsyncCursor([{"id": "a1", "favorite_items": [{"item_name": "Bread"}]}]),
+        ]
+        db.favorite_items.find.return_value = AsyncCursor([{"dac_id": "a2", "item_name_lower": "eggs"}])
+        db.rshd_items.find.return_value = AsyncCursor([
+            {"id": "r1", "category": "Dairy & Eggs"}, {"id": "r5", "category": "Dairy & Eggs"}
+        ])
+        db.favorite_items.bulk_write = AsyncMock()
+        db.resource_versions.bulk_write = AsyncMock()
+
+        stats = asyncio.run(auto_add_favorites_shard(db, "a", last_run))
+
+        counter_query = db.purchase_days.find.call_args[0][0]
+        assert counter_query["changed_at"] == {"$gte": last_run}
+        assert counter_query["dac_id"] == {"$gte": "a", "$lt": "b"}
+        operations = db.favorite_items.bulk_write.await_args[0][0]
+        assert len(operations) == 1
+        assert operations[0]._filter == {"dac_id": "a1", "item_name_lower": "whole milk"}
+        added = operations[0]._doc["$setOnInsert"]
+        assert added["item_name"] == "Whole Milk"
+        assert added["category"] == "Dairy & Eggs"
+        assert stats == {"changed_counters": 5, "items_added": 1, "dacs_updated": 1}
+
+    def test_sharded_run_resumes_unfinished_shards(self):
+        """Test that a resumed run only processes shards without a checkpoint"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        import job_runner_service
+
+        shards = {shard: {"status": "done", "stats": {"items_added": 1}} for shard in job_runner_service.SHARDS}
+        shards["7"] = {"status": "failed", "error": "connection reset"}
+        shards["c"] = {"status": "pending"}
+        db = MagicMock()
+        db.job_runs.find_one = AsyncMock(return_value={
+            "run_id": "run-1", "job_id": "auto_add_favorites", "status": "failed", "params": {}, "shards": shards
+        })
+        db.job_runs.update_one = AsyncMock()
+        processed = []
+
+        async def process_shard(shard, params):
+            processed.append(shard)
+            return {"items_added": 2}
+
+        run = asyncio.run(job_runner_service.run_sharded_job(db, "auto_add_favorites", process_shard))
+        assert sorted(processed) == ["7", "c"]
+        assert run["status"] == job_runner_service.RUN_COMPLETED
+        assert job_runner_service.summarize_run(run) == {"items_added": 18}
+
+    def test_run_abandoned_after_max_attempts(self):
+        """Test that a run which keeps failing is abandoned and a fresh run starts"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        import job_runner_service
+
+        shards = {shard: {"status": "done", "stats": {}} for shard in job_runner_service.SHARDS}
+        shards["7"] = {"status": "failed", "error": "bad document"}
+        db = MagicMock()
+        db.job_runs.find_one = AsyncMock(return_value={
+            "run_id": "run-1", "job_id": "auto_add_favorites", "status": "failed",
+            "attempts": job_runner_service.MAX_RUN_ATTEMPTS, "params": {"changed_since": "old"}, "shards": shards
+        })
+        db.job_runs.update_one = AsyncMock()
+        db.job_runs.insert_one = AsyncMock()
+        processed = []
+
+        async def process_shard(shard, params):
+            processed.append(shard)
+            return {}
+
+        async def prepare():
+            return {"changed_since": "new"}
+
+        run = asyncio.run(job_runner_service.run_sharded_job(db, "auto_add_favorites", process_shard, prepare))
+        abandon = db.job_runs.update_one.await_args_list[0].args
+        assert abandon[0] == {"run_id": "run-1"}
+        assert abandon[1]["$set"]["status"] == job_runner_service.RUN_ABANDONED
+        assert run["run_id"] != "run-1" and run["params"] == {"changed_since": "new"}
+        assert sorted(processed) == job_runner_service.SHARDS
+
+    def test_shards_cover_non_hex_ids(self):
+        """Test that every id, including legacy non-uuid ids, falls in exactly one shard"""
+        import job_runner_service
+
+        def matches(bounds, value):
+            return ("$gte" not in bounds or value >= bounds["$gte"]) and ("$lt" not in bounds or value < bounds["$lt"])
+
+        for dac_id in ["0abc", "f123", "-legacy", "DAC-42", "_x", "zeta", "~"]:
+            hits = [
+                shard for shard in job_runner_service.SHARDS
+                if matches(job_runner_service.shard_filter("dac_id", shard)["dac_id"], dac_id)
+            ]
+            assert len(hits) == 1, dac_id
+
+    def test_job_skipped_when_lock_held_elsewhere(self):
+        """Test that a second instance does not run the job while another holds the lease"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from pymongo.errors import DuplicateKeyError
+        import scheduler_service
+
+        db = MagicMock()
+        db.job_locks.find_one_and_update = AsyncMock(side_effect=DuplicateKeyError("E11000 duplicate key"))
+
+        with patch.object(scheduler_service, "_run_auto_add_favorites", AsyncMock()) as run:
+            asyncio.run(scheduler_service.process_auto_add_favorites(db))
+        run.assert_not_awaited()
+
+    def test_lock_released_after_run(self):
+        """Test that the holder runs the job and releases its lease afterwards"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        import scheduler_service
+        from job_lock_service import INSTANCE_ID
+
+        db = MagicMock()
+        db.job_locks.find_one_and_update = AsyncMock(return_value=None)
+        db.job_locks.delete_one = AsyncMock()
+
+        with patch.object(scheduler_service, "_run_auto_add_favorites", AsyncMock()) as run:
+            asyncio.run(scheduler_service.process_auto_add_favorites(db))
+        run.assert_awaited_once_with(db, False, INSTANCE_ID)
+        db.job_locks.delete_one.assert_awaited_once_with({"_id": "auto_add_favorites", "owner": INSTANCE_ID})
+
+
+class TestExpirySweep:
+    """Test RSHD item expiry parsing and the sweeper"""
+
+    def test_parse_expiry_date(self):
+        """Test that date-only expiries run through the end of the day (UTC)"""
+        from datetime import datetime, timezone
+        from expiry_service import parse_expiry_date
+
+        assert parse_expiry_date("2024-03-25") == datetime(2024, 3, 26, tzinfo=timezone.utc)
+        assert parse_expiry_date("2024-03-25T18:00:00Z") == datetime(2024, 3, 25, 18, tzinfo=timezone.utc)
+        assert parse_expiry_date("") is None
+        assert parse_expiry_date(datetime(2024, 3, 25, 18)) == datetime(2024, 3, 25, 18, tzinfo=timezone.utc)
+        with pytest.raises(ValueError):
+            parse_expiry_date("next tuesday")
+
+    def test_sweep_flips_expired_items_and_records_run(self):
+        """Test that one bulk update expires items and the sweep is recorded"""
+        import asyncio
+        from datetime import datetime, timezone
+        from unittest.mock import AsyncMock
+        from expiry_service import sweep_expired_items
+
+        db = MagicMock()
+        db.rshd_items.find.return_value = AsyncCursor([
+            {"id": "legacy-1", "expiry_date": "2024-01-01"},
+            {"id": "legacy-2", "expiry_date": "soon"},
+            {"id": "legacy-3", "expiry_date": datetime(2024, 1, 1)},
+            {"id": "legacy-4", "expiry_date": 20240101},
+        ])
+        db.rshd_items.bulk_write = AsyncMock()
+        db.rshd_items.update_many = AsyncMock(return_value=MagicMock(modified_count=4))
+        db.job_runs.insert_one = AsyncMock()
+        db.resource_versions.bulk_write = AsyncMock()
+
+        stats = asyncio.run(sweep_expired_items(db))
+
+        assert stats == {"expired": 4, "legacy_backfilled": 4}
+        query, update = db.rshd_items.update_many.await_args[0]
+        assert query["status"] == "available"
+        assert "$lte" in query["expires_at"]
+        assert update["$set"]["status"] == "expired"
+        backfill = db.rshd_items.bulk_write.await_args[0][0]
+        assert backfill[1]._doc == {"$set": {"expires_at": None}}
+        assert backfill[2]._doc == {"$set": {"expires_at": datetime(2024, 1, 1, tzinfo=timezone.utc)}}
+        assert backfill[3]._doc == {"$set": {"expires_at": None}}
+        assert db.job_runs.insert_one.await_args[0][0]["stats"] == stats
+
+
+class TestLiveRetailers:
+    """Test the live-retailer set and retailer_live flag sync"""
+
+    def test_is_retailer_live(self):
+        """Test that legacy retailers are live and suspended accounts are not"""
+        from live_retailer_service import is_retailer_live
+
+        assert is_retailer_live({"store_status": "live"}) is True
+        assert is_retailer_live({}) is True
+        assert is_retailer_live({"store_status": "sandbox"}) is False
+        assert is_retailer_live({"store_status": "live", "account_status": "suspended"}) is False
+
+    def test_sync_flags_items_and_refreshes_set(self):
+        """Test that a status transition re-flags the retailer's items and refreshes the cache"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        import live_retailer_service
+
+        db = MagicMock()
+        db.users.find_one = AsyncMock(return_value={"store_status": "live"})
+        db.users.find.return_value.to_list = AsyncMock(return_value=[{"id": "drlp-1"}, {"id": "drlp-2"}])
+        db.rshd_items.update_many = AsyncMock()
+        db.resource_versions.bulk_write = AsyncMock()
+
+        cache = live_retailer_service.LiveRetailerSet()
+        with patch.object(live_retailer_service, "live_retailers", cache):
+            live = asyncio.run(live_retailer_service.sync_retailer_live(db, "drlp-1"))
+
+        assert live is True
+        db.rshd_items.update_many.assert_awaited_once_with(
+            {"drlp_id": "drlp-1", "retailer_live": {"$ne": True}},
+            {"$set": {"retailer_live": True}}
+        )
+        assert asyncio.run(cache.get(db)) == frozenset({"drlp-1", "drlp-2"})
+        assert cache.refreshes == 1
+
+
+class TestItemUpdate:
+    """Test the field allow-list on PUT /rshd/items/{id}"""
+
+    DRLP = {"id": "drlp-1", "role": "DRLP"}
+
+    def _update(self, payload):
+        import asyncio
+        from unittest.mock import AsyncMock
+        import server
+
+        db = MagicMock()
+        db.rshd_items.find_one = AsyncMock(return_value={
+            "name": "Whole Milk", "attributes": {}, "regular_price": 4.0, "discount_level": 1
+        })
+        db.rshd_items.update_one = AsyncMock(return_value=MagicMock(modified_count=1))
+        db.resource_versions.bulk_write = AsyncMock()
+        with patch.object(server, "db", db):
+            asyncio.run(server.update_rshd_item("item-1", payload, self.DRLP))
+        return db.rshd_items.update_one.await_args[0][1]["$set"]
+
+    def test_server_owned_fields_are_dropped(self):
+        """Test that a DRLP cannot set the go-live flag or status through an update"""
+        update = self._update({"quantity": 3, "retailer_live": True, "status": "available", "holds": []})
+        assert update == {"quantity": 3}
+
+    def test_client_match_keys_ignored(self):
+        """Test that match_keys are only ever derived from name and attributes"""
+        from categorization_service import build_match_keys
+
+        update = self._update({"quantity": 3, "match_keys": {"tokens": ["anything"]}})
+        assert "match_keys" not in update
+
+        update = self._update({"name": "Organic 2% Milk", "match_keys": {"tokens": ["anything"]}})
+        assert update["match_keys"] == build_match_keys("Organic 2% Milk", {})
+
+    def test_unknown_fields_rejected_and_prices_rederived(self):
+        """Test 400 for fields outside the allow-list and deal_price recomputation"""
+        from fastapi import HTTPException
+
+        with pytest.raises(HTTPException) as exc:
+            self._update({"quantity": 3, "featured": True})
+        assert exc.value.status_code == 400
+
+        update = self._update({"regular_price": 10.0, "deal_price": 0.01})
+        assert update["deal_price"] == 5.0 and update["consumer_discount_percent"] == 50.0
+
+
+    def test_expiry_date_validated_like_create(self):
+        """Test 400 for a non-string or past expiry_date, and expires_at derivation"""
+        from fastapi import HTTPException
+
+        for expiry_date in (20240325, "2020-01-01", "soon"):
+            with pytest.raises(HTTPException) as exc:
+                self._update({"expiry_date": expiry_date})
+            assert exc.value.status_code == 400
+
+        update = self._update({"expiry_date": "2999-01-01", "expires_at": None})
+        assert update["expires_at"].year == 2999
+
+class TestDealFeed:
+    """Test the geo-scoped, keyset-paginated deal feed"""
+
+    RETAILERS = [
+        {"drlp_id": "far", "distance": 4.2},
+        {"drlp_id": "near", "distance": 0.8},
+        {"drlp_id": "removed", "distance": 0.1, "manually_removed": True},
+        {"drlp_id": "sandbox", "distance": 1.0},
+    ]
+
+    def _db(self, items):
+        from unittest.mock import AsyncMock
+        db = MagicMock()
+        db.dacdrlp_list.find_one = AsyncMock(return_value={"retailers": self.RETAILERS})
+        db.rshd_items.find.side_effect = lambda *args: AsyncCursor(items)
+        return db
+
+    def _page(self, db, **kwargs):
+        import asyncio
+        import feed_service
+        from feed_cache_service import DRLPFeedCache
+
+        cache = DRLPFeedCache()
+
+        async def run():
+            with patch.object(feed_service.live_retailers, "get", return_value=frozenset({"far", "near", "removed"})), \
+                    patch.object(feed_service, "feed_cache", cache):
+                return await feed_service.get_feed_page(db, "dac-1", **kwargs)
+
+        return asyncio.run(run()), cache
+
+    def test_feed_scoped_to_live_dacdrlp_retailers(self):
+        """Test that the feed only covers the DAC's live retailers and pages by keyset"""
+        import feed_service
+
+        items = [
+            {"id": f"item-{i}", "drlp_id": "near", "category": "Fruits", "discount_level": 2,
+             "posted_at": f"2024-03-2{9 - i}T10:00:00+00:00"}
+            for i in range(3)
+        ]
+        db = self._db(items)
+
+        page, _ = self._page(db, limit=2)
+        query = db.rshd_items.find.call_args[0][0]
+        assert query["drlp_id"] == {"$in": ["near", "far"]}
+        assert [item["id"] for item in page["items"]] == ["item-0", "item-1"]
+        assert page["items"][0]["distance"] == 0.8
+
+        after = feed_service.decode_cursor(page["next_cursor"], "newest")
+        assert (after["p"], after["i"]) == (items[1]["posted_at"], "item-1")
+        with pytest.raises(feed_service.InvalidCursorError):
+            feed_service.decode_cursor(page["next_cursor"], "distance")
+
+        next_page, _ = self._page(db, limit=2, cursor=page["next_cursor"])
+        assert [item["id"] for item in next_page["items"]] == ["item-2"]
+        assert next_page["next_cursor"] is None
+
+    def test_feed_merges_stores_and_filters_at_read_time(self):
+        """Test the k-way merge across stores and read-time category/expiry filtering"""
+        from datetime import datetime, timezone, timedelta
+
+        past = datetime.now(timezone.utc) - timedelta(hours=1)
+        items = [
+            {"id": "n1", "drlp_id": "near", "category": "Fruits", "discount_level": 1, "posted_at": "2024-03-29"},
+            {"id": "f1", "drlp_id": "far", "category": "Fruits", "discount_level": 3, "posted_at": "2024-03-28"},
+            {"id": "n2", "drlp_id": "near", "category": "Dairy", "discount_level": 2, "posted_at": "2024-03-27"},
+            {"id": "f2", "drlp_id": "far", "category": "Fruits", "discount_level": 2, "posted_at": "2024-03-26",
+             "expires_at": past.replace(tzinfo=None)},
+        ]
+        db = self._db(items)
+
+        page, cache = self._page(db)
+        assert [item["id"] for item in page["items"]] == ["n1", "f1", "n2"]
+        assert cache.get_stats()["db_loads"] == 1
+
+        page, _ = self._page(db, category="Fruits", sort="distance")
+        assert [item["id"] for item in page["items"]] == ["n1", "f1"]
+        assert "expires_at" not in page["items"][0]
+
+    def test_feed_cache_hits_and_invalidation(self):
+        """Test that cached store lists are reused until invalidated"""
+        import asyncio
+        from feed_cache_service import DRLPFeedCache
+
+        db = self._db([{"id": "n1", "drlp_id": "near", "posted_at": "2024-03-29"}])
+        cache = DRLPFeedCache()
+
+        asyncio.run(cache.get_many(db, ["near", "far"]))
+        lists = asyncio.run(cache.get_many(db, ["near", "far"]))
+        assert lists["far"] == [] and [item["id"] for item in lists["near"]] == ["n1"]
+        assert db.rshd_items.find.call_count == 1
+
+        cache.invalidate("near")
+        asyncio.run(cache.get_many(db, ["near", "far"]))
+        assert db.rshd_items.find.call_args[0][0]["drlp_id"] == {"$in": ["near"]}
+        stats = cache.get_stats()
+        assert (stats["hits"], stats["misses"], stats["invalidations"]) == (3, 3, 1)
+
+
+class TestConditionalGet:
+    """Test ETag version stamps and If-None-Match handling"""
+
+    def _request(self, if_none_match=None):
+        from starlette.requests import Request
+        headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+        return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+    def test_matching_etag_returns_304(self):
+        """Test weak comparison, lists and wildcard in If-None-Match"""
+        from starlette.responses import Response
+        from etag_service import make_etag, conditional_response
+
+        etag = make_etag("favorites:dac-1", "v1")
+        assert etag == make_etag("favorites:dac-1", "v1")
+        assert etag != make_etag("favorites:dac-1", "v2")
+
+        response = Response()
+        assert conditional_response(self._request(), response, etag) is None
+        assert response.headers["etag"] == etag
+
+        opaque = etag.removeprefix("W/")
+        for header in (etag, opaque, f'"other", {etag}', "*"):
+            not_modified = conditional_response(self._request(header), Response(), etag)
+            assert not_modified.status_code == 304
+            assert not_modified.headers["etag"] == etag
+        assert conditional_response(self._request('W/"stale"'), Response(), etag) is None
+
+    def test_versions_default_and_bump(self):
+        """Test that unwritten resources are version "0" and bumps upsert fresh stamps"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from etag_service import get_versions, bump_versions
+
+        db = MagicMock()
+        db.resource_versions.find.return_value = AsyncCursor([{"key": "rshd_items", "version": "abc"}])
+        versions = asyncio.run(get_versions(db, ["rshd_items", "favorites:dac-1"]))
+        assert versions == {"rshd_items": "abc", "favorites:dac-1": "0"}
+
+        db.resource_versions.bulk_write = AsyncMock()
+        asyncio.run(bump_versions(db, "notifications:a", "notifications:b", "notifications:a"))
+        operations = db.resource_versions.bulk_write.await_args[0][0]
+        assert [op._filter["key"] for op in operations] == ["notifications:a", "notifications:b"]
+        assert operations[0]._doc["$set"]["version"] != operations[1]._doc["$set"]["version"]
+        assert all(op._upsert for op in operations)
+
+
+class TestResponseEncoding:
+    """Test trusted orjson responses and negotiated compression"""
+
+    def _call(self, app, accept_encoding="gzip"):
+        import asyncio
+        from response_service import CompressionMiddleware
+
+        scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+        messages = []
+
+        async def receive():
+            await asyncio.sleep(3600)  # Client never disconnects
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(CompressionMiddleware(app, minimum_size=100)(scope, receive, send))
+        return messages
+
+    def test_negotiate_encoding(self):
+        """Test q-values and wildcard handling in Accept-Encoding"""
+        from response_service import negotiate_encoding
+
+        assert negotiate_encoding("gzip, deflate") == "gzip"
+        assert negotiate_encoding("gzip;q=0, identity") is None
+        assert negotiate_encoding("*") == "br"
+        assert negotiate_encoding("gzip, br;q=0.5") == "br"
+        assert negotiate_encoding("") is None
+
+    def test_compresses_large_json_only(self):
+        """Test that bodies above the threshold are gzipped and small ones are left alone"""
+        import gzip
+        from fastapi.responses import ORJSONResponse
+
+        payload = [{"id": str(i), "name": "Organic Whole Milk"} for i in range(50)]
+        messages = self._call(ORJSONResponse(payload))
+        headers = dict(messages[0]["headers"])
+        assert headers[b"content-encoding"] == b"gzip"
+        assert headers[b"vary"] == b"Accept-Encoding"
+        body = gzip.decompress(messages[1]["body"])
+        assert body == ORJSONResponse(payload).body
+        assert int(headers[b"content-length"]) == len(messages[1]["body"])
+
+        messages = self._call(ORJSONResponse({"ok": True}))
+        assert b"content-encoding" not in dict(messages[0]["headers"])
+
+    def test_brotli_preferred_when_accepted(self):
+        """Test that br is chosen over gzip and round-trips"""
+        import brotli
+        from fastapi.responses import ORJSONResponse
+
+        payload = [{"id": str(i), "name": "Organic Whole Milk"} for i in range(50)]
+        messages = self._call(ORJSONResponse(payload), accept_encoding="gzip, deflate, br")
+        headers = dict(messages[0]["headers"])
+        assert headers[b"content-encoding"] == b"br"
+        assert brotli.decompress(messages[1]["body"]) == ORJSONResponse(payload).body
+        assert int(headers[b"content-length"]) == len(messages[1]["body"])
+
+    def test_streams_pass_through(self):
+        """Test that NDJSON streams are forwarded chunk by chunk, uncompressed"""
+        from starlette.responses import StreamingResponse
+
+        async def lines():
+            for i in range(3):
+                yield ("x" * 200 + "\n").encode()
+
+        messages = self._call(StreamingResponse(lines(), media_type="application/x-ndjson"))
+        assert b"content-encoding" not in dict(messages[0]["headers"])
+        assert [len(m.get("body", b"")) for m in messages[1:4]] == [201, 201, 201]
+
+    def test_trusted_json_fills_model_defaults(self):
+        """Test projection and default filling for trusted DB documents"""
+        import json
+        from starlette.responses import Response
+        from server import Notification
+        from response_service import model_projection, trusted_json
+
+        projection = model_projection(Notification)
+        assert projection["_id"] == 0 and projection["read"] == 1
+
+        injected = Response()
+        injected.headers["ETag"] = 'W/"v1"'
+        response = trusted_json(
+            [{"id": "n1", "dac_id": "d", "rshd_id": "r", "message": "m", "created_at": "2024-03-29"}],
+            Notification, injected
+        )
+        assert json.loads(response.body)[0]["read"] is False
+        assert response.headers["etag"] == 'W/"v1"'
+        assert response.headers["content-length"] == str(len(response.body))
+
+
+class TestInventoryReservation:
+    """Test conditional stock reservation for checkout"""
+
+    def _db(self, reserved_count):
+        from unittest.mock import AsyncMock
+        db = MagicMock()
+        db.inventory_holds.insert_one = AsyncMock()
+        db.inventory_holds.update_one = AsyncMock()
+        db.rshd_items.bulk_write = AsyncMock(side_effect=[
+            MagicMock(modified_count=reserved_count), MagicMock(modified_count=reserved_count)
+        ])
+        return db
+
+    def _lines(self):
+        from server import OrderItem
+        return [
+            OrderItem(rshd_id="milk", name="Milk", price=2.0, quantity=1),
+            OrderItem(rshd_id="eggs", name="Eggs", price=3.0, quantity=2),
+            OrderItem(rshd_id="milk", name="Milk", price=2.0, quantity=1),
+        ]
+
+    def test_reserve_is_conditional_and_merges_lines(self):
+        """Test that each item is decremented only if enough stock remains"""
+        import asyncio
+        from inventory_service import reserve_items
+
+        db = self._db(2)
+        result = asyncio.run(reserve_items(db, "order-1", "dac-1", self._lines()))
+
+        assert result == {"success": True}
+        operations = db.rshd_items.bulk_write.await_args_list[0][0][0]
+        milk = operations[0]
+        assert milk._filter["quantity"] == {"$gte": 2}
+        assert milk._doc == {"$inc": {"quantity": -2}, "$push": {"holds": "order-1"}}
+        assert db.inventory_holds.update_one.await_args[0][1] == {"$set": {"status": "reserved"}}
+
+    def test_partial_reservation_rolls_back(self):
+        """Test that losing the race for one item restores the others and reports it"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from inventory_service import reserve_items
+
+        db = self._db(1)
+        db.rshd_items.find.return_value.to_list = AsyncMock(return_value=[
+            {"id": "milk", "name": "Milk", "quantity": 5, "status": "available"},
+            {"id": "eggs", "name": "Eggs", "quantity": 1, "status": "available"},
+        ])
+        result = asyncio.run(reserve_items(db, "order-1", "dac-1", self._lines()))
+
+        assert result == {"success": False, "error": "Not enough stock for: Eggs"}
+        restore = db.rshd_items.bulk_write.await_args_list[1][0][0]
+        assert restore[1]._filter == {"id": "eggs", "holds": "order-1"}
+        assert restore[1]._doc == {"$inc": {"quantity": 2}, "$pull": {"holds": "order-1"}}
+
+    def test_release_is_idempotent(self):
+        """Test that a hold already committed or released is not restored twice"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from inventory_service import release_hold
+
+        db = MagicMock()
+        db.inventory_holds.find_one_and_update = AsyncMock(return_value=None)
+        assert asyncio.run(release_hold(db, "order-1")) is False
+        db.rshd_items.bulk_write.assert_not_called()
+
+    def test_commit_scoped_to_hold_items(self):
+        """Test that committing pulls the hold from its own items only, and fails once released"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from inventory_service import commit_hold
+
+        db = MagicMock()
+        db.inventory_holds.find_one_and_update = AsyncMock(side_effect=[
+            {"hold_id": "order-1", "items": [{"rshd_id": "milk", "quantity": 2}, {"rshd_id": "eggs", "quantity": 1}]},
+            None,
+        ])
+        db.rshd_items.update_many = AsyncMock()
+
+        assert asyncio.run(commit_hold(db, "order-1")) is True
+        db.rshd_items.update_many.assert_awaited_once_with(
+            {"id": {"$in": ["milk", "eggs"]}, "holds": "order-1"}, {"$pull": {"holds": "order-1"}}
+        )
+        assert asyncio.run(commit_hold(db, "order-1")) is False
+        assert db.rshd_items.update_many.await_count == 1
+
+    def test_inventory_change_invalidates_every_retailer(self):
+        """Test that a multi-retailer cart drops each retailer's cached feed"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        import inventory_service
+
+        db = MagicMock()
+        db.rshd_items.distinct = AsyncMock(return_value=["drlp-1", "drlp-2"])
+        db.resource_versions.bulk_write = AsyncMock()
+        cache = MagicMock()
+        with patch.object(inventory_service, "feed_cache", cache):
+            asyncio.run(inventory_service.inventory_changed(db, ["milk", "bread"]))
+
+        db.rshd_items.distinct.assert_awaited_once_with("drlp_id", {"id": {"$in": ["milk", "bread"]}})
+        cache.invalidate.assert_called_once_with("drlp-1", "drlp-2")
+
+
+class TestPayments:
+    """Test that Stripe calls run off the event loop with idempotency keys"""
+
+    def test_payment_intent_runs_in_executor_with_order_key(self):
+        """Test the call happens on the payment thread pool with the order's idempotency key"""
+        import asyncio
+        import threading
+        import payment_service
+
+        calls = {}
+
+        def fake_create(**kwargs):
+            calls.update(kwargs, thread=threading.current_thread().name)
+            return MagicMock(id="pi_123")
+
+        with patch.object(payment_service.stripe.PaymentIntent, "create", side_effect=fake_create):
+            intent = asyncio.run(payment_service.create_payment_intent("order-1", 1250, "pm_card"))
+
+        assert intent.id == "pi_123"
+        assert calls["amount"] == 1250 and calls["confirm"] is True
+        assert calls["idempotency_key"] == "order-order-1-payment"
+        assert calls["thread"].startswith("stripe")
+
+    def test_connection_errors_count_as_timeouts(self):
+        """Test that Stripe connection failures are re-raised and counted"""
+        import asyncio
+        import payment_service
+        import metrics_service
+
+        before = metrics_service.get_metrics_snapshot()["counters"].get("stripe.payment_intent.create.timeouts", 0)
+        error = payment_service.stripe.error.APIConnectionError("timed out")
+        with patch.object(payment_service.stripe.PaymentIntent, "create", side_effect=error):
+            with pytest.raises(payment_service.stripe.error.StripeError):
+                asyncio.run(payment_service.create_payment_intent("order-2", 100, "pm_card"))
+
+        after = metrics_service.get_metrics_snapshot()["counters"]["stripe.payment_intent.create.timeouts"]
+        assert after == before + 1
+
+    def test_expired_hold_refunds_and_fails_order(self):
+        """Test that a payment completing after its hold was released is refunded, not confirmed"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from fastapi import HTTPException
+        import server
+        import inventory_service
+        import payment_service
+
+        db = MagicMock()
+        db.users.find_one = AsyncMock(return_value={"id": "dac-1", "role": "DAC", "account_status": "active"})
+        db.rshd_items.find_one = AsyncMock(return_value={"id": "milk", "drlp_id": "drlp-1", "drlp_name": "Store"})
+        db.orders.insert_one = AsyncMock()
+        order = server.OrderCreate(
+            items=[server.OrderItem(rshd_id="milk", name="Milk", price=2.0, quantity=1)],
+            delivery_method="pickup", payment_method_id="pm_card"
+        )
+
+        with patch.object(server, "db", db), \
+                patch.object(inventory_service, "reserve_items", AsyncMock(return_value={"success": True})), \
+                patch.object(inventory_service, "commit_hold", AsyncMock(return_value=False)), \
+                patch.object(payment_service, "create_payment_intent", AsyncMock(return_value=MagicMock(id="pi_1"))), \
+                patch.object(payment_service, "refund_payment_intent", AsyncMock()) as refund:
+            with pytest.raises(HTTPException) as exc:
+                asyncio.run(server.create_order(order, {"id": "dac-1", "role": "DAC", "name": "Ann"}))
+
+        assert exc.value.status_code == 409
+        order_id = refund.await_args[0][0]
+        refund.assert_awaited_once_with(order_id, "pi_1")
+        db.orders.insert_one.assert_not_awaited()
+
+
+class TestPasswordHashing:
+    """Test that bcrypt runs on the password thread pool"""
+
+    def test_hash_and_verify_off_loop(self):
+        """Test round trip, worker thread and latency metrics"""
+        import asyncio
+        import threading
+        import password_service
+        import metrics_service
+
+        threads = []
+        metric_threads = []
+        original = password_service.pwd_context.verify
+        original_observe = metrics_service.observe
+
+        def spy(*args):
+            threads.append(threading.current_thread().name)
+            return original(*args)
+
+        def observe_spy(*args):
+            metric_threads.append(threading.current_thread().name)
+            return original_observe(*args)
+
+        async def round_trip():
+            hashed = await password_service.hash_password("Secret123!")
+            with patch.object(password_service.pwd_context, "verify", side_effect=spy):
+                return hashed, await password_service.verify_password("Secret123!", hashed), \
+                    await password_service.verify_password("wrong", hashed)
+
+        with patch.object(metrics_service, "observe", side_effect=observe_spy):
+            hashed, good, bad = asyncio.run(round_trip())
+        assert hashed.startswith("$2b$")
+        assert (good, bad) == (True, False)
+        assert all(name.startswith("bcrypt") for name in threads)
+        # metrics_service is unguarded, so nothing is recorded from the worker threads
+        assert metric_threads and not any(name.startswith("bcrypt") for name in metric_threads)
+        latency = metrics_service.get_metrics_snapshot()["latency"]
+        assert "auth.password_hash" in latency and "auth.password_verify.queue_wait" in latency
+
+
+class TestUserPrincipalCache:
+    """Test the authenticated-user cache behind get_current_user"""
+
+    def test_caches_slim_principal_until_invalidated(self):
+        """Test projection, hit counting, copy-on-read and invalidation"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from user_cache_service import UserPrincipalCache, PRINCIPAL_PROJECTION
+
+        db = MagicMock()
+        db.users.find_one = AsyncMock(return_value={"id": "u1", "role": "DAC", "name": "Ann"})
+        cache = UserPrincipalCache()
+
+        first = asyncio.run(cache.get(db, "u1"))
+        first["role"] = "Admin"
+        second = asyncio.run(cache.get(db, "u1"))
+        assert second["role"] == "DAC"
+        db.users.find_one.assert_awaited_once_with({"id": "u1"}, PRINCIPAL_PROJECTION)
+        assert PRINCIPAL_PROJECTION["password_hash"] == 0 and PRINCIPAL_PROJECTION["favorite_items"] == 0
+
+        cache.invalidate("u1")
+        asyncio.run(cache.get(db, "u1"))
+        assert db.users.find_one.await_count == 2
+        stats = cache.get_stats()
+        assert (stats["hits"], stats["misses"], stats["invalidations"]) == (1, 2, 1)
+
+    def test_get_fresh_bypasses_stale_entry(self):
+        """Test that status-sensitive reads see a suspension made on another worker"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from user_cache_service import UserPrincipalCache
+
+        db = MagicMock()
+        db.users.find_one = AsyncMock(side_effect=[
+            {"id": "r1", "role": "DRLP", "account_status": "active"},
+            {"id": "r1", "role": "DRLP", "account_status": "suspended"},
+        ])
+        cache = UserPrincipalCache()
+
+        assert asyncio.run(cache.get(db, "r1"))["account_status"] == "active"
+        assert asyncio.run(cache.get_fresh(db, "r1"))["account_status"] == "suspended"
+        assert asyncio.run(cache.get(db, "r1"))["account_status"] == "suspended"
+        assert cache.get_stats()["fresh_reads"] == 1
+
+    def test_unknown_user_not_cached(self):
+        """Test that a missing user is looked up again next time"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from user_cache_service import UserPrincipalCache
+
+        db = MagicMock()
+        db.users.find_one = AsyncMock(return_value=None)
+        cache = UserPrincipalCache()
+        assert asyncio.run(cache.get(db, "ghost")) is None
+        assert asyncio.run(cache.get(db, "ghost")) is None
+        assert db.users.find_one.await_count == 2
+
+
+class TestFavoritesCollection:
+    """Test favorites stored one document per item, with legacy dual read"""
+
+    def test_matching_reads_category_and_merges_legacy(self):
+        """Test that matching queries one category and merges unmigrated arrays"""
+        import asyncio
+        import favorites_service
+
+        db = MagicMock()
+        db.favorite_items.find.return_value.sort.return_value = AsyncCursor([
+            {"dac_id": "a1", "item_name": "Milk", "category": "Dairy & Eggs"},
+        ])
+        db.users.aggregate.return_value = AsyncCursor([{"id": "a2", "favorite_items": [
+            {"item_name": "Yogurt", "category": "Dairy & Eggs"},
+        ]}])
+
+        with patch.object(favorites_service, "DUAL_READ", True):
+            favorites = asyncio.run(favorites_service.get_favorites_for_matching(db, ["a1", "a2"], "Dairy & Eggs"))
+
+        query = db.favorite_items.find.call_args[0][0]
+        assert query == {"dac_id": {"$in": ["a1", "a2"]}, "category": "Dairy & Eggs"}
+        pipeline = db.users.aggregate.call_args[0][0]
+        assert pipeline[0]["$match"]["favorite_items.category"] == "Dairy & Eggs"
+        assert pipeline[1]["$project"]["favorite_items"]["$filter"]["cond"] == {"$eq": ["$$fav.category", "Dairy & Eggs"]}
+        assert {dac: [f["item_name"] for f in favs] for dac, favs in favorites.items()} == {
+            "a1": ["Milk"], "a2": ["Yogurt"]
+        }
+
+    MISSING = object()
+
+    @classmethod
+    def _evaluate(cls, expression, variables):
+        """Evaluate the aggregation operators the matching query uses (MongoDB semantics for missing fields)"""
+        if isinstance(expression, list):
+            return [cls._evaluate(e, variables) for e in expression]
+        if isinstance(expression, str) and expression.startswith("$"):
+            name, *path = (expression[2:] if expression.startswith("$$") else "ROOT." + expression[1:]).split(".")
+            value = variables[name]
+            for key in path:
+                value = value.get(key, cls.MISSING) if isinstance(value, dict) else cls.MISSING
+            return value
+        if not isinstance(expression, dict):
+            return expression
+
+        (op, args), = expression.items()
+        if op == "$literal":
+            return args
+        if op == "$map":
+            items = cls._evaluate(args["input"], variables)
+            return [cls._evaluate(args["in"], {**variables, args["as"]: item}) for item in items]
+        if op == "$filter":
+            items = cls._evaluate(args["input"], variables)
+            return [item for item in items if cls._evaluate(args["cond"], {**variables, args["as"]: item})]
+        values = cls._evaluate(args, variables)
+        truthy = lambda v: v not in (False, None, 0) and v is not cls.MISSING
+        if op == "$and":
+            return all(truthy(v) for v in values)
+        if op == "$or":
+            return any(truthy(v) for v in values)
+        if op == "$eq":
+            return values[0] == values[1]
+        if op == "$ne":
+            return values[0] != values[1]
+        if op == "$gte":
+            return values[0] >= values[1]
+        if op == "$indexOfCP":
+            return values[0].find(values[1])
+        if op == "$ifNull":
+            return values[1] if values[0] is None or values[0] is cls.MISSING else values[0]
+        if op == "$anyElementTrue":
+            return any(truthy(v) for v in values[0])
+        raise AssertionError(f"Unsupported operator {op}")
+
+    def test_pushed_down_predicates_agree_with_python_rules(self):
+        """Test that $expr and $filter select exactly the favorites the Python rules match"""
+        import asyncio
+        import favorites_service
+
+        quaker = {"has_brand": True, "brand_keywords": ["quaker"], "generic_keywords": ["oatmeal"]}
+        milk = {"has_brand": False, "generic_keywords": ["milk"], "attributes": {"organic": False}}
+        organic_milk = {"has_brand": False, "generic_keywords": ["milk"], "attributes": {"organic": True}}
+        cases = [
+            # (favorite, item name, item organic, expected)
+            (quaker, "quaker instant oatmeal", False, True),  # Branded match
+            (quaker, "kirkland oatmeal", False, False),  # Brand mismatch
+            (quaker, "quaker granola", False, False),  # Brand without generic
+            (milk, "kirkland 2% milk", False, True),  # Generic-only, any brand
+            (milk, "kirkland greek yogurt", False, False),
+            (organic_milk, "kirkland 2% milk", False, False),  # Organic-only vs non-organic item
+            (organic_milk, "organic 2% milk", True, True),
+            (milk, "organic 2% milk", True, True),
+            (milk, "$5 milk", False, True),  # Names starting with "$" are literals, not field paths
+            (milk, "$$root milk", False, True),
+            ({}, "kirkland 2% milk", False, False),  # Missing keyword arrays
+            ({"generic_keywords": ["milk"]}, "kirkland 2% milk", False, True),  # Missing has_brand / attributes
+            ({"has_brand": True, "generic_keywords": ["milk"]}, "kirkland 2% milk", False, False),
+        ]
+
+        for favorite, item_name, item_organic, expected in cases:
+            favorite = {"item_name": "fav", "category": "Dairy & Eggs", **favorite}
+            db = MagicMock()
+            db.favorite_items.find.return_value.sort.return_value = AsyncCursor([])
+            db.users.aggregate.return_value = AsyncCursor([])
+            with patch.object(favorites_service, "DUAL_READ", True):
+                asyncio.run(favorites_service.get_favorites_for_matching(
+                    db, ["a1"], "Dairy & Eggs", item_name_lower=item_name, item_organic=item_organic
+                ))
+            expr = db.favorite_items.find.call_args[0][0]["$expr"]
+            project = db.users.aggregate.call_args[0][0][1]["$project"]
+
+            case = (favorite, item_name, item_organic)
+            assert favorites_service.favorite_matches(favorite, item_name, item_organic) is expected, case
+            assert self._evaluate(expr, {"ROOT": favorite}) is expected, case
+            legacy = self._evaluate(project["favorite_items"], {"ROOT": {"favorite_items": [favorite]}})
+            assert (legacy == [favorite]) is expected, case
+
+    def test_write_migrates_legacy_array_first(self):
+        """Test that a DAC's embedded favorites are moved before a new one is added"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from pymongo.errors import DuplicateKeyError
+        import favorites_service
+
+        legacy = [{"item_name": "Granola", "category": "Breakfast"}]
+        db = MagicMock()
+        db.users.find_one = AsyncMock(return_value={"favorite_items": legacy})
+        db.users.update_one = AsyncMock()
+        db.favorite_items.bulk_write = AsyncMock()
+        db.favorite_items.insert_one = AsyncMock(side_effect=[None, DuplicateKeyError("dup")])
+
+        with patch.object(favorites_service, "DUAL_READ", True):
+            added = asyncio.run(favorites_service.add_favorite(db, "a1", {"item_name": "Milk", "category": "Dairy & Eggs"}))
+            duplicate = asyncio.run(favorites_service.add_favorite(db, "a1", {"item_name": "milk", "category": "Dairy & Eggs"}))
+
+        assert (added, duplicate) == (True, False)
+        migrated = db.favorite_items.bulk_write.await_args_list[0][0][0]
+        assert migrated[0]._filter == {"dac_id": "a1", "item_name_lower": "granola"}
+        db.users.update_one.assert_any_await({"id": "a1", "favorite_items": legacy}, {"$unset": {"favorite_items": ""}})
+        inserted = db.favorite_items.insert_one.await_args_list[0][0][0]
+        assert inserted["dac_id"] == "a1" and inserted["item_name_lower"] == "milk"
+
+    def test_concurrent_migration_tolerates_duplicate_upserts(self):
+        """Test that losing the upsert race on the unique index is not an error"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from pymongo.errors import BulkWriteError
+        import favorites_service
+
+        def bulk_error(code):
+            return BulkWriteError({"writeErrors": [{"index": 0, "code": code, "errmsg": "E%d" % code}]})
+
+        db = MagicMock()
+        db.users.find_one = AsyncMock(return_value={"favorite_items": [{"item_name": "Granola", "category": "Breakfast"}]})
+        db.users.update_one = AsyncMock()
+        db.favorite_items.bulk_write = AsyncMock(side_effect=[bulk_error(11000), bulk_error(121)])
+
+        assert asyncio.run(favorites_service.migrate_user_favorites(db, "a1")) == 1
+        db.users.update_one.assert_awaited_once()
+        with pytest.raises(BulkWriteError):
+            asyncio.run(favorites_service.migrate_user_favorites(db, "a1"))
@@ -0,0 +1,78 @@
+"""
+Authenticated-User Cache for DealShaq
+- get_current_user resolves the JWT subject through a per-worker TTL LRU of slim
+  user principals instead of a users.find_one on every request
+- Principals omit password_hash and favorite_items; handlers needing those read them
+- Invalidated on this worker by profile, status, location, settings and password
+  writes; the short TTL bounds staleness from writes handled by other workers
+- Accepted window: a user suspended via another worker keeps a cached principal
+  there for up to ENTRY_TTL_SECONDS. Status-sensitive paths (item posting,
+  ordering, go-live) read the principal with get_fresh instead
+"""
+
+import logging
+from typing import Dict, Any, Optional
+
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+PRINCIPAL_PROJECTION = {"_id": 0, "password_hash": 0, "favorite_items": 0}
+MEMORY_CACHE_SIZE = 10000  # Users
+ENTRY_TTL_SECONDS = 30
+
+
+class UserPrincipalCache:
+    """Slim user documents keyed by user id."""
+
+    def __init__(self, maxsize: int = MEMORY_CACHE_SIZE, ttl_seconds: float = ENTRY_TTL_SECONDS):
+        self._memory: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "invalidations": 0,
+            "fresh_reads": 0,
+        }
+
+    async def get(self, db, user_id: str) -> Optional[Dict[str, Any]]:
+        user = self._memory.get(user_id)
+        if user is not None:
+            self.stats["hits"] += 1
+        else:
+            self.stats["misses"] += 1
+            user = await db.users.find_one({"id": user_id}, PRINCIPAL_PROJECTION)
+            if user is None:
+                return None
+            self._memory[user_id] = user
+        # Handlers get their own copy so a mutation can't leak into later requests
+        return dict(user)
+
+    async def get_fresh(self, db, user_id: str) -> Optional[Dict[str, Any]]:
+        """Read through to the database and refresh this worker's entry."""
+        self.stats["fresh_reads"] += 1
+        user = await db.users.find_one({"id": user_id}, PRINCIPAL_PROJECTION)
+        if user is None:
+            self._memory.pop(user_id, None)
+            return None
+        self._memory[user_id] = user
+        return dict(user)
+
+    def invalidate(self, *user_ids: str):
+        for user_id in user_ids:
+            if self._memory.pop(user_id, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self):
+        self._memory.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "memory_entries": len(self._memory),
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Global cache instance
+user_cache = UserPrincipalCache()
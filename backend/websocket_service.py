@@ -12,6 +12,8 @@ from fastapi import WebSocket, WebSocketDisconnect
 from jose import jwt, JWTError
 import os
 
+from etag_service import bump_versions, notifications_key
+
 logger = logging.getLogger(__name__)
 
 # JWT secret for token validation
@@ -212,6 +214,8 @@ async def notify_new_rshd(db, rshd_item: dict, drlp_id: str):
                 "created_at": datetime.now(timezone.utc).isoformat()
             })
         
+        await bump_versions(db, *(notifications_key(dac_id) for dac_id in dac_ids))
+        
         logger.info(f"RSHD notification sent to {len(dac_ids)} DACs ({len(connected_dacs)} online)")
         
     except Exception as e:
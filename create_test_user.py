@@ -45,7 +45,6 @@ async def create_test_dac():
         },
         "dacsai_radius": 5.0,
         "notification_prefs": {"email": True, "push": True, "sms": False},
-        "favorite_items": [],
         "auto_favorite_threshold": 0,
         "created_at": datetime.now(timezone.utc).isoformat()
     }